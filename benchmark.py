@@ -0,0 +1,656 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import embedding_store
+import layout_state
+import neighbor_index
+import pipeline_profile
+import projection
+import segment_cache
+import song_board
+import song_clusters
+import song_embedder
+import song_scanner
+
+
+def synthetic_song_names(n_songs):
+    for i in range(n_songs):
+        yield f"artist_{i % 997:03d}/track_{i:07d}.mp3"
+
+
+def synthetic_song_records(n_songs, seed=0):
+    # Deterministic stand-in for the records in song_embeddings.json
+    rng = random.Random(seed)
+    for name in synthetic_song_names(n_songs):
+        yield {"song_name": name, "x": rng.gauss(0, 10), "y": rng.gauss(0, 10)}
+
+
+def synthetic_embeddings(n_songs, dim, n_clusters=50, seed=0):
+    # Gaussian blobs around random centres, a rough stand-in for clustered transformer embeddings
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((n_clusters, dim)).astype(np.float32) * 4
+    vectors = np.empty((n_songs, dim), dtype=np.float32)
+    for start in range(0, n_songs, 65536):
+        block = vectors[start:start + 65536]
+        block[:] = rng.standard_normal(block.shape, dtype=np.float32)
+        block += centres[rng.integers(0, n_clusters, len(block))]
+    return vectors
+
+
+def _measure(target, kwargs):
+    baseline = pipeline_profile.peak_rss_mb()
+    start = time.perf_counter()
+    result = target(**kwargs) or {}
+    result.update(seconds=time.perf_counter() - start, baseline_rss_mb=baseline, peak_rss_mb=pipeline_profile.peak_rss_mb())
+    return result
+
+
+def run_isolated(target, **kwargs):
+    # Every measurement runs in a freshly spawned interpreter so peak RSS is not polluted by earlier runs
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_measure, (target, kwargs))
+
+
+def print_rows(rows, columns):
+    widths = [max(len(c), *(len(_format_cell(r.get(c))) for r in rows)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(_format_cell(row.get(c)).ljust(w) for c, w in zip(columns, widths)))
+
+
+def _format_cell(value):
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return "" if value is None else str(value)
+
+
+# --- HTML emission -------------------------------------------------------------------------------
+
+def _emit_string(n_songs, output_path):
+    # Reproduces the original build: materialise every record, double-escape it into one string, write once
+    records = list(synthetic_song_records(n_songs))
+    files = [r["song_name"] for r in records]
+    html = (song_board._PAGE_HEAD + "const boardConfig = {};\n"
+            + "const songData = JSON.parse(`" + json.dumps(json.dumps(records))[1:-1] + "`);\n"
+            + "const songFiles = JSON.parse(`" + json.dumps(json.dumps(files))[1:-1] + "`);\n"
+            + "const songGridIndex = null;\n"
+            + "const songNeighbors = null;\n"
+            + "const songClusters = null;\n"
+            + song_board._PAGE_TAIL)
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(html)
+    return {"bytes": os.path.getsize(output_path)}
+
+
+def _emit_stream(n_songs, output_path):
+    records = synthetic_song_records(n_songs)
+    with open(output_path, "w", encoding="utf-8") as f:
+        song_board.write_interactive_song_board(f, records, synthetic_song_names(n_songs))
+    return {"bytes": os.path.getsize(output_path)}
+
+
+def bench_emit(args):
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_songs in args.songs:
+            for mode, target in (("string", _emit_string), ("stream", _emit_stream)):
+                result = run_isolated(target, n_songs=n_songs, output_path=os.path.join(tmp, f"{mode}.html"))
+                rows.append({"songs": n_songs, "mode": mode, **result})
+    print_rows(rows, ["songs", "mode", "seconds", "baseline_rss_mb", "peak_rss_mb", "bytes"])
+
+
+# --- Binary sidecar ------------------------------------------------------------------------------
+
+def _directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def _parse_inline(html_path):
+    # Proxy for the browser's JSON.parse: the inline records are a JSON array literal, so json.loads does the same work
+    with open(html_path, encoding="utf-8") as f:
+        html = f.read()
+    start = html.index("const songData = [") + len("const songData = ")
+    end = html.index("];", start) + 1
+    begin = time.perf_counter()
+    records = json.loads(html[start:end])
+    return time.perf_counter() - begin, len(records)
+
+
+_SIDECAR_TYPECODES = {"x": "f", "y": "f", "z": "f", "cluster": "H", "names": "B", "name_offsets": "I",
+                      "order": "I", "offsets": "I", "label_level": "B"}
+
+
+def _parse_binary(data_dir):
+    # Mirrors the page: read each column and view it as a typed array, without decoding names up front
+    begin = time.perf_counter()
+    with open(os.path.join(data_dir, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    views = {}
+    for column, file_name in manifest["columns"].items():
+        with open(os.path.join(data_dir, file_name), "rb") as f:
+            buffer = memoryview(f.read())
+        views[column] = buffer.cast(_SIDECAR_TYPECODES[column])
+    return time.perf_counter() - begin, manifest["count"]
+
+
+def bench_sidecar(args):
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_songs in args.songs:
+            for data_format in ("inline", "binary"):
+                html_path = os.path.join(tmp, f"{data_format}_{n_songs}.html")
+                begin = time.perf_counter()
+                song_board.write_song_board(html_path, synthetic_song_records(n_songs), [], data_format)
+                write_seconds = time.perf_counter() - begin
+                total_bytes = os.path.getsize(html_path)
+                if data_format == "inline":
+                    parse_seconds, _ = _parse_inline(html_path)
+                else:
+                    data_dir = os.path.splitext(html_path)[0] + "_data"
+                    total_bytes += _directory_bytes(data_dir)
+                    parse_seconds, _ = _parse_binary(data_dir)
+                rows.append({"songs": n_songs, "format": data_format, "write_seconds": write_seconds,
+                             "parse_seconds": parse_seconds, "bytes": total_bytes, "bytes_per_song": total_bytes / n_songs})
+    print_rows(rows, ["songs", "format", "write_seconds", "parse_seconds", "bytes", "bytes_per_song"])
+
+
+# --- Tile pyramid --------------------------------------------------------------------------------
+
+def bench_tiles(args):
+    # Initial payload of a binary board (every column) vs. a tiled one, and the time to build the pyramid
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_songs in args.songs:
+            for data_format in ("binary", "tiles"):
+                html_path = os.path.join(tmp, f"{data_format}_{n_songs}.html")
+                begin = time.perf_counter()
+                song_board.write_song_board(html_path, synthetic_song_records(n_songs), [], data_format)
+                write_seconds = time.perf_counter() - begin
+                data_dir = os.path.splitext(html_path)[0] + "_data"
+                with open(os.path.join(data_dir, "manifest.json"), encoding="utf-8") as f:
+                    manifest = json.load(f)
+                row = {"songs": n_songs, "format": data_format, "write_seconds": write_seconds,
+                       "initial_bytes": song_board.board_output_bytes(html_path, data_format)["initial_bytes"]}
+                if data_format == "tiles":
+                    tiles_dir = os.path.join(data_dir, manifest["tiles"]["dir"])
+                    point_dir = os.path.join(tiles_dir, str(manifest["tiles"]["point_level"]))
+                    point_tiles = [os.path.getsize(os.path.join(point_dir, f)) for f in os.listdir(point_dir)]
+                    row.update(point_level=manifest["tiles"]["point_level"], tile_bytes=_directory_bytes(tiles_dir),
+                               max_point_tile_bytes=max(point_tiles))
+                rows.append(row)
+    print_rows(rows, ["songs", "format", "write_seconds", "initial_bytes", "point_level", "tile_bytes",
+                      "max_point_tile_bytes"])
+
+
+# --- Projection ----------------------------------------------------------------------------------
+
+def _project(n_songs, dim, method):
+    vectors = synthetic_embeddings(n_songs, dim)
+    begin = time.perf_counter()
+    projection.project_embeddings(vectors, method)
+    return {"project_seconds": time.perf_counter() - begin, "input_mb": vectors.nbytes / 2 ** 20}
+
+
+def bench_projection(args):
+    rows = []
+    for n_songs in args.songs:
+        for method in args.methods:
+            try:
+                result = run_isolated(_project, n_songs=n_songs, dim=args.dim, method=method)
+            except ImportError as e:
+                result = {"error": str(e)}
+            rows.append({"songs": n_songs, "dim": args.dim, "method": method, **result})
+    print_rows(rows, ["songs", "dim", "method", "project_seconds", "input_mb", "peak_rss_mb", "error"])
+
+
+# --- Incremental layout --------------------------------------------------------------------------
+
+def bench_incremental(args):
+    rows = []
+    vectors = synthetic_embeddings(args.songs + max(args.deltas), args.dim)
+    names = [f"track_{i:07d}" for i in range(len(vectors))]
+    # Libraries can hold the same file name twice (in different folders)
+    names[args.songs // 2] = names[0]
+    with tempfile.TemporaryDirectory() as state_dir:
+        begin = time.perf_counter()
+        layout_state.update_layout(state_dir, names[:args.songs], vectors[:args.songs], args.method)
+        rows.append({"songs": args.songs, "delta": args.songs, "mode": "full", "seconds": time.perf_counter() - begin})
+        for delta in args.deltas:
+            # Re-running on the same base plus `delta` new songs; the previous delta is dropped again
+            begin = time.perf_counter()
+            update = layout_state.update_layout(state_dir, names[:args.songs + delta], vectors[:args.songs + delta],
+                                                args.method)
+            rows.append({"songs": args.songs, "delta": len(update.changed), "mode": "incremental",
+                         "seconds": time.perf_counter() - begin})
+        # Re-running on unchanged songs must neither place nor add anything
+        slots = len(update.names)
+        begin = time.perf_counter()
+        update = layout_state.update_layout(state_dir, names[:args.songs + args.deltas[-1]],
+                                            vectors[:args.songs + args.deltas[-1]], args.method)
+        rows.append({"songs": args.songs, "delta": len(update.changed), "mode": "unchanged",
+                     "seconds": time.perf_counter() - begin})
+        if len(update.changed) or len(update.names) != slots:
+            raise RuntimeError(f"An unchanged rerun placed {len(update.changed)} songs and grew the layout from "
+                               f"{slots} to {len(update.names)} slots.")
+    print_rows(rows, ["songs", "delta", "mode", "seconds"])
+
+
+# --- Embedding store -----------------------------------------------------------------------------
+
+def _load_json(json_path):
+    with open(json_path, encoding="utf-8") as f:
+        records = json.load(f)
+    store = embedding_store.EmbeddingStore.from_records(records)
+    return {"songs": len(store)}
+
+
+def _load_store(store_path, scan):
+    store = embedding_store.EmbeddingStore.open(store_path)
+    if scan:
+        # Touch every vector once, e.g. what a projection pass does
+        store.vectors.sum(axis=0, dtype=np.float64)
+    return {"songs": len(store)}
+
+
+def bench_store(args):
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "song_embeddings.json")
+        store_path = os.path.join(tmp, "song_embeddings.store")
+        vectors = synthetic_embeddings(args.songs, args.dim)
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump([{"song_name": name, "embedding": vector}
+                       for name, vector in zip(synthetic_song_names(args.songs), vectors.tolist())], f)
+        del vectors
+        embedding_store.convert_json_to_store(json_path, store_path)
+        for mode, target, kwargs in (("json", _load_json, {"json_path": json_path}),
+                                     ("store", _load_store, {"store_path": store_path, "scan": False}),
+                                     ("store+scan", _load_store, {"store_path": store_path, "scan": True})):
+            rows.append({"mode": mode, "dim": args.dim, **run_isolated(target, **kwargs)})
+    print_rows(rows, ["mode", "songs", "dim", "seconds", "baseline_rss_mb", "peak_rss_mb"])
+
+
+# --- Similar songs index -------------------------------------------------------------------------
+
+def _recall(found, exact):
+    # Fraction of the exact top k that the approximate table also lists
+    return float(np.mean([len(set(a[a >= 0]) & set(b[b >= 0])) / max((b >= 0).sum(), 1) for a, b in zip(found, exact)]))
+
+
+def bench_neighbors(args):
+    rows = []
+    rng = np.random.default_rng(0)
+    for n_songs in args.songs:
+        vectors = synthetic_embeddings(n_songs, args.dim)
+        queries = np.sort(rng.choice(n_songs, min(args.queries, n_songs), replace=False))
+        # Brute-force cosine search is timed on the query sample only; it is O(n) per song
+        begin = time.perf_counter()
+        exact = neighbor_index.exact_neighbors(vectors, args.k, queries)
+        seconds = time.perf_counter() - begin
+        rows.append({"songs": n_songs, "backend": "brute force", "queries": len(queries), "seconds": seconds,
+                     "us_per_song": seconds / len(queries) * 1e6, "recall": 1.0})
+        for backend in args.backends:
+            begin = time.perf_counter()
+            try:
+                table = neighbor_index.song_neighbors(vectors, args.k, backend)
+            except ImportError as e:
+                print(f"Skipping {backend}: {e}")
+                continue
+            seconds = time.perf_counter() - begin
+            rows.append({"songs": n_songs, "backend": backend, "queries": n_songs, "seconds": seconds,
+                         "us_per_song": seconds / n_songs * 1e6, "recall": _recall(table[queries], exact)})
+    print_rows(rows, ["songs", "backend", "queries", "seconds", "us_per_song", "recall"])
+
+
+# --- Clustering ----------------------------------------------------------------------------------
+
+def _cluster_store(store_path, n_clusters, method):
+    labels = song_clusters.cluster_song_store(embedding_store.EmbeddingStore.open(store_path), n_clusters, method)
+    return {"clusters": len(np.unique(labels))}
+
+
+def bench_cluster(args):
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_songs in args.songs:
+            store_path = os.path.join(tmp, f"store_{n_songs}")
+            embedding_store.write_embedding_store(store_path, synthetic_song_names(n_songs),
+                                                  synthetic_embeddings(n_songs, args.dim))
+            for method in args.methods:
+                result = run_isolated(_cluster_store, store_path=store_path, n_clusters=args.clusters, method=method)
+                rows.append({"songs": n_songs, "method": method, "songs_per_sec": n_songs / result["seconds"], **result})
+    print_rows(rows, ["songs", "method", "clusters", "seconds", "songs_per_sec", "peak_rss_mb"])
+
+
+# --- Song embedding ------------------------------------------------------------------------------
+
+def _make_wav_songs(songs_dir, n_songs, min_seconds, max_seconds, sample_rate=22050):
+    # Stereo 16-bit noise at a CD-like rate, so decoding includes the downmix and the resampling to 8 kHz. Song
+    # lengths are uniform between min_seconds and max_seconds.
+    import wave
+    rng = np.random.default_rng(0)
+    os.makedirs(songs_dir)
+    song_files = []
+    for seconds in rng.integers(min_seconds, max_seconds + 1, n_songs):
+        song_files.append(f"track_{len(song_files):05d}.wav")
+        with wave.open(os.path.join(songs_dir, song_files[-1]), "wb") as f:
+            f.setnchannels(2)
+            f.setsampwidth(2)
+            f.setframerate(sample_rate)
+            f.writeframes((rng.standard_normal(int(seconds) * sample_rate * 2) * 3000).astype("<i2").tobytes())
+    return song_files
+
+
+def _small_segment_model(dim):
+    # Stand-in with the notebook model's shape, (songs, 100, 1, 30000) -> (songs, dim): a strided CNN per segment and
+    # a small transformer over the segments, exposing both stages for packed inference
+    import torch
+
+    class SegmentModel(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.cnn = torch.nn.Sequential(
+                torch.nn.Conv1d(1, 32, 64, stride=16), torch.nn.ReLU(),
+                torch.nn.Conv1d(32, 64, 16, stride=8), torch.nn.ReLU(),
+                torch.nn.AdaptiveAvgPool1d(1), torch.nn.Flatten(), torch.nn.Linear(64, dim))
+            layer = torch.nn.TransformerEncoderLayer(dim, nhead=8, dim_feedforward=2 * dim, batch_first=True)
+            self.transformer = torch.nn.TransformerEncoder(layer, num_layers=2)
+
+        def embed_segments(self, segments):
+            return self.cnn(segments)
+
+        def encode_sequence(self, features, padding_mask):
+            encoded = self.transformer(features, src_key_padding_mask=padding_mask)
+            keep = (~padding_mask).unsqueeze(-1).to(encoded.dtype)
+            return (encoded * keep).sum(dim=1) / keep.sum(dim=1)
+
+        def forward(self, x):
+            songs, segments = x.shape[:2]
+            features = self.embed_segments(x.flatten(0, 1)).view(songs, segments, -1)
+            return self.encode_sequence(features, torch.zeros(songs, segments, dtype=torch.bool))
+
+    return SegmentModel().eval()
+
+
+def bench_embed(args):
+    try:
+        import librosa  # noqa: F401
+        model = (song_embedder.load_embedding_model(args.model) if args.model else _small_segment_model(args.dim))
+    except ImportError as e:
+        print(f"The embed benchmark needs torch and librosa: {e}")
+        return
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        songs_dir = os.path.join(tmp, "songs")
+        song_files = _make_wav_songs(songs_dir, args.songs, *args.seconds)
+        paths = [os.path.join(songs_dir, song_file) for song_file in song_files]
+        for workers in args.workers:
+            begin = time.perf_counter()
+            for _ in song_embedder.iter_decoded_songs(paths, workers):
+                pass
+            seconds = time.perf_counter() - begin
+            rows.append({"stage": "decode", "workers": workers, "songs": len(paths), "seconds": seconds,
+                         "songs_per_sec": len(paths) / seconds})
+        # The first pass decodes into an empty segment cache, the second only hashes the files and maps the segments
+        cache = segment_cache.SegmentCache(os.path.join(tmp, "segment_cache"))
+        for stage in ("decode into cache", "segment cache hit"):
+            begin = time.perf_counter()
+            for _ in song_embedder.iter_decoded_songs(paths, args.workers[-1], cache):
+                pass
+            seconds = time.perf_counter() - begin
+            rows.append({"stage": stage, "workers": args.workers[-1], "songs": len(paths), "seconds": seconds,
+                         "songs_per_sec": len(paths) / seconds})
+        # Inference from the warm cache, padded to 100 segments per song and, if the model allows it, packed
+        for packed in (False, True) if song_embedder.is_packable(model) else (False,):
+            begin = time.perf_counter()
+            _, _, segments = song_embedder.embed_song_library(songs_dir, song_files, os.path.join(tmp, f"store_{packed}"),
+                                                              model, args.batch_size, args.workers[-1], cache, packed)
+            seconds = time.perf_counter() - begin
+            rows.append({"stage": "embed packed" if packed else "embed padded", "workers": args.workers[-1],
+                         "songs": len(paths), "seconds": seconds, "songs_per_sec": len(paths) / seconds,
+                         "cnn_segments": segments["segments"]})
+    print_rows(rows, ["stage", "workers", "songs", "seconds", "songs_per_sec", "cnn_segments"])
+
+
+# --- Song directory scan -------------------------------------------------------------------------
+
+def _make_song_tree(root, n_songs, per_directory):
+    # Artist/album style tree with per_directory files per leaf folder
+    for i in range(n_songs):
+        leaf = i // per_directory
+        directory = os.path.join(root, f"artist_{leaf // 10:05d}", f"album_{leaf % 10}")
+        if i % per_directory == 0:
+            os.makedirs(directory)
+        open(os.path.join(directory, f"track_{i:07d}.mp3"), "wb").close()
+
+
+def _walk_songs(root):
+    # The discovery loop song_board.py used before the scanner
+    songs = []
+    for _, _, files in os.walk(root):
+        songs.extend(file for file in files if file.endswith((".mp3", ".wav", ".ogg")))
+    return songs
+
+
+def bench_scan(args):
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, "songs")
+        index_path = os.path.join(tmp, "scan_index.json")
+        _make_song_tree(root, args.songs, args.per_directory)
+        for mode, target in (("os.walk", lambda: _walk_songs(root)),
+                             ("scan cold", lambda: song_scanner.scan_song_library(root, index_path, args.workers)),
+                             ("scan warm", lambda: song_scanner.scan_song_library(root, index_path, args.workers))):
+            begin = time.perf_counter()
+            found = target()
+            rows.append({"mode": mode, "songs": len(found), "seconds": time.perf_counter() - begin})
+    print_rows(rows, ["mode", "songs", "seconds"])
+
+
+# --- Whole pipeline ------------------------------------------------------------------------------
+
+_SONG_BOARD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "song_board.py")
+# Rows of two pipeline runs are compared on these; a lower value is always better
+_REGRESSION_METRICS = ("seconds", "peak_rss_mb", "bytes_per_song", "initial_bytes_per_song")
+# Timing differences below this many seconds are noise, whatever the ratio
+_REGRESSION_MIN_SECONDS = 0.05
+
+
+def _write_embeddings_json(json_path, names, vectors):
+    # Written record by record, so catalogues whose JSON would not fit in memory as Python objects can still be made
+    with open(json_path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for i, (name, vector) in enumerate(zip(names, vectors)):
+            f.write(("," if i else "") + json.dumps({"song_name": name, "embedding": vector.tolist()}))
+        f.write("]")
+
+
+def _run_profiled(profile_path, *arguments):
+    # Runs song_board.py in its own process, as a user would, and returns its --profile output
+    subprocess.run([sys.executable, _SONG_BOARD, "--profile", profile_path, *arguments], check=True,
+                   stdout=subprocess.DEVNULL, cwd=os.path.dirname(profile_path))
+    with open(profile_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _profile_rows(profile, **key):
+    rows = [{**key, **stage} for stage in profile["stages"]]
+    output = profile.get("output", {})
+    rows.append({**key, "stage": "total", "seconds": profile["seconds"], "peak_rss_mb": profile["peak_rss_mb"],
+                 "bytes_per_song": output.get("bytes_per_song"),
+                 "initial_bytes_per_song": output.get("initial_bytes_per_song")})
+    return rows
+
+
+def _regressions(rows, baseline_rows, tolerance):
+    # Rows whose metrics grew by more than the tolerance over the baseline run with the same key
+    def key(row):
+        return tuple(row.get(c) for c in ("songs", "dim", "input", "format", "stage"))
+
+    baseline = {key(row): row for row in baseline_rows}
+    found = []
+    for row in rows:
+        old = baseline.get(key(row))
+        if old is None:
+            continue
+        for metric in _REGRESSION_METRICS:
+            before, after = old.get(metric), row.get(metric)
+            if before is None or after is None or after <= before * (1 + tolerance):
+                continue
+            if metric == "seconds" and after - before < _REGRESSION_MIN_SECONDS:
+                continue
+            found.append({**{c: row.get(c) for c in ("songs", "dim", "input", "format", "stage")}, "metric": metric,
+                          "baseline": before, "current": after, "change": after / before - 1 if before else None})
+    return found
+
+
+def bench_pipeline(args):
+    # Every stage of the real command line on synthetic catalogues: an artist/album tree of empty audio files and
+    # embeddings named after them, loaded from song_embeddings.json or an embedding store. Store runs are clustered
+    # first with the cluster command, whose stages are reported as the "cluster" format.
+    rows = []
+    for n_songs in args.songs:
+        with tempfile.TemporaryDirectory() as tmp:
+            songs_dir = os.path.join(tmp, "songs")
+            _make_song_tree(songs_dir, n_songs, args.per_directory)
+            names = [f"track_{i:07d}.mp3" for i in range(n_songs)]
+            vectors = synthetic_embeddings(n_songs, args.dim)
+            inputs = {}
+            if "json" in args.inputs:
+                inputs["json"] = os.path.join(tmp, "song_embeddings.json")
+                _write_embeddings_json(inputs["json"], names, vectors)
+            if "store" in args.inputs:
+                inputs["store"] = os.path.join(tmp, "song_embeddings.store")
+                embedding_store.write_embedding_store(inputs["store"], names, vectors)
+            del vectors
+            clusters_path = os.path.join(tmp, "df_clusters.csv")
+            key = {"songs": n_songs, "dim": args.dim}
+            for input_format, input_path in inputs.items():
+                clusters = ""
+                if input_format == "store" and args.clusters > 0:
+                    profile = _run_profiled(os.path.join(tmp, "cluster_profile.json"), "--clusters", clusters_path,
+                                            "cluster", "--store", input_path, "--count", str(args.clusters))
+                    rows.extend(_profile_rows(profile, **key, input=input_format, format="cluster"))
+                    clusters = clusters_path
+                for data_format in args.formats:
+                    profile = _run_profiled(os.path.join(tmp, "profile.json"), "--input", input_path,
+                                            "--songs-dir", songs_dir, "--scan-index", "", "--clusters", clusters,
+                                            "--output", os.path.join(tmp, f"{input_format}_{data_format}.html"),
+                                            "--data-format", data_format, "--projection", args.projection,
+                                            "--neighbors", str(args.neighbors))
+                    rows.extend(_profile_rows(profile, **key, input=input_format, format=data_format))
+    print_rows(rows, ["songs", "dim", "input", "format", "stage", "seconds", "peak_rss_mb", "bytes_per_song",
+                      "initial_bytes_per_song"])
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = _regressions(rows, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regressions against {args.baseline}:")
+            print_rows(regressions, ["songs", "dim", "input", "format", "stage", "metric", "baseline", "current", "change"])
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the song board generator.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    emit_parser = subparsers.add_parser("emit", help="Peak RSS and wall time of the HTML string build vs. the streaming writer.")
+    emit_parser.add_argument("--songs", type=int, nargs="+", default=[10_000, 100_000, 300_000])
+    emit_parser.set_defaults(func=bench_emit)
+
+    sidecar_parser = subparsers.add_parser("sidecar", help="Output size and parse time of inline JSON vs. the binary sidecar.")
+    sidecar_parser.add_argument("--songs", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    sidecar_parser.set_defaults(func=bench_sidecar)
+
+    tiles_parser = subparsers.add_parser("tiles", help="Initial payload of the binary sidecar vs. the tile pyramid.")
+    tiles_parser.add_argument("--songs", type=int, nargs="+", default=[100_000, 1_000_000])
+    tiles_parser.set_defaults(func=bench_tiles)
+
+    projection_parser = subparsers.add_parser("projection", help="Time and peak RSS of the layout methods.")
+    projection_parser.add_argument("--songs", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    projection_parser.add_argument("--dim", type=int, default=1024, help="Embedding dimension (1M x 1024 float32 is 4 GB).")
+    projection_parser.add_argument("--methods", nargs="+", choices=projection.PROJECTION_METHODS, default=["pca", "rsvd"])
+    projection_parser.set_defaults(func=bench_projection)
+
+    incremental_parser = subparsers.add_parser("incremental", help="Full layout vs. placing a delta of new songs.")
+    incremental_parser.add_argument("--songs", type=int, default=100_000)
+    incremental_parser.add_argument("--deltas", type=int, nargs="+", default=[100, 1000, 10_000])
+    incremental_parser.add_argument("--dim", type=int, default=256)
+    incremental_parser.add_argument("--method", choices=projection.PROJECTION_METHODS, default="pca")
+    incremental_parser.set_defaults(func=bench_incremental)
+
+    store_parser = subparsers.add_parser("store", help="Load time and RSS of song_embeddings.json vs. the embedding store.")
+    store_parser.add_argument("--songs", type=int, default=20_000)
+    store_parser.add_argument("--dim", type=int, default=1024)
+    store_parser.set_defaults(func=bench_store)
+
+    neighbors_parser = subparsers.add_parser("neighbors", help="Recall and time per song of the similar songs index vs. brute force.")
+    neighbors_parser.add_argument("--songs", type=int, nargs="+", default=[20_000, 100_000])
+    neighbors_parser.add_argument("--dim", type=int, default=256)
+    neighbors_parser.add_argument("--k", type=int, default=neighbor_index.SIMILAR_SONGS)
+    neighbors_parser.add_argument("--queries", type=int, default=1000, help="Songs whose exact neighbours are computed for the recall.")
+    neighbors_parser.add_argument("--backends", nargs="+", choices=neighbor_index.NEIGHBOR_BACKENDS[2:],
+                                  default=["ivf", "faiss", "hnswlib"])
+    neighbors_parser.set_defaults(func=bench_neighbors)
+
+    cluster_parser = subparsers.add_parser("cluster", help="Time and peak RSS of clustering an embedding store.")
+    cluster_parser.add_argument("--songs", type=int, nargs="+", default=[100_000, 1_000_000])
+    cluster_parser.add_argument("--dim", type=int, default=256)
+    cluster_parser.add_argument("--clusters", type=int, default=song_clusters.CLUSTER_COUNT)
+    cluster_parser.add_argument("--methods", nargs="+", choices=song_clusters.CLUSTER_METHODS,
+                                default=list(song_clusters.CLUSTER_METHODS))
+    cluster_parser.set_defaults(func=bench_cluster)
+
+    embed_parser = subparsers.add_parser("embed", help="Songs/sec of decoding, the segment cache and padded vs. packed inference on CPU.")
+    embed_parser.add_argument("--songs", type=int, default=64)
+    embed_parser.add_argument("--seconds", type=int, nargs=2, default=[180, 240], metavar=("MIN", "MAX"),
+                              help="Length range of the synthetic songs.")
+    embed_parser.add_argument("--workers", type=int, nargs="+", default=[1, song_embedder.DECODE_WORKERS])
+    embed_parser.add_argument("--batch-size", type=int, default=song_embedder.EMBED_BATCH_SONGS)
+    embed_parser.add_argument("--model", help="Model file to benchmark instead of a small stand-in CNN.")
+    embed_parser.add_argument("--dim", type=int, default=1024, help="Output size of the stand-in CNN.")
+    embed_parser.set_defaults(func=bench_embed)
+
+    scan_parser = subparsers.add_parser("scan", help="os.walk vs. the parallel scanner, with a cold and a warm scan index.")
+    scan_parser.add_argument("--songs", type=int, default=100_000)
+    scan_parser.add_argument("--per-directory", type=int, default=20, help="Songs per album folder.")
+    scan_parser.add_argument("--workers", type=int, default=song_scanner.SCAN_WORKERS)
+    scan_parser.set_defaults(func=bench_scan)
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="Time and peak RSS of every stage of song_board.py "
+                                                              "(load, scan, layout, clustering, emission) and the "
+                                                              "output bytes per song, optionally against a baseline.")
+    pipeline_parser.add_argument("--songs", type=int, nargs="+", default=[1000, 10_000, 100_000],
+                                 help="Catalogue sizes; past ~100k songs use --inputs store, the JSON gets large.")
+    pipeline_parser.add_argument("--dim", type=int, default=128)
+    pipeline_parser.add_argument("--per-directory", type=int, default=20,
+                                 help="Songs per album folder; the catalogue size puts every song in one folder.")
+    pipeline_parser.add_argument("--inputs", nargs="+", choices=["json", "store"], default=["json", "store"])
+    pipeline_parser.add_argument("--formats", nargs="+", choices=song_board.DATA_FORMATS,
+                                 default=list(song_board.DATA_FORMATS))
+    pipeline_parser.add_argument("--projection", choices=projection.PROJECTION_METHODS, default="pca")
+    pipeline_parser.add_argument("--neighbors", type=int, default=neighbor_index.SIMILAR_SONGS)
+    pipeline_parser.add_argument("--clusters", type=int, default=song_clusters.CLUSTER_COUNT,
+                                 help="Clusters made with the cluster command on store inputs; 0 skips it.")
+    pipeline_parser.add_argument("--save", metavar="JSON", help="Write the rows to this file, e.g. as a later baseline.")
+    pipeline_parser.add_argument("--baseline", metavar="JSON",
+                                 help="Rows saved by an earlier run; exits with 1 when a metric got worse.")
+    pipeline_parser.add_argument("--tolerance", type=float, default=0.25,
+                                 help="Relative increase over the baseline that counts as a regression.")
+    pipeline_parser.set_defaults(func=bench_pipeline)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,162 @@
+import json
+import os
+
+import numpy as np
+
+# A store is a directory of little-endian column files described by meta.json:
+#   names.utf8 + name_offsets.u64   UTF-8 song names, name i is names[offsets[i]:offsets[i + 1]]
+#   vectors.f32                     (count, dim) raw embedding vectors, row-major
+#   layout.f32                      (count, layout_dims) precomputed x/y(/z) coordinates
+#   cluster.u16                     cluster id per song (0xFFFF = unassigned)
+# Every column but the names is optional. Opening a store only maps the files, so startup does not depend on the
+# catalogue size and the OS page cache is shared between runs.
+STORE_META = "meta.json"
+
+
+def _cluster_id(value):
+    # Ids that do not fit the uint16 column (such as -1 for noise) are stored as unassigned, like in read_cluster_csv
+    if value is None:
+        return 0xFFFF
+    value = int(value)
+    return value if 0 <= value < 0xFFFF else 0xFFFF
+
+
+class NameTable:
+    # Read-only sequence over a memory-mapped name table; names are decoded on access
+
+    def __init__(self, data, offsets):
+        self._data = data
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        return bytes(self._data[self._offsets[i]:self._offsets[i + 1]]).decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def _map_column(path, dtype, shape):
+    # np.memmap cannot map an empty file
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+class EmbeddingStore:
+
+    def __init__(self, names, vectors=None, layout=None, cluster=None):
+        self.names = names
+        self.vectors = vectors
+        self.layout = layout
+        self.cluster = cluster
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def open(cls, path):
+        with open(os.path.join(path, STORE_META), encoding="utf-8") as f:
+            meta = json.load(f)
+        count = meta["count"]
+        offsets = _map_column(os.path.join(path, "name_offsets.u64"), "<u8", (count + 1,))
+        data = _map_column(os.path.join(path, "names.utf8"), np.uint8, (int(offsets[-1]),))
+        vectors = layout = cluster = None
+        if meta.get("dim"):
+            vectors = _map_column(os.path.join(path, "vectors.f32"), "<f4", (count, meta["dim"]))
+        if meta.get("layout_dims"):
+            layout = _map_column(os.path.join(path, "layout.f32"), "<f4", (count, meta["layout_dims"]))
+        if meta.get("cluster"):
+            cluster = _map_column(os.path.join(path, "cluster.u16"), "<u2", (count,))
+        return cls(NameTable(data, offsets), vectors, layout, cluster)
+
+    @classmethod
+    def from_records(cls, records):
+        # In-memory store for song_embeddings.json style records: song_name plus an "embedding" vector and/or x/y(/z)
+        names = [record["song_name"] for record in records]
+        first = records[0] if records else {}
+        vectors = layout = cluster = None
+        if "embedding" in first:
+            vectors = np.asarray([record["embedding"] for record in records], dtype=np.float32)
+        if "x" in first:
+            axes = "xyz" if "z" in first else "xy"
+            layout = np.asarray([[record.get(axis, np.nan) for axis in axes] for record in records], dtype=np.float32)
+        if "cluster" in first:
+            cluster = np.asarray([_cluster_id(record.get("cluster")) for record in records], dtype=np.uint16)
+        return cls(names, vectors, layout, cluster)
+
+    def board_records(self, layout=None):
+        # Yields the records the board is drawn from, using the given (count, 2|3) layout or the stored one
+        layout = self.layout if layout is None else layout
+        for i, name in enumerate(self.names):
+            record = {"song_name": name}
+            if layout is not None:
+                record.update(zip("xyz", layout[i].tolist()))
+            if self.cluster is not None:
+                record["cluster"] = int(self.cluster[i])
+            yield record
+
+
+def write_store_names(path, names):
+    offsets = [0]
+    with open(os.path.join(path, "names.utf8"), "wb") as f:
+        for name in names:
+            encoded = name.encode("utf-8")
+            f.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+    np.asarray(offsets, dtype="<u8").tofile(os.path.join(path, "name_offsets.u64"))
+    return len(offsets) - 1
+
+
+def write_store_meta(path, meta):
+    # meta.json goes last, so an interrupted write never looks like a complete store
+    with open(os.path.join(path, STORE_META), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+
+def write_store_cluster(path, cluster):
+    # Replaces the cluster ids of an existing store. The column is swapped in by rename, so a store that is open
+    # keeps its old mapping intact.
+    with open(os.path.join(path, STORE_META), encoding="utf-8") as f:
+        meta = json.load(f)
+    temporary_path = os.path.join(path, "cluster.u16.tmp")
+    np.asarray(cluster, dtype="<u2").tofile(temporary_path)
+    os.replace(temporary_path, os.path.join(path, "cluster.u16"))
+    meta["cluster"] = True
+    write_store_meta(path, meta)
+    return meta
+
+
+def write_embedding_store(path, names, vectors=None, layout=None, cluster=None):
+    os.makedirs(path, exist_ok=True)
+    meta = {"count": write_store_names(path, names), "dim": 0, "layout_dims": 0, "cluster": False}
+    if vectors is not None:
+        np.asarray(vectors, dtype="<f4").tofile(os.path.join(path, "vectors.f32"))
+        meta["dim"] = int(vectors.shape[1])
+    if layout is not None:
+        np.asarray(layout, dtype="<f4").tofile(os.path.join(path, "layout.f32"))
+        meta["layout_dims"] = int(layout.shape[1])
+    if cluster is not None:
+        np.asarray(cluster, dtype="<u2").tofile(os.path.join(path, "cluster.u16"))
+        meta["cluster"] = True
+    write_store_meta(path, meta)
+    return meta
+
+
+def convert_json_to_store(json_path, store_path):
+    # One-off conversion of song_embeddings.json; this is the last time the JSON has to be parsed
+    with open(json_path, encoding="utf-8") as f:
+        records = json.load(f)
+    if not isinstance(records, list):
+        raise ValueError(f"{json_path} should contain a JSON list of song objects.")
+    store = EmbeddingStore.from_records(records)
+    del records
+    return write_embedding_store(store_path, store.names, store.vectors, store.layout, store.cluster)
+
+
+def is_embedding_store(path):
+    return os.path.isfile(os.path.join(path, STORE_META))
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+from collections import deque, namedtuple
+
+import numpy as np
+
+from neighbor_index import (SIMILAR_SONGS, merge_top_k, neighbor_similarities, song_neighbors, sort_neighbor_table,
+                            update_neighbor_table)
+from projection import project_embeddings
+
+# Songs placed into an existing layout are interpolated from this many nearest neighbours (cosine) among the
+# songs whose layout is kept
+INTERPOLATION_NEIGHBORS = 10
+# Anchor rows compared against the new songs per block
+INTERPOLATION_BLOCK_ROWS = 65536
+# Re-project everything once this fraction of the library is new or changed, so drift does not accumulate
+FULL_REBUILD_FRACTION = 0.5
+# The similar songs table of the slots and its cosine similarities, kept next to the layout by update_neighbors
+NEIGHBORS_STATE = "neighbors.json"
+NEIGHBORS_TABLE = "neighbors.i32"
+NEIGHBORS_SIMILARITY = "neighbor_similarity.f32"
+# The changed songs and about k songs per changed song that listed them are searched exhaustively; past this fraction
+# of the library the table is built again with the neighbour backend instead
+NEIGHBOR_REBUILD_FRACTION = 0.1
+
+# names and layout are indexed by slot; a slot keeps its position across runs so sidecar files can be patched in place.
+# Removed songs leave a tombstone slot (name None, NaN layout). changed lists the slots whose layout or name differs
+# from the previous run, and full is True when the layout was recomputed from scratch.
+LayoutUpdate = namedtuple("LayoutUpdate", "names layout changed full")
+
+
+def embedding_fingerprint(vector):
+    return hashlib.blake2b(np.ascontiguousarray(vector, dtype=np.float32).tobytes(), digest_size=8).hexdigest()
+
+
+def _read_state(state_dir, method, n_components, dim):
+    state_path = os.path.join(state_dir, "state.json")
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, encoding="utf-8") as f:
+        state = json.load(f)
+    if (state["method"], state["n_components"], state["dim"]) != (method, n_components, dim):
+        return None
+    slots = len(state["names"])
+    # The stored vectors are only scanned block by block, so they stay memory-mapped
+    state["vectors"] = np.memmap(os.path.join(state_dir, "vectors.f32"), dtype="<f4", mode="r", shape=(slots, dim))
+    state["layout"] = np.fromfile(os.path.join(state_dir, "layout.f32"), dtype="<f4",
+                                  count=slots * n_components).reshape(slots, n_components)
+    return state
+
+
+def _patch_rows(path, slots, rows):
+    # Rewrites the given rows of a row-major float32 file in place; slots past the end extend the file
+    with open(path, "r+b") as f:
+        for slot, row in zip(slots, rows):
+            f.seek(int(slot) * row.size * 4)
+            f.write(row.astype("<f4").tobytes())
+
+
+def _write_json(path, data):
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(temporary_path, path)
+
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_state_json(state_dir, method, names, fingerprints, n_components, dim):
+    # Every update bumps the generation, so tables derived from the slots (see update_neighbors) can tell whether
+    # they are exactly one update behind
+    previous = _read_json(os.path.join(state_dir, "state.json"))
+    generation = previous.get("generation", 0) + 1 if previous is not None else 0
+    state = {"method": method, "n_components": n_components, "dim": dim, "names": names, "fingerprints": fingerprints,
+             "generation": generation}
+    _write_json(os.path.join(state_dir, "state.json"), state)
+
+
+def place_out_of_sample(queries, anchor_vectors, anchor_layout, anchor_mask=None, k=INTERPOLATION_NEIGHBORS):
+    # Finds each query's k most cosine-similar anchors (rows where anchor_mask is True) and places it at their
+    # distance-weighted mean position. Anchors are read block by block, so anchor_vectors can be a memmap.
+    queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    if anchor_mask is None:
+        anchor_mask = np.ones(len(anchor_vectors), dtype=bool)
+    k = min(k, int(anchor_mask.sum()))
+    best_similarity = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_index = np.zeros((len(queries), k), dtype=np.int64)
+    for start in range(0, len(anchor_vectors), INTERPOLATION_BLOCK_ROWS):
+        block = np.asarray(anchor_vectors[start:start + INTERPOLATION_BLOCK_ROWS], dtype=np.float32)
+        block = block / np.maximum(np.linalg.norm(block, axis=1, keepdims=True), 1e-12)
+        block_similarity = queries @ block.T
+        block_similarity[:, ~anchor_mask[start:start + len(block)]] = -np.inf
+        best_similarity, best_index = merge_top_k(best_similarity, best_index, block_similarity,
+                                                  np.arange(start, start + len(block)), k)
+
+    weights = 1.0 / (1.0 - best_similarity + 1e-6)
+    return (weights[:, :, None] * anchor_layout[best_index]).sum(axis=1) / weights.sum(axis=1, keepdims=True)
+
+
+def update_layout(state_dir, names, vectors, method="pca", n_components=2):
+    # Keeps the previous layout for unchanged songs and interpolates new or changed ones into it, so the cost of a
+    # rerun follows the number of changed songs instead of the library size. The state (names, embedding
+    # fingerprints, stored vectors and layout per slot) lives in state_dir and is created on the first run.
+    vectors = np.asarray(vectors, dtype=np.float32)
+    dim = vectors.shape[1]
+    fingerprints = [embedding_fingerprint(vector) for vector in vectors]
+    state = _read_state(state_dir, method, n_components, dim)
+
+    if state is not None:
+        previous_slots = len(state["names"])
+        # A name can occur more than once (the same file name in two folders); its rows take its slots in order
+        slots_of = {}
+        for slot, name in enumerate(state["names"]):
+            if name is not None:
+                slots_of.setdefault(name, deque()).append(slot)
+        slot_names = list(state["names"])
+        slot_fingerprints = list(state["fingerprints"])
+        placed_rows = []
+        placed_slots = []
+        for row, name in enumerate(names):
+            slots = slots_of.get(name)
+            slot = slots.popleft() if slots else None
+            if slot is None:
+                slot = len(slot_names)
+                slot_names.append(name)
+                slot_fingerprints.append(None)
+            if slot_fingerprints[slot] != fingerprints[row]:
+                placed_rows.append(row)
+                placed_slots.append(slot)
+        removed = sorted(slot for slots in slots_of.values() for slot in slots)
+
+        anchors = np.isfinite(state["layout"]).all(axis=1)
+        anchors[[slot for slot in placed_slots if slot < previous_slots]] = False
+        anchors[removed] = False
+        if anchors.any() and len(placed_rows) + len(removed) <= FULL_REBUILD_FRACTION * len(names):
+            layout = np.concatenate([state["layout"],
+                                     np.full((len(slot_names) - previous_slots, n_components), np.nan, np.float32)])
+            if placed_rows:
+                layout[placed_slots] = place_out_of_sample(vectors[placed_rows], state["vectors"], state["layout"], anchors)
+            for slot, row in zip(placed_slots, placed_rows):
+                slot_fingerprints[slot] = fingerprints[row]
+            for slot in removed:
+                slot_names[slot] = None
+                slot_fingerprints[slot] = None
+                layout[slot] = np.nan
+
+            del state["vectors"]
+            _patch_rows(os.path.join(state_dir, "vectors.f32"), placed_slots, vectors[placed_rows])
+            changed = np.unique(np.asarray(placed_slots + removed, dtype=np.int64))
+            _patch_rows(os.path.join(state_dir, "layout.f32"), changed, layout[changed])
+            _write_state_json(state_dir, method, slot_names, slot_fingerprints, n_components, dim)
+            return LayoutUpdate(slot_names, layout, changed, False)
+
+    # First run, a changed method or too large a delta: lay out everything and compact the slots
+    layout = project_embeddings(vectors, method, n_components)
+    os.makedirs(state_dir, exist_ok=True)
+    vectors.astype("<f4").tofile(os.path.join(state_dir, "vectors.f32"))
+    layout.astype("<f4").tofile(os.path.join(state_dir, "layout.f32"))
+    _write_state_json(state_dir, method, list(names), fingerprints, n_components, dim)
+    return LayoutUpdate(list(names), layout, np.arange(len(names)), True)
+
+
+def _patch_table(path, rows, table):
+    # Rewrites the given rows of a row-major table file in place, extending it to the table's length
+    with open(path, "r+b") as f:
+        f.truncate(table.nbytes)
+        for row in rows:
+            f.seek(int(row) * table[row].nbytes)
+            f.write(table[row].tobytes())
+
+
+def update_neighbors(state_dir, changed=None, k=SIMILAR_SONGS, backend="auto"):
+    # Keeps the similar songs table of the layout's slots in state_dir, next to the layout. Called after update_layout
+    # with the slots it changed, only those songs are searched and merged into the stored table (see
+    # update_neighbor_table in neighbor_index.py). Without changed slots, when the stored table is not exactly one
+    # update behind, or for a large delta, the table is built from scratch with the backend. Returns the (slots, k)
+    # int32 table, -1 for no neighbour, and the slots whose row changed, or None when the table was built from scratch.
+    state = _read_json(os.path.join(state_dir, "state.json"))
+    names = state["names"]
+    live = np.array([name is not None for name in names], dtype=bool)
+    vectors = np.memmap(os.path.join(state_dir, "vectors.f32"), dtype="<f4", mode="r", shape=(len(names), state["dim"]))
+    neighbors_path = os.path.join(state_dir, NEIGHBORS_TABLE)
+    similarity_path = os.path.join(state_dir, NEIGHBORS_SIMILARITY)
+    stored = _read_json(os.path.join(state_dir, NEIGHBORS_STATE))
+
+    if (changed is not None and stored is not None and stored["k"] == k
+            and stored["generation"] == state["generation"] - 1
+            and len(changed) * (k + 1) <= NEIGHBOR_REBUILD_FRACTION * len(names)):
+        previous_slots = stored["slots"]
+        neighbors = np.full((len(names), k), -1, dtype=np.int32)
+        similarity = np.full((len(names), k), -np.inf, dtype=np.float32)
+        neighbors[:previous_slots] = np.fromfile(neighbors_path, dtype="<i4").reshape(previous_slots, k)
+        similarity[:previous_slots] = np.fromfile(similarity_path, dtype="<f4").reshape(previous_slots, k)
+        rows = update_neighbor_table(vectors, neighbors, similarity, changed, live)
+        # Appended slots always get a row, even when it stays empty
+        rows = np.union1d(rows, np.arange(previous_slots, len(names)))
+        _patch_table(neighbors_path, rows, neighbors)
+        _patch_table(similarity_path, rows, similarity)
+    else:
+        live_slots = np.flatnonzero(live)
+        table = song_neighbors(vectors if live.all() else vectors[live_slots], k, backend)
+        neighbors = np.full((len(names), k), -1, dtype=np.int32)
+        neighbors[live_slots] = np.where(table >= 0, live_slots[np.maximum(table, 0)], -1)
+        similarity = neighbor_similarities(vectors, neighbors)
+        # Ordered by the stored similarities, so later updates only move rows that really changed
+        sort_neighbor_table(neighbors, similarity)
+        neighbors.tofile(neighbors_path)
+        similarity.tofile(similarity_path)
+        rows = None
+    _write_json(os.path.join(state_dir, NEIGHBORS_STATE),
+                {"k": k, "slots": len(names), "generation": state["generation"]})
+    return neighbors, rows
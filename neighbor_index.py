@@ -0,0 +1,264 @@
+import numpy as np
+
+# Backends for the "similar songs" table, by cosine similarity of the raw embeddings. exact and ivf only need numpy;
+# faiss (HNSW graph) and hnswlib are used when installed. "auto" searches exhaustively for small libraries and
+# otherwise picks the first installed of faiss, hnswlib and ivf.
+NEIGHBOR_BACKENDS = ("auto", "exact", "ivf", "faiss", "hnswlib")
+
+# Neighbours stored per song
+SIMILAR_SONGS = 10
+# Up to this many songs "auto" uses the exhaustive search, which is exact and still takes about a second
+EXACT_SEARCH_MAX_SONGS = 10000
+# Rows per block for the similarity products, so memory-mapped vectors stream through
+NEIGHBOR_BLOCK_ROWS = 4096
+
+# IVF: songs are grouped by their nearest k-means centroid, and each song is compared only against the songs of the
+# IVF_PROBES lists whose centroids are nearest to it. The centroids are trained on a sample.
+IVF_PROBES = 8
+IVF_ITERATIONS = 10
+IVF_TRAIN_SAMPLE = 65536
+
+
+def unit_rows(block):
+    block = np.asarray(block, dtype=np.float32)
+    return block / np.maximum(np.linalg.norm(block, axis=1, keepdims=True), 1e-12)
+
+
+def merge_top_k(best_similarity, best_index, block_similarity, block_index, k):
+    # Merges a block of candidate similarities (queries x candidates, candidate ids in block_index) into the running
+    # top k per query. The block is cut to its own top k first, so only 2k columns are merged.
+    block_k = min(k, block_similarity.shape[1])
+    block_top = np.argpartition(-block_similarity, block_k - 1, axis=1)[:, :block_k]
+    similarity = np.concatenate([best_similarity, np.take_along_axis(block_similarity, block_top, axis=1)], axis=1)
+    index = np.concatenate([best_index, block_index[block_top]], axis=1)
+    top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(similarity, top, axis=1), np.take_along_axis(index, top, axis=1)
+
+
+def _empty_top_k(n_queries, k):
+    return np.full((n_queries, k), -np.inf, dtype=np.float32), np.full((n_queries, k), -1, dtype=np.int64)
+
+
+def _drop_self(rows, similarity, index, k):
+    # Sorts each query's candidates by similarity, drops the query song itself (or the weakest candidate when the
+    # song is not among them) and returns k columns of int32 ids, padded with -1
+    order = np.argsort(-similarity, axis=1, kind="stable")
+    index = np.take_along_axis(index, order, axis=1)
+    index[np.take_along_axis(similarity, order, axis=1) == -np.inf] = -1
+    is_self = index == np.asarray(rows)[:, None]
+    is_self[~is_self.any(axis=1), -1] = True
+    index = index[~is_self].reshape(len(rows), -1)
+    neighbors = np.full((len(rows), k), -1, dtype=np.int32)
+    neighbors[:, :min(k, index.shape[1])] = index[:, :k]
+    return neighbors
+
+
+def exact_neighbors(vectors, k=SIMILAR_SONGS, rows=None):
+    # Exhaustive cosine search for the given rows (default: every song), O(n) per query
+    rows = np.arange(len(vectors)) if rows is None else np.asarray(rows)
+    neighbors = np.empty((len(rows), k), dtype=np.int32)
+    for query_start in range(0, len(rows), NEIGHBOR_BLOCK_ROWS):
+        query_rows = rows[query_start:query_start + NEIGHBOR_BLOCK_ROWS]
+        queries = unit_rows(vectors[query_rows])
+        best_similarity, best_index = _empty_top_k(len(query_rows), k + 1)
+        for start in range(0, len(vectors), NEIGHBOR_BLOCK_ROWS):
+            block = unit_rows(vectors[start:start + NEIGHBOR_BLOCK_ROWS])
+            best_similarity, best_index = merge_top_k(best_similarity, best_index, queries @ block.T,
+                                                      np.arange(start, start + len(block)), k + 1)
+        neighbors[query_start:query_start + len(query_rows)] = _drop_self(query_rows, best_similarity, best_index, k)
+    return neighbors
+
+
+def neighbor_similarities(vectors, neighbors):
+    # Cosine similarity of every song to each of its listed neighbours, -inf for the -1 padding
+    similarity = np.full(neighbors.shape, -np.inf, dtype=np.float32)
+    for start in range(0, len(neighbors), NEIGHBOR_BLOCK_ROWS):
+        ids = neighbors[start:start + NEIGHBOR_BLOCK_ROWS]
+        queries = unit_rows(vectors[start:start + len(ids)])
+        candidates = unit_rows(vectors[np.maximum(ids, 0).ravel()]).reshape(len(ids), ids.shape[1], -1)
+        similarity[start:start + len(ids)] = np.where(ids >= 0, np.einsum("qd,qkd->qk", queries, candidates), -np.inf)
+    return similarity
+
+
+def sort_neighbor_table(neighbors, similarity):
+    # Orders every row best first in place, with the -1 padding last
+    order = np.argsort(-similarity, axis=1, kind="stable")
+    similarity[:] = np.take_along_axis(similarity, order, axis=1)
+    neighbors[:] = np.take_along_axis(neighbors, order, axis=1)
+    neighbors[similarity == -np.inf] = -1
+
+
+def update_neighbor_table(vectors, neighbors, similarity, changed, live):
+    # Updates a (slots, k) neighbour table and its similarities in place after the songs in the changed slots got new
+    # vectors or were removed, in O(slots x changed) instead of a new index over every song. vectors holds the current
+    # vector of every slot and live marks the slots that still hold a song. The changed songs, and the songs that
+    # listed one of them (about changed x k), are searched exhaustively; every other song only takes the changed ones
+    # as candidates. Rows of removed songs are cleared. Returns the rows that differ from before.
+    k = neighbors.shape[1]
+    before = neighbors.copy()
+    changed = np.asarray(changed, dtype=np.int64)
+    is_changed = np.zeros(len(live), dtype=bool)
+    is_changed[changed] = True
+    refresh = live & (is_changed | ((neighbors >= 0) & (is_changed | ~live)[np.maximum(neighbors, 0)]).any(axis=1))
+    neighbors[~live] = -1
+    similarity[~live] = -np.inf
+
+    candidates = changed[live[changed]]
+    queries = np.flatnonzero(refresh)
+    if len(queries):
+        candidate_vectors = unit_rows(vectors[candidates])
+        query_vectors = unit_rows(vectors[queries])
+        fresh_similarity, fresh_index = _empty_top_k(len(queries), k)
+        for start in range(0, len(live), NEIGHBOR_BLOCK_ROWS):
+            stop = min(start + NEIGHBOR_BLOCK_ROWS, len(live))
+            block = unit_rows(vectors[start:stop])
+            block_live = live[start:stop]
+            rows = start + np.flatnonzero(block_live & ~refresh[start:stop])
+            if len(rows) and len(candidates):
+                similarity[rows], neighbors[rows] = merge_top_k(similarity[rows], neighbors[rows],
+                                                                block[rows - start] @ candidate_vectors.T, candidates, k)
+            block_similarity = query_vectors @ block.T
+            block_similarity[:, ~block_live] = -np.inf
+            own = np.flatnonzero((queries >= start) & (queries < stop))
+            block_similarity[own, queries[own] - start] = -np.inf
+            fresh_similarity, fresh_index = merge_top_k(fresh_similarity, fresh_index, block_similarity,
+                                                        np.arange(start, stop), k)
+        similarity[queries] = fresh_similarity
+        neighbors[queries] = fresh_index
+    sort_neighbor_table(neighbors, similarity)
+    return np.flatnonzero((neighbors != before).any(axis=1))
+
+
+def nearest_centroids(vectors, centroids, n_probe):
+    # (n_songs, n_probe) centroid ids per song, nearest first
+    nearest = np.empty((len(vectors), n_probe), dtype=np.int64)
+    for start in range(0, len(vectors), NEIGHBOR_BLOCK_ROWS):
+        similarity = unit_rows(vectors[start:start + NEIGHBOR_BLOCK_ROWS]) @ centroids.T
+        top = np.argpartition(-similarity, n_probe - 1, axis=1)[:, :n_probe]
+        top_similarity = np.take_along_axis(similarity, top, axis=1)
+        nearest[start:start + len(top)] = np.take_along_axis(top, np.argsort(-top_similarity, axis=1), axis=1)
+    return nearest
+
+
+def _spherical_kmeans(train, n_lists, rng):
+    centroids = train[rng.choice(len(train), n_lists, replace=False)]
+    for _ in range(IVF_ITERATIONS):
+        assignment = nearest_centroids(train, centroids, 1)[:, 0]
+        order = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=n_lists)
+        used = counts > 0
+        sums = np.add.reduceat(train[order], np.concatenate([[0], np.cumsum(counts)[:-1]])[used], axis=0)
+        # Lists that lost all their songs keep their previous centroid
+        centroids[used] = unit_rows(sums)
+    return centroids
+
+
+class IvfIndex:
+    # Inverted-file index over unit-normalised embeddings: list l holds order[offsets[l]:offsets[l + 1]], and probes
+    # lists the n_probe nearest centroids of every song (its own list first)
+
+    def __init__(self, vectors, centroids, order, offsets, probes):
+        self.vectors = vectors
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.probes = probes
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, n_probe=IVF_PROBES, random_state=0):
+        rng = np.random.default_rng(random_state)
+        n_lists = min(n_lists or max(1, int(np.sqrt(len(vectors)))), len(vectors))
+        sample = np.sort(rng.choice(len(vectors), min(len(vectors), max(IVF_TRAIN_SAMPLE, n_lists)), replace=False))
+        centroids = _spherical_kmeans(unit_rows(vectors[sample]), n_lists, rng)
+        probes = nearest_centroids(vectors, centroids, min(n_probe, n_lists))
+        order = np.argsort(probes[:, 0], kind="stable")
+        offsets = np.searchsorted(probes[order, 0], np.arange(n_lists + 1))
+        return cls(vectors, centroids, order, offsets, probes)
+
+    def search_all(self, k=SIMILAR_SONGS):
+        # Top k for every indexed song. Each list is loaded once and compared against all songs that probe it.
+        n_songs, n_probe = self.probes.shape
+        best_similarity, best_index = _empty_top_k(n_songs, k + 1)
+        probed = self.probes.ravel()
+        by_list = np.argsort(probed, kind="stable")
+        query_offsets = np.searchsorted(probed[by_list], np.arange(len(self.centroids) + 1))
+        for l in range(len(self.centroids)):
+            members = self.order[self.offsets[l]:self.offsets[l + 1]]
+            if len(members) == 0:
+                continue
+            candidates = unit_rows(self.vectors[members])
+            query_rows = by_list[query_offsets[l]:query_offsets[l + 1]] // n_probe
+            for start in range(0, len(query_rows), NEIGHBOR_BLOCK_ROWS):
+                rows = query_rows[start:start + NEIGHBOR_BLOCK_ROWS]
+                best_similarity[rows], best_index[rows] = merge_top_k(
+                    best_similarity[rows], best_index[rows], unit_rows(self.vectors[rows]) @ candidates.T, members, k + 1)
+        return _drop_self(np.arange(n_songs), best_similarity, best_index, k)
+
+
+def _faiss_neighbors(vectors, k):
+    try:
+        import faiss
+    except ImportError:
+        raise ImportError("The faiss neighbour index needs faiss (pip install faiss-cpu).") from None
+    index = faiss.IndexHNSWFlat(vectors.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+    for start in range(0, len(vectors), NEIGHBOR_BLOCK_ROWS):
+        index.add(unit_rows(vectors[start:start + NEIGHBOR_BLOCK_ROWS]))
+    index.hnsw.efSearch = max(64, 4 * k)
+    neighbors = np.empty((len(vectors), k), dtype=np.int32)
+    for start in range(0, len(vectors), NEIGHBOR_BLOCK_ROWS):
+        similarity, index_rows = index.search(unit_rows(vectors[start:start + NEIGHBOR_BLOCK_ROWS]), k + 1)
+        similarity[index_rows < 0] = -np.inf
+        rows = np.arange(start, start + len(index_rows))
+        neighbors[start:start + len(rows)] = _drop_self(rows, similarity, index_rows, k)
+    return neighbors
+
+
+def _hnswlib_neighbors(vectors, k):
+    try:
+        import hnswlib
+    except ImportError:
+        raise ImportError("The hnswlib neighbour index needs hnswlib (pip install hnswlib).") from None
+    index = hnswlib.Index(space="ip", dim=vectors.shape[1])
+    index.init_index(max_elements=len(vectors), ef_construction=200, M=16)
+    for start in range(0, len(vectors), NEIGHBOR_BLOCK_ROWS):
+        block = unit_rows(vectors[start:start + NEIGHBOR_BLOCK_ROWS])
+        index.add_items(block, np.arange(start, start + len(block)))
+    index.set_ef(max(64, 4 * k))
+    neighbors = np.empty((len(vectors), k), dtype=np.int32)
+    for start in range(0, len(vectors), NEIGHBOR_BLOCK_ROWS):
+        labels, distances = index.knn_query(unit_rows(vectors[start:start + NEIGHBOR_BLOCK_ROWS]),
+                                            k=min(k + 1, len(vectors)))
+        # hnswlib's "ip" distance is 1 - inner product
+        rows = np.arange(start, start + len(labels))
+        neighbors[start:start + len(rows)] = _drop_self(rows, 1 - distances, labels.astype(np.int64), k)
+    return neighbors
+
+
+def _installed_backend():
+    for backend, module in (("faiss", "faiss"), ("hnswlib", "hnswlib")):
+        try:
+            __import__(module)
+        except ImportError:
+            continue
+        return backend
+    return "ivf"
+
+
+def song_neighbors(vectors, k=SIMILAR_SONGS, backend="auto"):
+    # (n_songs, k) int32 ids of each song's most cosine-similar songs, best first and padded with -1. vectors can be
+    # an ndarray or a read-only memmap.
+    if backend not in NEIGHBOR_BACKENDS:
+        raise ValueError(f"Unknown neighbour index: {backend!r}")
+    if k < 1:
+        raise ValueError("The number of similar songs must be positive.")
+    if len(vectors) == 0:
+        return np.zeros((0, k), dtype=np.int32)
+    if backend == "auto":
+        backend = "exact" if len(vectors) <= EXACT_SEARCH_MAX_SONGS else _installed_backend()
+    if backend == "exact":
+        return exact_neighbors(vectors, k)
+    if backend == "ivf":
+        return IvfIndex.build(vectors).search_all(k)
+    if backend == "faiss":
+        return _faiss_neighbors(vectors, k)
+    return _hnswlib_neighbors(vectors, k)
@@ -0,0 +1,80 @@
+import json
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+# Writing "5" here resets the process's peak RSS (Linux 4.0+), so every stage can report its own peak rather than the
+# highest one so far
+_CLEAR_REFS = "/proc/self/clear_refs"
+
+
+def _proc_status_mb(field):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb():
+    # Linux keeps ru_maxrss across exec, so a freshly spawned child would inherit its parent's peak; VmHWM belongs
+    # to the process's own address space
+    peak = _proc_status_mb("VmHWM")
+    if peak is not None:
+        return peak
+    # ru_maxrss is reported in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def rss_mb():
+    # Resident set size right now; None where /proc is not available
+    return _proc_status_mb("VmRSS")
+
+
+def _reset_peak_rss():
+    try:
+        with open(_CLEAR_REFS, "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class PipelineProfile:
+    # Wall time and peak RSS of every stage of one song_board.py run, as written by --profile. Stages that stream
+    # records (layout and cluster ids are only applied while the page is written) are paid for in the "emit" stage.
+    def __init__(self, command):
+        self.command = command
+        self.stages = []
+        self.info = {}
+        self.per_stage_peaks = True
+        self._start = time.perf_counter()
+        self._peak = peak_rss_mb()
+
+    @contextmanager
+    def stage(self, name):
+        self._peak = max(self._peak, peak_rss_mb())
+        self.per_stage_peaks &= _reset_peak_rss()
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            peak = peak_rss_mb()
+            self._peak = max(self._peak, peak)
+            self.stages.append({"stage": name, "seconds": time.perf_counter() - begin, "peak_rss_mb": peak,
+                                "rss_mb": rss_mb()})
+
+    def to_dict(self):
+        # Without per-stage peaks (no /proc/self/clear_refs) each stage reports the process's peak so far
+        return {"command": self.command, **self.info, "seconds": time.perf_counter() - self._start,
+                "peak_rss_mb": max(self._peak, peak_rss_mb()), "per_stage_peaks": self.per_stage_peaks,
+                "stages": self.stages}
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
@@ -0,0 +1,119 @@
+import numpy as np
+
+# Layout methods for raw embeddings, fastest first. pca and rsvd only need numpy; tsne uses openTSNE (FFT-accelerated)
+# or falls back to scikit-learn's Barnes-Hut t-SNE, and umap needs umap-learn.
+PROJECTION_METHODS = ("pca", "rsvd", "tsne", "umap")
+
+# Rows per block when accumulating statistics over the embedding matrix, so memory-mapped inputs stream through
+PROJECTION_BLOCK_ROWS = 65536
+
+# t-SNE and UMAP run on a PCA reduction of the embeddings rather than on the full 1024-d vectors
+NEIGHBOR_METHOD_INPUT_DIMS = 50
+
+
+def _column_mean(vectors):
+    total = np.zeros(vectors.shape[1], dtype=np.float64)
+    for start in range(0, len(vectors), PROJECTION_BLOCK_ROWS):
+        total += vectors[start:start + PROJECTION_BLOCK_ROWS].sum(axis=0, dtype=np.float64)
+    return total / max(len(vectors), 1)
+
+
+def _project_blocks(vectors, mean, components):
+    out = np.empty((len(vectors), components.shape[1]), dtype=np.float32)
+    for start in range(0, len(vectors), PROJECTION_BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + PROJECTION_BLOCK_ROWS], dtype=np.float32)
+        out[start:start + len(block)] = (block - mean) @ components
+    return out
+
+
+def pca(vectors, n_components=2):
+    # Exact PCA from the d x d covariance, accumulated block by block (BLAS uses every core for the products)
+    mean = _column_mean(vectors).astype(np.float32)
+    covariance = np.zeros((vectors.shape[1], vectors.shape[1]), dtype=np.float64)
+    for start in range(0, len(vectors), PROJECTION_BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + PROJECTION_BLOCK_ROWS], dtype=np.float32) - mean
+        covariance += block.T @ block
+    _, eigenvectors = np.linalg.eigh(covariance)
+    components = eigenvectors[:, ::-1][:, :n_components].astype(np.float32)
+    return _project_blocks(vectors, mean, components)
+
+
+def randomized_pca(vectors, n_components=2, oversample=10, power_iterations=4, random_state=0):
+    # Randomized SVD (Halko et al.) of the centred matrix: O(n * d * k) instead of the O(n * d^2) covariance build
+    rng = np.random.default_rng(random_state)
+    mean = _column_mean(vectors).astype(np.float32)
+    rank = min(n_components + oversample, *vectors.shape)
+    basis = rng.standard_normal((vectors.shape[1], rank)).astype(np.float32)
+    for _ in range(power_iterations):
+        sketch = _project_blocks(vectors, mean, basis)
+        sketch, _ = np.linalg.qr(sketch)
+        basis = _transpose_product(vectors, mean, sketch)
+        basis, _ = np.linalg.qr(basis)
+    sketch, _ = np.linalg.qr(_project_blocks(vectors, mean, basis))
+    small = _transpose_product(vectors, mean, sketch).T
+    _, _, right = np.linalg.svd(small, full_matrices=False)
+    return _project_blocks(vectors, mean, right[:n_components].T.astype(np.float32))
+
+
+def _transpose_product(vectors, mean, sketch):
+    # (vectors - mean).T @ sketch, one block of rows at a time
+    out = np.zeros((vectors.shape[1], sketch.shape[1]), dtype=np.float32)
+    for start in range(0, len(vectors), PROJECTION_BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + PROJECTION_BLOCK_ROWS], dtype=np.float32) - mean
+        out += block.T @ sketch[start:start + len(block)]
+    return out
+
+
+def tsne(vectors, n_components=2, random_state=0, n_jobs=-1):
+    reduced = _reduce_for_neighbors(vectors, random_state)
+    try:
+        from openTSNE import TSNE
+    except ImportError:
+        TSNE = None
+    if TSNE is not None:
+        # openTSNE switches to FFT-accelerated interpolation for 2D layouts of large catalogues. That raises a
+        # RuntimeError for 3D layouts, which use Barnes-Hut at every size instead.
+        gradient = "auto" if n_components <= 2 else "bh"
+        model = TSNE(n_components=n_components, negative_gradient_method=gradient, n_jobs=n_jobs,
+                     random_state=random_state)
+        return np.asarray(model.fit(reduced), dtype=np.float32)
+    try:
+        from sklearn.manifold import TSNE
+    except ImportError:
+        raise ImportError("t-SNE projection needs openTSNE or scikit-learn (pip install openTSNE).") from None
+    model = TSNE(n_components=n_components, method="barnes_hut", init="pca", n_jobs=n_jobs, random_state=random_state)
+    return model.fit_transform(reduced).astype(np.float32)
+
+
+def umap(vectors, n_components=2, random_state=None, n_jobs=-1):
+    try:
+        import umap as umap_learn
+    except ImportError:
+        raise ImportError("UMAP projection needs umap-learn (pip install umap-learn).") from None
+    # umap-learn builds an approximate kNN graph (NN-descent) before laying it out; a fixed random_state would
+    # force it onto a single thread, so reproducibility is opt-in
+    model = umap_learn.UMAP(n_components=n_components, random_state=random_state, n_jobs=n_jobs, low_memory=True)
+    return model.fit_transform(_reduce_for_neighbors(vectors, 0)).astype(np.float32)
+
+
+def _reduce_for_neighbors(vectors, random_state):
+    if vectors.shape[1] <= NEIGHBOR_METHOD_INPUT_DIMS:
+        return np.asarray(vectors, dtype=np.float32)
+    return randomized_pca(vectors, NEIGHBOR_METHOD_INPUT_DIMS, random_state=random_state)
+
+
+def project_embeddings(vectors, method="pca", n_components=2):
+    # Projects an (n_songs, dim) matrix - an ndarray or a read-only memmap - to (n_songs, n_components) float32
+    if method not in PROJECTION_METHODS:
+        raise ValueError(f"Unknown projection method: {method!r}")
+    if n_components not in (2, 3):
+        raise ValueError("The song board can only show 2D or 3D layouts.")
+    if vectors.ndim != 2 or len(vectors) == 0:
+        raise ValueError("Expected a non-empty (n_songs, dim) embedding matrix.")
+    if method == "pca":
+        return pca(vectors, n_components)
+    if method == "rsvd":
+        return randomized_pca(vectors, n_components)
+    if method == "tsne":
+        return tsne(vectors, n_components)
+    return umap(vectors, n_components)
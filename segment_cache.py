@@ -0,0 +1,130 @@
+import hashlib
+import os
+import time
+
+import numpy as np
+
+from song_embedder import INT16_SCALE, SAMPLE_RATE, SEGMENT_SAMPLES, SEGMENTS_PER_SONG
+
+# Total size the cache is held to, least recently used songs first
+SEGMENT_CACHE_BYTES = 20 * 2 ** 30
+# Once a run has written past the cap, the cache is trimmed to this fraction of it, so the directory is not scanned
+# again for every further song
+SEGMENT_CACHE_TRIM_RATIO = 0.9
+# Songs used this close before a queued song was submitted are kept too, allowing for coarse file system timestamps
+_MTIME_SLACK_SECONDS = 2.0
+_HASH_CHUNK_BYTES = 1 << 20
+
+
+class SegmentCache:
+    # Decoded, resampled songs on disk, keyed by a hash of the audio file's bytes and the decode settings, so renamed
+    # or moved files still hit. Each song is one .npy file under <cache_dir>/<key[:2]>/ holding an int16
+    # (segments, SEGMENT_SAMPLES) array - the silence that pads a short song is not stored - which np.load maps
+    # without copying. A file's mtime is its last use, and evict() removes the oldest files first.
+    # Lookups and stores also run in decode worker processes; hits and misses are counted where record() is called,
+    # which also keeps a running total of the cache size and trims the cache as soon as it passes max_bytes.
+
+    def __init__(self, cache_dir, max_bytes=SEGMENT_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._bytes = None  # running size of the cache, counted from the first stored song on
+
+    def key(self, audio_path):
+        digest = hashlib.blake2b(f"{SAMPLE_RATE}:{SEGMENT_SAMPLES}:{SEGMENTS_PER_SONG}".encode("ascii"), digest_size=16)
+        with open(audio_path, "rb") as f:
+            for chunk in iter(lambda: f.read(_HASH_CHUNK_BYTES), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".npy")
+
+    def open(self, key):
+        # Read-only (segments, SEGMENT_SAMPLES) int16 memmap of a cached song
+        return np.load(self.path(key), mmap_mode="r")
+
+    def get(self, audio_path):
+        # The cached segments of an audio file, or None; never decodes
+        key = self.key(audio_path)
+        hit = os.path.exists(self.path(key))
+        self.record(hit)
+        if not hit:
+            return None
+        os.utime(self.path(key))
+        return self.open(key)
+
+    def store(self, key, samples):
+        # samples: flat float audio at SAMPLE_RATE, at most SEGMENTS_PER_SONG segments long
+        segments = -(-len(samples) // SEGMENT_SAMPLES)
+        rows = np.zeros(segments * SEGMENT_SAMPLES, dtype=np.int16)
+        rows[:len(samples)] = np.clip(np.round(np.asarray(samples) * INT16_SCALE), -INT16_SCALE, INT16_SCALE)
+        target = self.path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Workers decoding identical files may race on the same key; each writes its own temporary file
+        temporary_path = f"{target}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as f:
+            np.save(f, rows.reshape(segments, SEGMENT_SAMPLES))
+        os.replace(temporary_path, target)
+
+    def load_or_decode(self, audio_path, decode):
+        # Returns (key, hit). On a miss the song is decoded with decode(audio_path) -> flat samples (or None when the
+        # file cannot be decoded, giving a None key) and stored.
+        key = self.key(audio_path)
+        try:
+            os.utime(self.path(key))
+            return key, True
+        except FileNotFoundError:
+            pass  # not cached, or evicted just now
+        samples = decode(audio_path)
+        if samples is None:
+            return None, False
+        self.store(key, samples)
+        return key, False
+
+    def record(self, hit, key=None, keep_since=None):
+        # Counts a lookup. A miss that stored key adds its file to the running size; once that passes max_bytes the
+        # cache is trimmed, keeping songs used since the keep_since timestamp (those still queued for decoding).
+        if hit:
+            self.hits += 1
+            return
+        self.misses += 1
+        if key is None:
+            return
+        if self._bytes is None:
+            self._bytes = self.evict(max_bytes=float("inf"))
+        else:
+            self._bytes += os.path.getsize(self.path(key))
+        if self._bytes > self.max_bytes:
+            self._bytes = self.evict(keep_since, int(self.max_bytes * SEGMENT_CACHE_TRIM_RATIO))
+
+    def evict(self, keep_since=None, max_bytes=None):
+        # Removes least recently used songs until the cache fits max_bytes (default: the cap) and returns the bytes
+        # left. Songs used since keep_since (a time.time() value) are never removed.
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        keep_since = time.time() if keep_since is None else keep_since - _MTIME_SLACK_SECONDS
+        entries = []
+        if os.path.isdir(self.cache_dir):
+            for shard in os.scandir(self.cache_dir):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(".npy"):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue  # removed by a concurrent run
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        kept = 0
+        full = False
+        for mtime, size, path in sorted(entries, reverse=True):
+            full = full or kept + size > max_bytes
+            if full and mtime < keep_since:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            else:
+                kept += size
+        return kept
@@ -1,8 +1,65 @@
+import argparse
+import base64
+import itertools
 import json
 import os
+import sys
+import urllib.parse
+from array import array
+from collections import Counter, deque
+from contextlib import ExitStack
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 
-def generate_interactive_song_board(song_embeddings, song_files):
-    html_content = """
+import numpy as np
+
+from embedding_store import EmbeddingStore, NameTable, convert_json_to_store, is_embedding_store, write_store_cluster
+from layout_state import update_layout, update_neighbors
+from neighbor_index import NEIGHBOR_BACKENDS, SIMILAR_SONGS, song_neighbors
+from pipeline_profile import PipelineProfile
+from projection import PROJECTION_METHODS, project_embeddings
+from song_embedder import DECODE_WORKERS, EMBED_BATCH_SONGS, embed_song_library, load_embedding_model
+from segment_cache import SEGMENT_CACHE_BYTES, SegmentCache
+from song_clusters import (CLUSTER_BATCH_ROWS, CLUSTER_COUNT, CLUSTER_EPOCHS, CLUSTER_METHODS, CLUSTER_WORKERS,
+                           UNASSIGNED_CLUSTER, cluster_song_store, read_cluster_csv, write_cluster_csv)
+from song_previews import PREVIEW_BITRATE, PREVIEW_SECONDS, PREVIEW_WORKERS, generate_previews
+from song_scanner import SCAN_WORKERS, scan_song_library
+from song_tiles import initial_tile_bytes, write_tile_pyramid
+
+# Number of song records serialised per write when streaming the page
+SONG_RECORD_CHUNK = 1000
+
+# Binary sidecar columns: file name, array typecode, value written when a record lacks the column
+SIDECAR_COLUMNS = {
+    "x": ("x.f32", "f", float("nan")),
+    "y": ("y.f32", "f", float("nan")),
+    "z": ("z.f32", "f", float("nan")),
+    "cluster": ("cluster.u16", "H", UNASSIGNED_CLUSTER),
+}
+# Grid index arrays (see build_song_grid_index) and their sidecar file names
+GRID_INDEX_FILES = {"order": "grid_order.u32", "offsets": "grid_offsets.u32", "label_level": "label_level.u8"}
+_UINT32 = "I" if array("I").itemsize == 4 else "L"
+# (songs, k) int32 "similar songs" table (see neighbor_index.song_neighbors), row i at ids[i * k:(i + 1) * k]
+NEIGHBORS_FILE = "neighbors.i32"
+# Cluster member lists (see build_cluster_index) and their sidecar file names
+CLUSTER_INDEX_FILES = {"cluster_order": "cluster_order.u32", "cluster_offsets": "cluster_offsets.u32"}
+
+# "svg" keeps one DOM node per song; "canvas" and "webgl" draw every point in one batched pass
+RENDERERS = ("svg", "canvas", "webgl")
+# "inline" embeds the records in the page, "binary" writes them as a sidecar the page fetches whole, and "tiles" adds a
+# tile pyramid (see song_tiles.py) to the sidecar from which the page fetches only what is on screen
+DATA_FORMATS = ("inline", "binary", "tiles")
+
+# Label level of detail: at level L the projected extent is split into 2**L x 2**L cells and only the first
+# LABELS_PER_CELL songs of each cell are labelled. The page shows level LABEL_BASE_LEVEL at zoom 1 and one more
+# level per doubling of the zoom factor.
+LABEL_LEVELS = 8
+LABELS_PER_CELL = 2
+LABEL_BASE_LEVEL = 3
+# Target number of songs per cell of the viewport-culling grid
+GRID_CELL_SONGS = 8
+
+_PAGE_HEAD = """
     <!DOCTYPE html>
     <html lang="en">
     <head>
@@ -17,6 +74,7 @@ def generate_interactive_song_board(song_embeddings, song_files):
             .song-circle { cursor: pointer; border-radius: 50%; opacity: 0.7; transition: opacity 0.2s ease, stroke-width 0.2s ease; stroke: transparent; stroke-width: 0; }
             .song-circle:hover { opacity: 1; stroke: #60a5fa; stroke-width: 2px; }
             .song-circle.playing { stroke: #f59e0b; stroke-width: 4px; opacity: 1; }
+            .song-circle.similar { stroke: #10b981; stroke-width: 3px; opacity: 1; }
             #tooltip { position: absolute; background: white; padding: 0.5rem; border: 1px solid #e5e7eb; border-radius: 0.25rem; font-size: 0.875rem; box-shadow: 0 1px 3px rgba(0,0,0,0.1); pointer-events: none; opacity: 0; transition: opacity 0.2s ease; }
 
             /* Styles for the seek bar thumb */
@@ -84,6 +142,11 @@ def generate_interactive_song_board(song_embeddings, song_files):
             <div class="flex justify-center space-x-4 mb-4">
                 <button id="play-all" class="bg-blue-500 hover:bg-blue-700 text-white font-bold py-2 px-4 rounded">Play All</button>
                 <button id="pause-all" class="bg-gray-300 hover:bg-gray-400 text-gray-800 font-bold py-2 px-4 rounded">Pause All</button>
+                <select id="cluster-filter" class="hidden border border-gray-300 rounded py-2 px-2 text-gray-800"></select>
+            </div>
+            <div id="similar-songs" class="hidden max-w-3xl mx-auto text-sm text-gray-700">
+                <h2 class="font-semibold mb-1">Similar songs</h2>
+                <ul id="similar-songs-list" class="space-y-1"></ul>
             </div>
         </div>
 
@@ -121,165 +184,980 @@ def generate_interactive_song_board(song_embeddings, song_files):
                 .attr("id", "tooltip")
                 .style("opacity", 0);
 
-            const audioElements = {};
+            const audioElements = new Map(); // song name -> { audio, name, index }, least recently used first
             let playingAudio = null;
 
-            // Ensure song_embeddings and song_files are correctly passed as JSON strings
-            const songData = JSON.parse(`""" + json.dumps(json.dumps(song_embeddings))[1:-1] + """`);
-            const songFiles = JSON.parse(`""" + json.dumps(json.dumps(song_files))[1:-1] + """`);
+"""
+
+_PAGE_MIDDLE = """];
+            const songFiles = ["""
+
+_PAGE_TAIL = """
+            // The board works on a columnar view of the songs: typed arrays for coordinates, names looked up by index.
+            // Inline pages convert the records above; binary pages fetch the sidecar and wrap it without copying.
+            let songs = null;
+
+            function columnsFromRecords(records) {
+                const hasZ = records.length > 0 && records[0].z !== undefined;
+                const hasCluster = records.length > 0 && records[0].cluster !== undefined;
+                return {
+                    count: records.length,
+                    x: Float32Array.from(records, d => d.x),
+                    y: Float32Array.from(records, d => d.y),
+                    z: hasZ ? Float32Array.from(records, d => d.z) : null,
+                    cluster: hasCluster ? Uint16Array.from(records, d => d.cluster) : null,
+                    name: i => records[i].song_name,
+                    index: gridIndex(songGridIndex, new Uint32Array(base64Buffer(songGridIndex.order)),
+                        new Uint32Array(base64Buffer(songGridIndex.offsets)), new Uint8Array(base64Buffer(songGridIndex.label_level))),
+                    neighbors: songNeighbors ? { k: songNeighbors.k, ids: new Int32Array(base64Buffer(songNeighbors.ids)) } : null,
+                    clusters: songClusters ? clusterIndex(songClusters, new Uint32Array(base64Buffer(songClusters.cluster_order)),
+                        new Uint32Array(base64Buffer(songClusters.cluster_offsets))) : null,
+                };
+            }
+
+            function base64Buffer(text) {
+                const bytes = atob(text);
+                const buffer = new Uint8Array(bytes.length);
+                for (let i = 0; i < bytes.length; i++) buffer[i] = bytes.charCodeAt(i);
+                return buffer.buffer;
+            }
+
+            function gridIndex(meta, order, offsets, labelLevel) {
+                return { extent: meta.extent, gridSize: meta.grid_size, baseLevel: meta.base_level, order, offsets, labelLevel };
+            }
+
+            // Cluster c holds order[offsets[c]:offsets[c + 1]] and is centred on centroids[c] (see build_cluster_index)
+            function clusterIndex(meta, order, offsets) {
+                return { count: meta.count, centroids: meta.centroids, order, offsets, size: c => offsets[c + 1] - offsets[c] };
+            }
+
+            // Tiled boards start from the manifest and the tile occupancy map alone. Songs become known as the tiles
+            // holding them arrive (see createTiledRenderer) and are forgotten again with their tile, unless the player
+            // still refers to them (songInUse), so memory follows the viewport rather than the catalogue.
+            const tileSongs = new Map(); // song index -> { name, path, cluster }
+            // Songs queued by Play All on a tiled board, and the similar songs listed below the player
+            const queuedSongs = new Set();
+            let listedSongs = [];
 
-            const songLinks = {};
-            // Assuming song_files is an array of filenames like ["song1.mp3", "song2.mp3"]
-            // And songData is an array of objects like [{song_name: "song1.mp3", x: ..., y:...}, ...]
-            // The song_name in songData should match the filenames in song_files.
+            function songInUse(i) {
+                return (playingAudio !== null && playingAudio.index === i) || (prefetchedAudio !== null && prefetchedAudio.index === i)
+                    || queuedSongs.has(i) || listedSongs.includes(i);
+            }
+
+            function tiledSongs(manifest, occupancy) {
+                const tiles = manifest.tiles;
+                const levelOffset = z => (4 ** z - 1) / 3;
+                const song = i => tileSongs.get(i) || {};
+                return {
+                    count: manifest.count,
+                    x: null,
+                    y: null,
+                    z: null,
+                    cluster: null,
+                    name: i => song(i).name,
+                    path: i => song(i).path,
+                    clusterOf: i => song(i).cluster,
+                    index: null,
+                    neighbors: null,
+                    clusters: manifest.clusters ? {
+                        count: manifest.clusters.count, centroids: manifest.clusters.centroids, size: c => manifest.clusters.sizes[c],
+                    } : null,
+                    tiles: {
+                        url: boardConfig.dataUrl + "/" + tiles.dir,
+                        extent: tiles.extent,
+                        pointLevel: tiles.point_level,
+                        baseLevel: tiles.base_level,
+                        bins: tiles.bins,
+                        maxCounts: tiles.max_counts,
+                        occupied: (z, x, y) => occupancy[levelOffset(z) + y * 2 ** z + x] === 1,
+                    },
+                };
+            }
+
+            async function loadBinaryColumns(dataUrl) {
+                const fetchBuffer = async file => {
+                    const response = await fetch(dataUrl + "/" + file);
+                    if (!response.ok) throw new Error("Failed to fetch " + file + ": " + response.status);
+                    return response.arrayBuffer();
+                };
+                const manifest = JSON.parse(new TextDecoder().decode(await fetchBuffer("manifest.json")));
+                if (manifest.tiles) return tiledSongs(manifest, new Uint8Array(await fetchBuffer(manifest.tiles.occupancy)));
+                const buffers = {};
+                await Promise.all(Object.entries(manifest.columns).map(async ([column, file]) => {
+                    buffers[column] = await fetchBuffer(file);
+                }));
+
+                // Columns are little-endian, which matches every platform browsers run on
+                const nameOffsets = new Uint32Array(buffers.name_offsets);
+                const nameBytes = new Uint8Array(buffers.names);
+                const decoder = new TextDecoder();
+                return {
+                    count: manifest.count,
+                    x: new Float32Array(buffers.x),
+                    y: new Float32Array(buffers.y),
+                    z: buffers.z ? new Float32Array(buffers.z) : null,
+                    cluster: buffers.cluster ? new Uint16Array(buffers.cluster) : null,
+                    name: i => decoder.decode(nameBytes.subarray(nameOffsets[i], nameOffsets[i + 1])),
+                    index: gridIndex(manifest.index, new Uint32Array(buffers.order), new Uint32Array(buffers.offsets),
+                        new Uint8Array(buffers.label_level)),
+                    neighbors: buffers.neighbors ? { k: manifest.neighbors.k, ids: new Int32Array(buffers.neighbors) } : null,
+                    clusters: manifest.clusters ? clusterIndex(manifest.clusters, new Uint32Array(buffers.cluster_order),
+                        new Uint32Array(buffers.cluster_offsets)) : null,
+                };
+            }
+
+            function loadSongs() {
+                if (boardConfig.dataUrl) return loadBinaryColumns(boardConfig.dataUrl);
+                return Promise.resolve(columnsFromRecords(songData));
+            }
+
+            const songPaths = {};
+            // songFiles holds paths relative to the songs directory, like ["artist/song1.mp3", "song2.mp3"].
+            // A song_name can be either that relative path or, when it is unique in the library, the bare file name.
+            const baseName = f => f.slice(f.lastIndexOf("/") + 1);
+            const encodePath = f => f.split("/").map(encodeURIComponent).join("/");
+            const baseNameCounts = d3.rollup(songFiles, v => v.length, baseName);
             songFiles.forEach(f => {
-                // Create a mapping from the song name (which should be the file name) to its path
-                songLinks[f] = "songs/" + f;
+                songPaths[f] = f;
+                if (baseNameCounts.get(baseName(f)) === 1 && !(baseName(f) in songPaths)) songPaths[baseName(f)] = f;
             });
 
+            // Tiled boards get each song's path with its tile instead of from songFiles
+            function songPath(i) {
+                return songs.path ? songs.path(i) || undefined : songPaths[songs.name(i)];
+            }
+
+            function songLink(i) {
+                const path = songPath(i);
+                return path === undefined ? undefined : boardConfig.songsUrl + encodePath(path);
+            }
+
+
+            // Every renderer exposes the same interface: render(transform) draws the board under a d3 zoom transform,
+            // setPlaying(i, on) toggles the playing highlight, setSimilar(indices) marks the similar songs of the clicked
+            // one, and element receives the zoom behaviour.
+            let board = null;
+
+            // Songs are coloured by cluster, so a song keeps its colour across reloads: cluster c gets c times the
+            // golden angle as its hue, which keeps consecutive ids far apart. Songs without a cluster hash their name.
+            const UNASSIGNED_CLUSTER = 0xFFFF;
+            const GOLDEN_ANGLE = 137.508;
+
+            function nameHue(name) {
+                let hash = 0x811c9dc5; // FNV-1a
+                for (let j = 0; j < name.length; j++) hash = Math.imul(hash ^ name.charCodeAt(j), 0x01000193);
+                return (hash >>> 0) % 360;
+            }
+
+            const clusterHue = c => (c * GOLDEN_ANGLE) % 360;
+
+            function songHues() {
+                const hues = new Float32Array(songs.count);
+                for (let i = 0; i < songs.count; i++) {
+                    const c = songs.cluster ? songs.cluster[i] : UNASSIGNED_CLUSTER;
+                    hues[i] = c === UNASSIGNED_CLUSTER ? nameHue(songs.name(i)) : clusterHue(c);
+                }
+                return hues;
+            }
 
             function createSongBoard() {
                 const width = songBoard.node().clientWidth;
                 const height = songBoard.node().clientHeight;
                 const padding = 40;
 
-                const svg = songBoard.append("svg").attr("width", width).attr("height", height);
-                const container = svg.append("g");
+                const [x0, x1, y0, y1] = songs.tiles ? songs.tiles.extent : [...d3.extent(songs.x), ...d3.extent(songs.y)];
+
+                const xScale = d3.scaleLinear().domain([x0, x1]).range([padding, width - padding]);
+                const yScale = d3.scaleLinear().domain([y0, y1]).range([padding, height - padding]);
+
+                let viewport;
+                let maxZoom = 10;
+                if (songs.tiles) {
+                    viewport = createTileViewport(width, height, xScale, yScale);
+                    board = createTiledRenderer(width, height, xScale, yScale, viewport);
+                    // Zooming goes a few levels past the point level, where single songs come apart
+                    maxZoom = Math.max(maxZoom, 2 ** (songs.tiles.pointLevel - songs.tiles.baseLevel + 3));
+                } else {
+                    viewport = createViewport(width, height, xScale, yScale);
+                    const renderers = { svg: createSvgRenderer, canvas: createCanvasRenderer, webgl: createWebglRenderer };
+                    board = (renderers[boardConfig.renderer] || createSvgRenderer)(width, height, xScale, yScale, songHues(), viewport);
+                }
+                board.render(d3.zoomIdentity);
+
+                // Zoom ticks are coalesced into at most one render per animation frame
+                let pendingTransform = null;
+                const zoom = d3.zoom().scaleExtent([0.5, maxZoom]).on("zoom", e => {
+                    if (pendingTransform === null) {
+                        requestAnimationFrame(() => {
+                            board.render(pendingTransform);
+                            pendingTransform = null;
+                        });
+                    }
+                    pendingTransform = e.transform;
+                });
+                d3.select(board.element).call(zoom);
+                setupClusterFilter(zoom, xScale, yScale, viewport);
+            }
+
+            // Picking a cluster only draws its songs and pans the board to its centroid
+            function setupClusterFilter(zoom, xScale, yScale, viewport) {
+                const clusters = songs.clusters;
+                if (!clusters) return;
+                const options = [{ value: -1, text: "All clusters" }];
+                for (let c = 0; c < clusters.count; c++) {
+                    const size = clusters.size(c);
+                    if (size > 0) options.push({ value: c, text: `Cluster ${c} (${size} songs)` });
+                }
+                const select = d3.select("#cluster-filter").classed("hidden", false);
+                select.selectAll("option").data(options).join("option").attr("value", d => d.value).text(d => d.text);
+                select.on("change", () => {
+                    const c = +select.property("value");
+                    viewport.setFilter(c);
+                    board.render(d3.zoomTransform(board.element));
+                    if (c < 0) return;
+                    const [x, y] = clusters.centroids[c];
+                    d3.select(board.element).transition().duration(500).call(zoom.translateTo, xScale(x), yScale(y));
+                });
+            }
+
+            // Viewport culling and label level of detail over the generator's grid index (see build_song_grid_index):
+            // only grid cells that intersect the viewport are visited, so zoom cost follows the visible songs.
+            const LABEL_ALL_BELOW = 150; // label every visible song once no more than this many are on screen
+            const CULL_MARGIN = 20; // px kept around the viewport so circles on its edge are not dropped
 
-                const xExtent = d3.extent(songData, d => d.x);
-                const yExtent = d3.extent(songData, d => d.y);
+            function createViewport(width, height, xScale, yScale) {
+                const index = songs.index;
+                const [x0, x1, y0, y1] = index.extent;
+                const size = index.gridSize;
+                const cellOf = (value, lo, hi) => Math.min(size - 1, Math.max(0, Math.floor((value - lo) / Math.max(hi - lo, 1e-12) * size)));
+                const visible = [];
+                let filter = -1; // cluster whose songs are shown, -1 for all
+                return {
+                    get filter() { return filter; },
+                    setFilter(c) { filter = c; },
+                    shows: i => filter < 0 || (songs.cluster !== null && songs.cluster[i] === filter),
+                    // Indices of the songs in grid cells that intersect the viewport; the array is reused between calls.
+                    // With a cluster filter the cluster's member list is walked instead of the grid.
+                    visibleSongs(transform) {
+                        const [ax, ay] = transform.invert([-CULL_MARGIN, -CULL_MARGIN]);
+                        const [bx, by] = transform.invert([width + CULL_MARGIN, height + CULL_MARGIN]);
+                        const [dx0, dx1] = d3.extent([xScale.invert(ax), xScale.invert(bx)]);
+                        const [dy0, dy1] = d3.extent([yScale.invert(ay), yScale.invert(by)]);
+                        visible.length = 0;
+                        if (dx1 < x0 || dx0 > x1 || dy1 < y0 || dy0 > y1) return visible;
+                        if (filter >= 0) {
+                            const clusters = songs.clusters;
+                            for (let j = clusters.offsets[filter]; j < clusters.offsets[filter + 1]; j++) {
+                                const i = clusters.order[j];
+                                if (songs.x[i] >= dx0 && songs.x[i] <= dx1 && songs.y[i] >= dy0 && songs.y[i] <= dy1) visible.push(i);
+                            }
+                            return visible;
+                        }
+                        const cx0 = cellOf(dx0, x0, x1), cx1 = cellOf(dx1, x0, x1);
+                        const cy0 = cellOf(dy0, y0, y1), cy1 = cellOf(dy1, y0, y1);
+                        for (let cy = cy0; cy <= cy1; cy++) {
+                            for (let cx = cx0; cx <= cx1; cx++) {
+                                const c = cy * size + cx;
+                                for (let j = index.offsets[c]; j < index.offsets[c + 1]; j++) visible.push(index.order[j]);
+                            }
+                        }
+                        return visible;
+                    },
+                    // The visible songs that get a label at this zoom: at most a few per cell of the current label level
+                    labelled(transform, visibleSongs) {
+                        if (visibleSongs.length <= LABEL_ALL_BELOW) return visibleSongs;
+                        const level = Math.max(0, Math.ceil(Math.log2(transform.k))) + index.baseLevel;
+                        return visibleSongs.filter(i => index.labelLevel[i] <= level);
+                    },
+                };
+            }
+
+            // Tiled boards pick a pyramid level from the zoom and only the occupied tiles of that level that intersect the
+            // viewport (see song_tiles.py), so what the page fetches follows the viewport rather than the catalogue
+            function createTileViewport(width, height, xScale, yScale) {
+                const tiles = songs.tiles;
+                const [x0, x1, y0, y1] = tiles.extent;
+                let filter = -1;
+                return {
+                    get filter() { return filter; },
+                    setFilter(c) { filter = c; },
+                    shows: i => filter < 0 || songs.clusterOf(i) === filter,
+                    level: transform => Math.max(0, Math.min(tiles.pointLevel, Math.floor(Math.log2(transform.k)) + tiles.baseLevel)),
+                    // [level, x, y] of the tiles to draw at this zoom
+                    visibleTiles(transform) {
+                        const z = this.level(transform);
+                        const size = 2 ** z;
+                        const tileOf = (value, lo, hi) => Math.min(size - 1, Math.max(0, Math.floor((value - lo) / Math.max(hi - lo, 1e-12) * size)));
+                        const [ax, ay] = transform.invert([-CULL_MARGIN, -CULL_MARGIN]);
+                        const [bx, by] = transform.invert([width + CULL_MARGIN, height + CULL_MARGIN]);
+                        const [dx0, dx1] = d3.extent([xScale.invert(ax), xScale.invert(bx)]);
+                        const [dy0, dy1] = d3.extent([yScale.invert(ay), yScale.invert(by)]);
+                        const visible = [];
+                        if (dx1 < x0 || dx0 > x1 || dy1 < y0 || dy0 > y1) return visible;
+                        for (let ty = tileOf(dy0, y0, y1); ty <= tileOf(dy1, y0, y1); ty++) {
+                            for (let tx = tileOf(dx0, x0, x1); tx <= tileOf(dx1, x0, x1); tx++) {
+                                if (tiles.occupied(z, tx, ty)) visible.push([z, tx, ty]);
+                            }
+                        }
+                        return visible;
+                    },
+                };
+            }
 
-                const xScale = d3.scaleLinear().domain(xExtent).range([padding, width - padding]);
-                const yScale = d3.scaleLinear().domain(yExtent).range([padding, height - padding]);
+            function showTooltip(event, i) {
+                tooltip.text(songs.name(i))
+                    .style("left", (event.pageX + 10) + "px")
+                    .style("top", (event.pageY - 28) + "px")
+                    .style("opacity", 1);
+                startPreview(i);
+            }
+
+            function hideTooltip() {
+                tooltip.style("opacity", 0);
+                stopPreview();
+            }
+
+            function handleSongClick(i) {
+                const songName = songs.name(i);
+                const url = songLink(i);
+                showSimilarSongs(i);
+                if (url) playSong(i, url);
+                else console.error("Song URL not found for:", songName);
+            }
+
+            // Nearest neighbours in embedding space, precomputed by the generator (see neighbor_index.py):
+            // row i of the table holds song i's most similar songs, best first, padded with -1
+            function similarSongs(i) {
+                const table = songs.neighbors;
+                if (!table) return [];
+                return Array.from(table.ids.subarray(i * table.k, (i + 1) * table.k)).filter(j => j >= 0);
+            }
+
+            function showSimilarSongs(i) {
+                const similar = similarSongs(i);
+                listedSongs = similar;
+                board.setSimilar(similar);
+                d3.select("#similar-songs").classed("hidden", similar.length === 0);
+                const items = d3.select("#similar-songs-list").selectAll("li").data(similar).join("li");
+                items.text(j => songs.name(j))
+                    .attr("class", "cursor-pointer hover:text-blue-600")
+                    .on("click", (event, j) => handleSongClick(j));
+            }
+
+            function createSvgRenderer(width, height, xScale, yScale, hues, viewport) {
+                const svg = songBoard.append("svg").attr("width", width).attr("height", height);
+                const container = svg.append("g");
+                const indices = d3.range(songs.count);
 
                 const circles = container.selectAll("circle")
-                    .data(songData).enter().append("circle")
+                    .data(indices).enter().append("circle")
                     .attr("class", "song-circle")
                     .attr("r", 10)
-                    .attr("fill", () => `hsl(${Math.random() * 360}, 70%, 50%)`)
-                    .on("mouseover", (event, d) => {
-                        tooltip.html(d.song_name) // song_name should be the property holding the display name / file name
-                            .style("left", (event.pageX + 10) + "px")
-                            .style("top", (event.pageY - 28) + "px")
-                            .style("opacity", 1);
-                    })
-                    .on("mouseout", () => tooltip.style("opacity", 0))
-                    .on("click", function (event, d) {
-                        const url = songLinks[d.song_name]; // Use d.song_name to look up in songLinks
-                        if (url) playSong(d.song_name, url, this);
-                        else console.error("Song URL not found for:", d.song_name, "Available links:", songLinks);
-                    });
+                    .attr("fill", d => `hsl(${hues[d]}, 70%, 50%)`)
+                    .on("mouseover", showTooltip)
+                    .on("mouseout", hideTooltip)
+                    .on("click", (event, d) => handleSongClick(d));
 
                 const labels = container.selectAll("text")
-                    .data(songData).enter().append("text")
-                    .text(d => d.song_name) // Make sure d.song_name is what you want to display
+                    .data(indices).enter().append("text")
+                    .text(d => songs.name(d))
                     .attr("font-size", "10px")
                     .attr("fill", "#444");
 
-                function updatePositions(xS, yS) {
-                    circles.attr("cx", d => xS(d.x)).attr("cy", d => yS(d.y));
-                    labels.attr("x", d => xS(d.x) + 12).attr("y", d => yS(d.y) + 4);
-                }
+                // Culled nodes are hidden rather than repositioned, so a zoom tick only touches what was or is visible
+                const circleNodes = circles.style("display", "none").nodes();
+                const labelNodes = labels.style("display", "none").nodes();
+                let shownCircles = [];
+                let shownLabels = [];
+                let similar = [];
 
-                updatePositions(xScale, yScale);
+                return {
+                    element: svg.node(),
+                    render(transform) {
+                        const xS = transform.rescaleX(xScale);
+                        const yS = transform.rescaleY(yScale);
+                        const visible = viewport.visibleSongs(transform);
+                        const labelled = viewport.labelled(transform, visible);
+                        shownCircles.forEach(i => { circleNodes[i].style.display = "none"; });
+                        shownLabels.forEach(i => { labelNodes[i].style.display = "none"; });
+                        visible.forEach(i => {
+                            const node = circleNodes[i];
+                            node.setAttribute("cx", xS(songs.x[i]));
+                            node.setAttribute("cy", yS(songs.y[i]));
+                            node.style.display = "";
+                        });
+                        labelled.forEach(i => {
+                            const node = labelNodes[i];
+                            node.setAttribute("x", xS(songs.x[i]) + 12);
+                            node.setAttribute("y", yS(songs.y[i]) + 4);
+                            node.style.display = "";
+                        });
+                        shownCircles = visible.slice();
+                        shownLabels = labelled.slice();
+                    },
+                    setPlaying(i, playing) {
+                        d3.select(circles.nodes()[i]).classed("playing", playing);
+                    },
+                    setSimilar(indices) {
+                        similar.forEach(i => circleNodes[i].classList.remove("similar"));
+                        similar = indices;
+                        similar.forEach(i => circleNodes[i].classList.add("similar"));
+                    },
+                };
+            }
 
-                svg.call(d3.zoom().scaleExtent([0.5, 10]).on("zoom", e => {
-                    const newX = e.transform.rescaleX(xScale);
-                    const newY = e.transform.rescaleY(yScale);
-                    updatePositions(newX, newY);
-                }));
+            // Canvas and WebGL boards project every point once into unzoomed screen space;
+            // a zoom then only changes the transform applied while drawing.
+            function projectPoints(xScale, yScale) {
+                const px = Float32Array.from(songs.x, v => xScale(v));
+                const py = Float32Array.from(songs.y, v => yScale(v));
+                return { px, py, quadtree: d3.quadtree(d3.range(songs.count), i => px[i], i => py[i]) };
             }
 
-            function playSong(songName, songUrl, circleElement) {
-                if (playingAudio && playingAudio.name !== songName) {
-                    playingAudio.audio.pause();
-                    d3.select(playingAudio.circle).classed("playing", false);
-                    // No need to reset playingAudio to null here yet,
-                    // it will be overwritten or handled if a new song starts
+            function appendCanvas(width, height) {
+                const dpr = window.devicePixelRatio || 1;
+                return songBoard.append("canvas")
+                    .attr("width", Math.round(width * dpr)).attr("height", Math.round(height * dpr))
+                    .style("position", "absolute").style("left", 0).style("top", 0)
+                    .style("width", width + "px").style("height", height + "px")
+                    .node();
+            }
+
+            // Hover and click go through the quadtree instead of per-song DOM events
+            function attachHitTesting(element, points, renderer) {
+                const pick = event => {
+                    const [bx, by] = renderer.transform.invert(d3.pointer(event, element));
+                    const found = points.quadtree.find(bx, by, 10 / renderer.transform.k);
+                    return found === undefined || !renderer.shows(found) ? -1 : found;
+                };
+                d3.select(element)
+                    .on("mousemove", event => {
+                        const i = pick(event);
+                        element.style.cursor = i >= 0 ? "pointer" : "default";
+                        if (i >= 0) showTooltip(event, i);
+                        else hideTooltip();
+                        renderer.setHovered(i);
+                    })
+                    .on("mouseleave", () => {
+                        hideTooltip();
+                        renderer.setHovered(-1);
+                    })
+                    .on("click", event => {
+                        const i = pick(event);
+                        if (i >= 0) handleSongClick(i);
+                    });
+            }
+
+            // Labels and highlight rings are drawn with the 2D context for both canvas and WebGL boards
+            function drawOverlay(ctx, points, renderer, labelled) {
+                const t = renderer.transform;
+                ctx.font = "10px sans-serif";
+                ctx.fillStyle = "#444";
+                for (const i of labelled) {
+                    ctx.fillText(renderer.name(i), t.applyX(points.px[i]) + 12, t.applyY(points.py[i]) + 4);
                 }
+                const rings = renderer.similar.map(i => [i, "#10b981", 3]);
+                rings.push([renderer.hovered, "#60a5fa", 2], [renderer.playing, "#f59e0b", 4]);
+                rings.forEach(([i, color, lineWidth]) => {
+                    if (i < 0) return;
+                    ctx.strokeStyle = color;
+                    ctx.lineWidth = lineWidth;
+                    ctx.beginPath();
+                    ctx.arc(t.applyX(points.px[i]), t.applyY(points.py[i]), 10, 0, 2 * Math.PI);
+                    ctx.stroke();
+                });
+            }
+
+            // Shared state and interface for the canvas and WebGL renderers; draw() does the actual painting
+            function createPointRenderer(element, points, viewport, draw) {
+                const names = new Array(songs.count);
+                const renderer = {
+                    element,
+                    shows: viewport.shows,
+                    transform: d3.zoomIdentity,
+                    hovered: -1,
+                    playing: -1,
+                    similar: [],
+                    render(transform) {
+                        renderer.transform = transform;
+                        draw();
+                    },
+                    // Label text is decoded on first use, so only songs that were ever labelled pay for it
+                    name(i) {
+                        if (names[i] === undefined) names[i] = songs.name(i);
+                        return names[i];
+                    },
+                    setHovered(i) {
+                        if (i === renderer.hovered) return;
+                        renderer.hovered = i;
+                        draw();
+                    },
+                    setPlaying(i, playing) {
+                        if (playing) renderer.playing = i;
+                        else if (renderer.playing === i) renderer.playing = -1;
+                        draw();
+                    },
+                    setSimilar(indices) {
+                        renderer.similar = indices;
+                        draw();
+                    },
+                };
+                attachHitTesting(element, points, renderer);
+                return renderer;
+            }
 
-                if (!audioElements[songName]) {
-                    const audio = new Audio(songUrl);
+            function createCanvasRenderer(width, height, xScale, yScale, hues, viewport) {
+                const canvas = appendCanvas(width, height);
+                const ctx = canvas.getContext("2d");
+                const dpr = canvas.width / width;
+                const points = projectPoints(xScale, yScale);
 
-                    audio.addEventListener('loadedmetadata', () => {
-                        if (!isNaN(audio.duration)) {
-                           totalDurationLabel.textContent = formatTime(audio.duration);
-                           seekBar.max = audio.duration;
+                // One filled path per hue bucket instead of one fill per song; only visible songs are bucketed
+                const buckets = 36;
+                const bucketOf = Uint8Array.from(hues, h => Math.floor(h / 360 * buckets) % buckets);
+                const batches = Array.from({ length: buckets }, () => []);
+
+                const renderer = createPointRenderer(canvas, points, viewport, () => {
+                    const t = renderer.transform;
+                    const visible = viewport.visibleSongs(t);
+                    batches.forEach(members => { members.length = 0; });
+                    for (const i of visible) batches[bucketOf[i]].push(i);
+                    ctx.setTransform(dpr, 0, 0, dpr, 0, 0);
+                    ctx.clearRect(0, 0, width, height);
+                    ctx.globalAlpha = 0.7;
+                    batches.forEach((members, b) => {
+                        if (members.length === 0) return;
+                        ctx.fillStyle = `hsl(${(b + 0.5) * 360 / buckets}, 70%, 50%)`;
+                        ctx.beginPath();
+                        for (const i of members) {
+                            const sx = t.applyX(points.px[i]);
+                            const sy = t.applyY(points.py[i]);
+                            ctx.moveTo(sx + 10, sy);
+                            ctx.arc(sx, sy, 10, 0, 2 * Math.PI);
                         }
+                        ctx.fill();
                     });
+                    ctx.globalAlpha = 1;
+                    drawOverlay(ctx, points, renderer, viewport.labelled(t, visible));
+                });
+                return renderer;
+            }
 
-                    audio.addEventListener("timeupdate", () => {
-                        if (!isNaN(audio.duration)) { // Check duration is a number
-                            seekBar.value = audio.currentTime;
-                            currentTimeLabel.textContent = formatTime(audio.currentTime);
-                            // Total duration is set on loadedmetadata, but can be reaffirmed here if needed
-                            if (totalDurationLabel.textContent === "0:00" || totalDurationLabel.textContent === "NaN:NaN") {
-                                totalDurationLabel.textContent = formatTime(audio.duration);
-                                seekBar.max = audio.duration;
-                            }
-                        }
+            const POINT_VERTEX_SHADER = `
+                attribute vec2 a_position;
+                attribute vec3 a_color;
+                attribute float a_cluster;
+                uniform vec3 u_transform;
+                uniform vec2 u_viewport;
+                uniform float u_pointSize;
+                uniform float u_filter;
+                varying vec3 v_color;
+                void main() {
+                    vec2 screen = a_position * u_transform.x + u_transform.yz;
+                    vec2 clip = screen / u_viewport * 2.0 - 1.0;
+                    gl_Position = vec4(clip.x, -clip.y, 0.0, 1.0);
+                    // Songs outside the cluster filter shrink to nothing
+                    gl_PointSize = u_filter < 0.0 || a_cluster == u_filter ? u_pointSize : 0.0;
+                    v_color = a_color;
+                }`;
+
+            const POINT_FRAGMENT_SHADER = `
+                precision mediump float;
+                varying vec3 v_color;
+                void main() {
+                    vec2 offset = gl_PointCoord - 0.5;
+                    if (dot(offset, offset) > 0.25) discard;
+                    gl_FragColor = vec4(v_color * 0.7, 0.7);
+                }`;
+
+            function compileProgram(gl, vertexSource, fragmentSource) {
+                const program = gl.createProgram();
+                [[gl.VERTEX_SHADER, vertexSource], [gl.FRAGMENT_SHADER, fragmentSource]].forEach(([type, source]) => {
+                    const shader = gl.createShader(type);
+                    gl.shaderSource(shader, source);
+                    gl.compileShader(shader);
+                    if (!gl.getShaderParameter(shader, gl.COMPILE_STATUS)) throw new Error(gl.getShaderInfoLog(shader));
+                    gl.attachShader(program, shader);
+                });
+                gl.linkProgram(program);
+                if (!gl.getProgramParameter(program, gl.LINK_STATUS)) throw new Error(gl.getProgramInfoLog(program));
+                return program;
+            }
+
+            function uploadAttribute(gl, program, name, data, size) {
+                const location = gl.getAttribLocation(program, name);
+                gl.bindBuffer(gl.ARRAY_BUFFER, gl.createBuffer());
+                gl.bufferData(gl.ARRAY_BUFFER, data, gl.STATIC_DRAW);
+                gl.enableVertexAttribArray(location);
+                gl.vertexAttribPointer(location, size, gl.FLOAT, false, 0, 0);
+            }
+
+            function createWebglRenderer(width, height, xScale, yScale, hues, viewport) {
+                const glCanvas = appendCanvas(width, height);
+                const gl = glCanvas.getContext("webgl", { antialias: true });
+                if (!gl) {
+                    console.warn("WebGL is not available, falling back to the canvas renderer.");
+                    glCanvas.remove();
+                    return createCanvasRenderer(width, height, xScale, yScale, hues, viewport);
+                }
+                const overlay = appendCanvas(width, height);
+                const ctx = overlay.getContext("2d");
+                const dpr = glCanvas.width / width;
+                const points = projectPoints(xScale, yScale);
+
+                // Positions and colours are uploaded once; zooming only updates the u_transform uniform.
+                // The GPU clips off-screen points itself, so culling is only applied to the label overlay.
+                const program = compileProgram(gl, POINT_VERTEX_SHADER, POINT_FRAGMENT_SHADER);
+                gl.useProgram(program);
+                const positions = new Float32Array(songs.count * 2);
+                const colors = new Float32Array(songs.count * 3);
+                for (let i = 0; i < songs.count; i++) {
+                    positions[2 * i] = points.px[i];
+                    positions[2 * i + 1] = points.py[i];
+                    const rgb = d3.hsl(hues[i], 0.7, 0.5).rgb();
+                    colors.set([rgb.r / 255, rgb.g / 255, rgb.b / 255], 3 * i);
+                }
+                uploadAttribute(gl, program, "a_position", positions, 2);
+                uploadAttribute(gl, program, "a_color", colors, 3);
+                uploadAttribute(gl, program, "a_cluster",
+                    songs.cluster ? Float32Array.from(songs.cluster) : new Float32Array(songs.count).fill(UNASSIGNED_CLUSTER), 1);
+                const transformLocation = gl.getUniformLocation(program, "u_transform");
+                const filterLocation = gl.getUniformLocation(program, "u_filter");
+                gl.uniform2f(gl.getUniformLocation(program, "u_viewport"), width, height);
+                gl.uniform1f(gl.getUniformLocation(program, "u_pointSize"), 20 * dpr);
+                gl.viewport(0, 0, glCanvas.width, glCanvas.height);
+                gl.enable(gl.BLEND);
+                gl.blendFunc(gl.ONE, gl.ONE_MINUS_SRC_ALPHA);
+                gl.clearColor(0, 0, 0, 0);
+
+                const renderer = createPointRenderer(overlay, points, viewport, () => {
+                    const t = renderer.transform;
+                    gl.uniform3f(transformLocation, t.k, t.x, t.y);
+                    gl.uniform1f(filterLocation, viewport.filter);
+                    gl.clear(gl.COLOR_BUFFER_BIT);
+                    gl.drawArrays(gl.POINTS, 0, songs.count);
+                    ctx.setTransform(dpr, 0, 0, dpr, 0, 0);
+                    ctx.clearRect(0, 0, width, height);
+                    drawOverlay(ctx, points, renderer, viewport.labelled(t, viewport.visibleSongs(t)));
+                });
+                return renderer;
+            }
+
+            // Tiled boards fetch tiles as the viewport needs them and keep the most recently drawn ones. Aggregate tiles are
+            // drawn as density cells in the colour of their most common cluster, point tiles like the canvas board.
+            const TILE_CACHE_SIZE = 256;
+
+            function createTiledRenderer(width, height, xScale, yScale, viewport) {
+                const canvas = appendCanvas(width, height);
+                const ctx = canvas.getContext("2d");
+                const dpr = canvas.width / width;
+                const tiles = songs.tiles;
+                const [x0, x1, y0, y1] = tiles.extent;
+                const decoder = new TextDecoder();
+                const cache = new Map(); // "z/x_y" -> decoded tile, or null while it is fetched; least recently used first
+
+                // Unzoomed screen positions of the songs in cached point tiles. The quadtree only answers hit tests while
+                // point tiles are drawn, so hovering density cells does not pick songs that are not on screen.
+                const points = { px: {}, py: {} };
+                const tree = d3.quadtree().x(i => points.px[i]).y(i => points.py[i]);
+                const noSongs = d3.quadtree();
+                let showingPoints = false;
+                Object.defineProperty(points, "quadtree", { get: () => showingPoints ? tree : noSongs });
+
+                // Point tile layout (see song_tiles.py): every section starts on a 4-byte boundary
+                function decodePointTile(buffer) {
+                    const count = new Uint32Array(buffer, 0, 1)[0];
+                    let offset = 4;
+                    const section = (Type, length) => {
+                        const array = new Type(buffer, offset, length);
+                        offset += Math.ceil(length * Type.BYTES_PER_ELEMENT / 4) * 4;
+                        return array;
+                    };
+                    const ids = section(Uint32Array, count);
+                    const x = section(Float32Array, count);
+                    const y = section(Float32Array, count);
+                    const cluster = section(Uint16Array, count);
+                    const offsets = section(Uint32Array, 2 * count + 1);
+                    const bytes = new Uint8Array(buffer, offset);
+                    const text = j => decoder.decode(bytes.subarray(offsets[j], offsets[j + 1]));
+                    const hues = new Float32Array(count);
+                    for (let j = 0; j < count; j++) {
+                        const name = text(j);
+                        tileSongs.set(ids[j], { name, path: text(count + j), cluster: cluster[j] });
+                        points.px[ids[j]] = xScale(x[j]);
+                        points.py[ids[j]] = yScale(y[j]);
+                        hues[j] = cluster[j] === UNASSIGNED_CLUSTER ? nameHue(name) : clusterHue(cluster[j]);
+                    }
+                    tree.addAll(Array.from(ids));
+                    return { ids, cluster, hues };
+                }
+
+                function decodeAggregateTile(x, y, buffer) {
+                    const cells = tiles.bins * tiles.bins;
+                    return { x, y, counts: new Uint32Array(buffer, 0, cells), clusters: new Uint16Array(buffer, 4 * cells, cells) };
+                }
+
+                function evictTiles() {
+                    for (const [key, tile] of cache) {
+                        if (cache.size <= TILE_CACHE_SIZE) break;
+                        cache.delete(key);
+                        if (!tile || !tile.ids) continue;
+                        tree.removeAll(Array.from(tile.ids));
+                        tile.ids.forEach(i => {
+                            delete points.px[i];
+                            delete points.py[i];
+                            if (!songInUse(i)) tileSongs.delete(i);
+                        });
+                    }
+                }
+
+                // The tile if it is cached; otherwise starts fetching it and redraws once it arrives
+                function requestTile(z, x, y) {
+                    const key = `${z}/${x}_${y}`;
+                    if (cache.has(key)) {
+                        const tile = cache.get(key);
+                        cache.delete(key);
+                        cache.set(key, tile);
+                        return tile;
+                    }
+                    cache.set(key, null);
+                    fetch(`${tiles.url}/${key}.bin`)
+                        .then(response => {
+                            if (!response.ok) throw new Error(response.status);
+                            return response.arrayBuffer();
+                        })
+                        .then(buffer => {
+                            if (!cache.has(key)) return; // evicted while in flight
+                            cache.set(key, z === tiles.pointLevel ? decodePointTile(buffer) : decodeAggregateTile(x, y, buffer));
+                            scheduleDraw();
+                        })
+                        .catch(e => console.error("Failed to fetch tile " + key + ":", e));
+                    evictTiles();
+                    return null;
+                }
+
+                let drawPending = false;
+                function scheduleDraw() {
+                    if (drawPending) return;
+                    drawPending = true;
+                    requestAnimationFrame(() => {
+                        drawPending = false;
+                        renderer.render(renderer.transform);
                     });
+                }
 
-                    audio.addEventListener("ended", () => {
-                        d3.select(circleElement).classed("playing", false);
-                        if (playingAudio && playingAudio.name === songName) {
-                            playingAudio = null; // Clear only if the ended song is the one currently marked as playing
+                function drawCells(visible, z, t) {
+                    const bins = tiles.bins;
+                    const cellWidth = (x1 - x0) / (2 ** z * bins);
+                    const cellHeight = (y1 - y0) / (2 ** z * bins);
+                    const maxCount = Math.log1p(tiles.maxCounts[z] || 1);
+                    const filter = viewport.filter;
+                    for (const tile of visible) {
+                        for (let c = 0; c < bins * bins; c++) {
+                            const count = tile.counts[c];
+                            const cluster = tile.clusters[c];
+                            if (count === 0 || (filter >= 0 && cluster !== filter)) continue;
+                            const gx = tile.x * bins + c % bins;
+                            const gy = tile.y * bins + Math.floor(c / bins);
+                            const sx0 = t.applyX(xScale(x0 + gx * cellWidth)), sx1 = t.applyX(xScale(x0 + (gx + 1) * cellWidth));
+                            const sy0 = t.applyY(yScale(y0 + gy * cellHeight)), sy1 = t.applyY(yScale(y0 + (gy + 1) * cellHeight));
+                            ctx.globalAlpha = 0.2 + 0.7 * Math.log1p(count) / maxCount;
+                            ctx.fillStyle = cluster === UNASSIGNED_CLUSTER ? "#6b7280" : `hsl(${clusterHue(cluster)}, 70%, 50%)`;
+                            ctx.fillRect(Math.min(sx0, sx1), Math.min(sy0, sy1), Math.abs(sx1 - sx0), Math.abs(sy1 - sy0));
                         }
-                        playIcon.classList.remove("hidden");
-                        pauseIcon.classList.add("hidden");
+                    }
+                    ctx.globalAlpha = 1;
+                }
 
-                        // Don't reset seekbar and labels here if you plan to implement a playlist/queue
-                        // For now, resetting is fine for single play.
-                        // seekBar.value = 0;
-                        // currentTimeLabel.textContent = "0:00";
+                // One filled path per hue bucket, as on the canvas board; returns the songs to label
+                const buckets = 36;
+                const batches = Array.from({ length: buckets }, () => []);
+                function drawPoints(visible, t) {
+                    const filter = viewport.filter;
+                    const onScreen = [];
+                    batches.forEach(coords => { coords.length = 0; });
+                    for (const tile of visible) {
+                        for (let j = 0; j < tile.ids.length; j++) {
+                            if (filter >= 0 && tile.cluster[j] !== filter) continue;
+                            const i = tile.ids[j];
+                            const sx = t.applyX(points.px[i]);
+                            const sy = t.applyY(points.py[i]);
+                            if (sx < -CULL_MARGIN || sx > width + CULL_MARGIN || sy < -CULL_MARGIN || sy > height + CULL_MARGIN) continue;
+                            onScreen.push(i);
+                            batches[Math.floor(tile.hues[j] / 360 * buckets) % buckets].push(sx, sy);
+                        }
+                    }
+                    ctx.globalAlpha = 0.7;
+                    batches.forEach((coords, b) => {
+                        if (coords.length === 0) return;
+                        ctx.fillStyle = `hsl(${(b + 0.5) * 360 / buckets}, 70%, 50%)`;
+                        ctx.beginPath();
+                        for (let k = 0; k < coords.length; k += 2) {
+                            ctx.moveTo(coords[k] + 10, coords[k + 1]);
+                            ctx.arc(coords[k], coords[k + 1], 10, 0, 2 * Math.PI);
+                        }
+                        ctx.fill();
                     });
+                    ctx.globalAlpha = 1;
+                    return onScreen.length <= LABEL_ALL_BELOW ? onScreen : [];
+                }
+
+                const renderer = createPointRenderer(canvas, points, viewport, () => {
+                    const t = renderer.transform;
+                    const z = viewport.level(t);
+                    const visible = viewport.visibleTiles(t).map(([tz, tx, ty]) => requestTile(tz, tx, ty)).filter(tile => tile);
+                    showingPoints = z === tiles.pointLevel;
+                    ctx.setTransform(dpr, 0, 0, dpr, 0, 0);
+                    ctx.clearRect(0, 0, width, height);
+                    let labelled = [];
+                    if (showingPoints) labelled = drawPoints(visible, t);
+                    else drawCells(visible, z, t);
+                    drawOverlay(ctx, points, renderer, labelled);
+                });
+                return renderer;
+            }
+
+            // Full tracks play through a small pool of audio elements, least recently used first out. Evicted elements
+            // drop their src so the browser can release the media it buffered for them.
+            const AUDIO_POOL_SIZE = 8;
+            let prefetchedAudio = null;
+
+            function createAudioEntry(index, songName, songUrl) {
+                const audio = new Audio(songUrl);
+                const entry = { audio, name: songName, index };
 
-                    audio.addEventListener("play", () => {
-                        d3.select(circleElement).classed("playing", true);
-                         if (!isNaN(audio.duration)) { // Ensure duration is available
+                // Prefetched tracks load while another one plays, so only the playing track drives the player
+                audio.addEventListener('loadedmetadata', () => {
+                    if (entry === playingAudio && !isNaN(audio.duration)) {
+                       totalDurationLabel.textContent = formatTime(audio.duration);
+                       seekBar.max = audio.duration;
+                    }
+                });
+
+                audio.addEventListener("timeupdate", () => {
+                    if (entry === playingAudio && !isNaN(audio.duration)) { // Check duration is a number
+                        seekBar.value = audio.currentTime;
+                        currentTimeLabel.textContent = formatTime(audio.currentTime);
+                        // Total duration is set on loadedmetadata, but can be reaffirmed here if needed
+                        if (totalDurationLabel.textContent === "0:00" || totalDurationLabel.textContent === "NaN:NaN") {
                             totalDurationLabel.textContent = formatTime(audio.duration);
                             seekBar.max = audio.duration;
                         }
-                    });
+                    }
+                });
 
-                    audio.addEventListener("pause", () => {
-                        d3.select(circleElement).classed("playing", false);
-                    });
+                audio.addEventListener("ended", () => {
+                    board.setPlaying(index, false);
+                    if (playingAudio && playingAudio.name === songName) {
+                        playingAudio = null; // Clear only if the ended song is the one currently marked as playing
+                    }
+                    playIcon.classList.remove("hidden");
+                    pauseIcon.classList.add("hidden");
+                });
 
+                audio.addEventListener("play", () => {
+                    board.setPlaying(index, true);
+                     if (!isNaN(audio.duration)) { // Ensure duration is available
+                        totalDurationLabel.textContent = formatTime(audio.duration);
+                        seekBar.max = audio.duration;
+                    }
+                });
+
+                audio.addEventListener("pause", () => {
+                    board.setPlaying(index, false);
+                });
+
+                return entry;
+            }
 
-                    audioElements[songName] = { audio, name: songName, circle: circleElement };
-                    playingAudio = audioElements[songName]; // Set current playing audio
+            // Returns the pooled element for a song, creating it if needed, and marks it as most recently used
+            function acquireAudio(index, songUrl) {
+                const songName = songs.name(index);
+                let entry = audioElements.get(songName);
+                if (entry) audioElements.delete(songName);
+                else entry = createAudioEntry(index, songName, songUrl);
+                audioElements.set(songName, entry);
+                evictAudio();
+                return entry;
+            }
+
+            function evictAudio() {
+                // Map iteration follows insertion order, i.e. least recently used first
+                for (const [name, entry] of audioElements) {
+                    if (audioElements.size <= AUDIO_POOL_SIZE) break;
+                    if (entry === playingAudio || entry === prefetchedAudio) continue;
+                    entry.audio.pause();
+                    entry.audio.removeAttribute("src");
+                    entry.audio.load();
+                    audioElements.delete(name);
+                }
+            }
 
-                    audio.play()
+            // Starts buffering a song that is about to play, so it starts without a gap
+            function prefetchSong(index) {
+                prefetchedAudio = acquireAudio(index, songLink(index));
+                prefetchedAudio.audio.preload = "auto";
+            }
+
+            function playSong(index, songUrl) {
+                stopPreview();
+                const songName = songs.name(index);
+                if (playingAudio && playingAudio.name !== songName) {
+                    playingAudio.audio.pause();
+                    board.setPlaying(playingAudio.index, false);
+                    // No need to reset playingAudio to null here yet,
+                    // it will be overwritten or handled if a new song starts
+                }
+
+                const entry = acquireAudio(index, songUrl);
+                const a = entry.audio;
+                if (a.paused) {
+                    playingAudio = entry; // Set current playing audio
+                    a.play()
                         .then(() => {
                             playIcon.classList.add("hidden");
                             pauseIcon.classList.remove("hidden");
                         })
                         .catch(e => console.error("Playback failed for " + songName + ":", e));
-
-                } else { // Audio element already exists
-                    const existingAudioData = audioElements[songName];
-                    const a = existingAudioData.audio;
-
-                    if (a.paused) {
-                        // If this song was paused, and it's different from the one that was globally "playingAudio"
-                        // (e.g. another song was clicked and paused), make sure to stop the other one.
-                        if (playingAudio && playingAudio.name !== songName) {
-                             playingAudio.audio.pause();
-                             d3.select(playingAudio.circle).classed("playing", false);
-                        }
-                        a.play().catch(e => console.error("Playback failed for "+songName+":", e));
-                        playingAudio = existingAudioData; // Set this as the current playing audio
-                    } else {
-                        a.pause();
-                        // If this song (which was playing) is paused, clear it from being the "playingAudio"
-                        if (playingAudio && playingAudio.name === songName) {
-                            playingAudio = null;
-                        }
+                } else {
+                    a.pause();
+                    // If this song (which was playing) is paused, clear it from being the "playingAudio"
+                    if (playingAudio && playingAudio.name === songName) {
+                        playingAudio = null;
                     }
                 }
             }
 
+            // Hover previews: short clips cut by `song_board.py previews`, played by a single reused element after a
+            // short dwell. Songs without a clip fall back to silence rather than to the full track.
+            const PREVIEW_DELAY_MS = 300;
+            const previewAudio = new Audio();
+            let previewTimer = null;
+            let previewIndex = -1;
+
+            function startPreview(i) {
+                if (!boardConfig.previewsUrl || i === previewIndex) return;
+                stopPreview();
+                const path = songPath(i);
+                if (path === undefined) return;
+                previewIndex = i;
+                previewTimer = setTimeout(() => {
+                    // Never talk over the song that is playing
+                    if (playingAudio && !playingAudio.audio.paused) return;
+                    previewAudio.src = boardConfig.previewsUrl + encodePath(path) + ".mp3";
+                    previewAudio.play().catch(() => {});
+                }, PREVIEW_DELAY_MS);
+            }
+
+            function stopPreview() {
+                clearTimeout(previewTimer);
+                previewIndex = -1;
+                if (previewAudio.getAttribute("src") === null) return;
+                previewAudio.pause();
+                previewAudio.removeAttribute("src");
+                previewAudio.load();
+            }
+
             seekBar.addEventListener("input", () => {
                 if (playingAudio && playingAudio.audio && !isNaN(playingAudio.audio.duration)) {
                     playingAudio.audio.currentTime = seekBar.value;
@@ -287,35 +1165,34 @@ def generate_interactive_song_board(song_embeddings, song_files):
             });
 
             document.getElementById("play-all").addEventListener("click", () => {
+                if (!board) return;
                 // Basic play all - plays one after another, interrupting previous.
                 // A more robust queue system would be needed for sequential play.
                 let currentSongIndex = 0;
-                const songsToPlay = Object.keys(songLinks);
+                const songsToPlay = d3.range(songs.count).filter(i => songLink(i));
+                // Tiled boards only know the songs of cached tiles, so the queued ones are kept (see songInUse)
+                queuedSongs.clear();
+                if (songs.tiles) songsToPlay.forEach(i => queuedSongs.add(i));
 
                 function playNextSong() {
                     if (currentSongIndex < songsToPlay.length) {
-                        const songName = songsToPlay[currentSongIndex];
-                        const songUrl = songLinks[songName];
-                        const circleElement = d3.selectAll(".song-circle").filter(d => d.song_name === songName).node();
-
-                        if (circleElement) {
-                            playSong(songName, songUrl, circleElement);
-                            // Listen for 'ended' to play the next song
-                            if (audioElements[songName] && audioElements[songName].audio) {
-                                const currentAudio = audioElements[songName].audio;
-                                const onEndedListener = () => {
-                                    currentAudio.removeEventListener('ended', onEndedListener); // Clean up listener
-                                    currentSongIndex++;
-                                    playNextSong();
-                                };
-                                currentAudio.addEventListener('ended', onEndedListener);
-                            } else { // If song couldn't be set up, try next
+                        const index = songsToPlay[currentSongIndex];
+                        const songName = songs.name(index);
+                        playSong(index, songLink(index));
+                        if (currentSongIndex + 1 < songsToPlay.length) prefetchSong(songsToPlay[currentSongIndex + 1]);
+                        queuedSongs.delete(index);
+                        // Listen for 'ended' to play the next song
+                        if (audioElements.has(songName)) {
+                            const currentAudio = audioElements.get(songName).audio;
+                            const onEndedListener = () => {
+                                currentAudio.removeEventListener('ended', onEndedListener); // Clean up listener
                                 currentSongIndex++;
                                 playNextSong();
-                            }
-                        } else { // If circle element not found, skip to next
-                             currentSongIndex++;
-                             playNextSong();
+                            };
+                            currentAudio.addEventListener('ended', onEndedListener);
+                        } else { // If song couldn't be set up, try next
+                            currentSongIndex++;
+                            playNextSong();
                         }
                     }
                 }
@@ -325,62 +1202,922 @@ def generate_interactive_song_board(song_embeddings, song_files):
             document.getElementById("pause-all").addEventListener("click", () => {
                 if (playingAudio && playingAudio.audio) {
                     playingAudio.audio.pause();
-                    // d3.select(playingAudio.circle).classed("playing", false); // Pause event listener should handle this
+                    // board.setPlaying(playingAudio.index, false); // Pause event listener should handle this
                     // playingAudio = null; // Let pause event listener handle this if needed
                 }
                 // To pause all audio elements regardless of 'playingAudio' state:
-                Object.values(audioElements).forEach(data => {
+                audioElements.forEach(data => {
                     if (data.audio && !data.audio.paused) {
                         data.audio.pause();
                     }
                 });
             });
 
-            // Defensive check for songData
-            if (songData && songData.length > 0) {
-                createSongBoard();
-            } else {
-                console.error("Song data is empty or not loaded correctly. Board not created.");
-                songBoard.html("<p class='text-red-500 p-4'>Error: No song data found to display.</p>");
-            }
+            loadSongs().then(loaded => {
+                songs = loaded;
+                if (songs.count > 0) {
+                    createSongBoard();
+                } else {
+                    console.error("Song data is empty or not loaded correctly. Board not created.");
+                    songBoard.html("<p class='text-red-500 p-4'>Error: No song data found to display.</p>");
+                }
+            }).catch(e => {
+                console.error("Failed to load song data:", e);
+                songBoard.html("<p class='text-red-500 p-4'>Error: Could not load the song data files. Binary boards must be served over HTTP.</p>");
+            });
 
         </script>
     </body>
     </html>
     """
-    return html_content
+
+
+def _js_literal(value):
+    # JSON is a valid JS literal; escaping "<" keeps a song name from closing the <script> tag
+    return json.dumps(value).replace("<", "\\u003c")
+
+
+def _iter_js_array_items(items, chunk_size):
+    # Serialises one chunk per json.dumps call and strips the brackets, so the chunks join into one array literal
+    chunk = []
+    separator = ""
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield separator + _js_literal(chunk)[1:-1]
+            separator = ",\n"
+            chunk = []
+    if chunk:
+        yield separator + _js_literal(chunk)[1:-1]
+
+
+def iter_interactive_song_board(song_embeddings, song_files, chunk_size=SONG_RECORD_CHUNK, data_url=None, renderer="svg",
+                                songs_url="songs/", neighbors=None, previews_url=None):
+    # Yields the page piece by piece: template head, song records in bounded chunks, then the tail.
+    # song_embeddings and song_files may be any iterables, so callers can stream them from disk.
+    # With data_url set the page fetches its records from a binary sidecar instead (see write_song_board_sidecar).
+    # song_files are paths relative to the songs directory, which the page reaches at songs_url; with previews_url
+    # set, hovering a song plays its preview clip from there (see song_previews.py).
+    # neighbors, an optional (songs, k) "similar songs" table, is inlined the same way unless it is in the sidecar,
+    # and so is the cluster index when the records carry cluster ids.
+    if renderer not in RENDERERS:
+        raise ValueError(f"Unknown renderer: {renderer!r}")
+    yield _PAGE_HEAD
+    yield "            const boardConfig = " + _js_literal({"dataUrl": data_url, "renderer": renderer, "songsUrl": songs_url,
+                                                             "previewsUrl": previews_url}) + ";\n"
+    yield "            // Inline song records and file names are emitted as plain array literals, in chunks\n"
+    yield "            const songData = ["
+    xs, ys, clusters = array("f"), array("f"), array("H")
+    if data_url is None:
+        yield from _iter_js_array_items(_collect_coordinates(song_embeddings, xs, ys, clusters), chunk_size)
+    yield _PAGE_MIDDLE
+    yield from _iter_js_array_items(song_files, chunk_size)
+    yield "];\n"
+    index = cluster_index = None
+    if data_url is None:
+        xs, ys = np.frombuffer(xs, dtype=np.float32), np.frombuffer(ys, dtype=np.float32)
+        index = build_song_grid_index(xs, ys)
+        cluster_index = build_cluster_index(np.frombuffer(clusters, dtype=np.uint16), xs, ys)
+    yield "            const songGridIndex = " + _js_literal(_inline_grid_index(index)) + ";\n"
+    yield "            const songNeighbors = " + _js_literal(_inline_neighbors(None if data_url else neighbors)) + ";\n"
+    yield "            const songClusters = " + _js_literal(_inline_cluster_index(cluster_index)) + ";\n"
+    yield _PAGE_TAIL
+
+
+def write_interactive_song_board(f, song_embeddings, song_files, chunk_size=SONG_RECORD_CHUNK, data_url=None, renderer="svg",
+                                 songs_url="songs/", neighbors=None, previews_url=None):
+    for part in iter_interactive_song_board(song_embeddings, song_files, chunk_size, data_url, renderer, songs_url,
+                                            neighbors, previews_url):
+        f.write(part)
+
+
+def generate_interactive_song_board(song_embeddings, song_files):
+    return "".join(iter_interactive_song_board(song_embeddings, song_files))
+
+
+def _collect_coordinates(records, xs, ys, clusters):
+    # Passes records through unchanged while keeping their x/y as float32 and their cluster as uint16, 10 bytes per
+    # song, for the grid and cluster indexes
+    nan = float("nan")
+    for record in records:
+        x, y, cluster = record.get("x"), record.get("y"), record.get("cluster")
+        xs.append(nan if x is None else x)
+        ys.append(nan if y is None else y)
+        clusters.append(UNASSIGNED_CLUSTER if cluster is None else cluster)
+        yield record
+
+
+def _grid_cells(u, v, size):
+    cx = np.clip((u * size).astype(np.int64), 0, size - 1)
+    cy = np.clip((v * size).astype(np.int64), 0, size - 1)
+    return cy * size + cx
+
+
+def build_song_grid_index(xs, ys, labels_per_cell=LABELS_PER_CELL, label_levels=LABEL_LEVELS):
+    # Precomputes the spatial index the page uses while zooming:
+    # - a uniform culling grid over the projected extent: "order" lists song indices cell by cell (row-major) and
+    #   cell c holds order[offsets[c]:offsets[c + 1]], so the page only visits cells that intersect the viewport;
+    # - "label_level", the coarsest label level at which each song is among the first labels_per_cell songs of its
+    #   cell (255 = never), which caps the label density per zoom level.
+    # Songs with non-finite coordinates are left out of the grid.
+    xs = np.asarray(xs, dtype=np.float32)
+    ys = np.asarray(ys, dtype=np.float32)
+    count = len(xs)
+    finite = np.isfinite(xs) & np.isfinite(ys)
+    if finite.any():
+        extent = [float(xs[finite].min()), float(xs[finite].max()), float(ys[finite].min()), float(ys[finite].max())]
+    else:
+        extent = [0.0, 1.0, 0.0, 1.0]
+    u = (np.where(finite, xs, extent[0]) - extent[0]) / max(extent[1] - extent[0], 1e-12)
+    v = (np.where(finite, ys, extent[2]) - extent[2]) / max(extent[3] - extent[2], 1e-12)
+
+    grid_size = 1 << int(np.clip(np.round(np.log2(max(np.sqrt(finite.sum() / GRID_CELL_SONGS), 1))), 0, 10))
+    cells = np.where(finite, _grid_cells(u, v, grid_size), grid_size * grid_size)
+    order = np.argsort(cells, kind="stable")
+    offsets = np.searchsorted(cells[order], np.arange(grid_size * grid_size + 1))
+    order = order[:offsets[-1]]
+
+    label_level = np.full(count, 255, dtype=np.uint8)
+    positions = np.arange(count)
+    for level in range(label_levels):
+        level_cells = np.where(finite, _grid_cells(u, v, 1 << level), -1)
+        level_order = np.argsort(level_cells, kind="stable")
+        sorted_cells = level_cells[level_order]
+        rank = positions - np.searchsorted(sorted_cells, sorted_cells)
+        chosen = level_order[(rank < labels_per_cell) & (sorted_cells >= 0)]
+        label_level[chosen] = np.minimum(label_level[chosen], level)
+
+    return {
+        "extent": extent,
+        "grid_size": grid_size,
+        "base_level": LABEL_BASE_LEVEL,
+        "order": order.astype("<u4"),
+        "offsets": offsets.astype("<u4"),
+        "label_level": label_level,
+    }
+
+
+def _inline_grid_index(index):
+    # Inline pages carry the index arrays as base64 strings; binary pages fetch them as sidecar files instead
+    if index is None:
+        return None
+    meta = {key: index[key] for key in ("extent", "grid_size", "base_level")}
+    meta.update({key: base64.b64encode(index[key].tobytes()).decode("ascii") for key in GRID_INDEX_FILES})
+    return meta
+
+
+def build_cluster_index(clusters, xs, ys):
+    # Member lists and layout centroids the page's cluster filter works from: "cluster_order" lists song indices
+    # cluster by cluster, cluster c holds cluster_order[cluster_offsets[c]:cluster_offsets[c + 1]], and centroids[c]
+    # is the mean x/y of its songs (None for ids without songs). Unassigned songs and songs with non-finite
+    # coordinates are left out. Returns None when no song has a cluster.
+    clusters = np.asarray(clusters, dtype=np.int64)
+    xs = np.asarray(xs, dtype=np.float32)
+    ys = np.asarray(ys, dtype=np.float32)
+    member = np.isfinite(xs) & np.isfinite(ys) & (clusters != UNASSIGNED_CLUSTER)
+    if not member.any():
+        return None
+    count = int(clusters[member].max()) + 1
+    keys = np.where(member, clusters, count)
+    order = np.argsort(keys, kind="stable")
+    offsets = np.searchsorted(keys[order], np.arange(count + 1))
+    sizes = np.diff(offsets)
+    sum_x = np.bincount(keys[member], weights=xs[member], minlength=count)
+    sum_y = np.bincount(keys[member], weights=ys[member], minlength=count)
+    centroids = [[float(x / size), float(y / size)] if size else None for x, y, size in zip(sum_x, sum_y, sizes)]
+    return {
+        "count": count,
+        "centroids": centroids,
+        "cluster_order": order[:offsets[-1]].astype("<u4"),
+        "cluster_offsets": offsets.astype("<u4"),
+    }
+
+
+def _inline_cluster_index(index):
+    if index is None:
+        return None
+    meta = {key: index[key] for key in ("count", "centroids")}
+    meta.update({key: base64.b64encode(index[key].tobytes()).decode("ascii") for key in CLUSTER_INDEX_FILES})
+    return meta
+
+
+def _write_cluster_index(data_dir, manifest, index):
+    # Adds the cluster member lists to a sidecar manifest, or drops stale ones when the songs have no clusters
+    if index is None:
+        for key in CLUSTER_INDEX_FILES:
+            manifest["columns"].pop(key, None)
+        manifest.pop("clusters", None)
+        return
+    for key, file_name in CLUSTER_INDEX_FILES.items():
+        index[key].tofile(os.path.join(data_dir, file_name))
+        manifest["columns"][key] = file_name
+    manifest["clusters"] = {key: index[key] for key in ("count", "centroids")}
+    # Tiled pages do not fetch the member lists, so they size the clusters from the manifest
+    manifest["clusters"]["sizes"] = np.diff(index["cluster_offsets"]).tolist()
+
+
+def _inline_neighbors(neighbors):
+    if neighbors is None:
+        return None
+    return {"k": neighbors.shape[1], "ids": base64.b64encode(neighbors.astype("<i4").tobytes()).decode("ascii")}
+
+
+def _write_neighbors(data_dir, manifest, neighbors, rows=None):
+    # Adds the "similar songs" table to a sidecar manifest, or drops a stale one when this run has none. With rows,
+    # only those rows (and any the table grew by) are rewritten, provided the sidecar already has a table of that k.
+    if neighbors is None:
+        manifest["columns"].pop("neighbors", None)
+        manifest.pop("neighbors", None)
+        return
+    path = os.path.join(data_dir, NEIGHBORS_FILE)
+    k = neighbors.shape[1]
+    if rows is not None and manifest.get("neighbors", {}).get("k") == k and os.path.exists(path):
+        neighbors = neighbors.astype("<i4", copy=False)
+        stored_rows = os.path.getsize(path) // (k * 4)
+        with open(path, "r+b") as f:
+            f.truncate(neighbors.nbytes)
+            for row in np.union1d(rows, np.arange(stored_rows, len(neighbors))):
+                f.seek(int(row) * k * 4)
+                f.write(neighbors[row].tobytes())
+    else:
+        neighbors.astype("<i4").tofile(path)
+    manifest["columns"]["neighbors"] = NEIGHBORS_FILE
+    manifest["neighbors"] = {"k": neighbors.shape[1]}
+
+
+def _write_little_endian(f, values):
+    if sys.byteorder == "big":
+        values.byteswap()
+    values.tofile(f)
+
+
+def write_song_board_sidecar(data_dir, song_embeddings, chunk_size=SONG_RECORD_CHUNK, neighbors=None, has_clusters=None):
+    # Writes the records as packed little-endian columns (float32 x/y/z, uint16 cluster) and the song names as a
+    # UTF-8 string table indexed by uint32 offsets, so the page can wrap every file in a typed array without parsing.
+    # has_clusters says whether there is a cluster column; when None it is taken from the first record, like z.
+    # Records missing an optional column get NaN / 0xFFFF.
+    os.makedirs(data_dir, exist_ok=True)
+    records = iter(song_embeddings)
+    first = next(records, None)
+    if has_clusters is None:
+        has_clusters = first is not None and "cluster" in first
+    columns = ["x", "y"] + (["z"] if first is not None and "z" in first else []) + (["cluster"] if has_clusters else [])
+    xs, ys, clusters = array("f"), array("f"), array("H")
+    records = _collect_coordinates(itertools.chain([first] if first is not None else [], records), xs, ys, clusters)
+    count = 0
+    name_offset = 0
+
+    with ExitStack() as stack:
+        column_files = {c: stack.enter_context(open(os.path.join(data_dir, SIDECAR_COLUMNS[c][0]), "wb")) for c in columns}
+        names_file = stack.enter_context(open(os.path.join(data_dir, "names.utf8"), "wb"))
+        offsets_file = stack.enter_context(open(os.path.join(data_dir, "name_offsets.u32"), "wb"))
+        _write_little_endian(offsets_file, array(_UINT32, [0]))
+
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) < chunk_size:
+                continue
+            name_offset = _write_sidecar_chunk(chunk, columns, column_files, names_file, offsets_file, name_offset)
+            count += len(chunk)
+            chunk = []
+        if chunk:
+            _write_sidecar_chunk(chunk, columns, column_files, names_file, offsets_file, name_offset)
+            count += len(chunk)
+
+    xs, ys = np.frombuffer(xs, dtype=np.float32), np.frombuffer(ys, dtype=np.float32)
+    index = build_song_grid_index(xs, ys)
+    for key, file_name in GRID_INDEX_FILES.items():
+        index[key].tofile(os.path.join(data_dir, file_name))
+    cluster_index = None
+    if "cluster" in columns:
+        cluster_index = build_cluster_index(np.frombuffer(clusters, dtype=np.uint16), xs, ys)
+
+    # The manifest goes last, so an interrupted run never leaves a sidecar that looks complete
+    manifest = {"count": count, "columns": {c: SIDECAR_COLUMNS[c][0] for c in columns}}
+    manifest["columns"].update(names="names.utf8", name_offsets="name_offsets.u32", **GRID_INDEX_FILES)
+    manifest["index"] = {key: index[key] for key in ("extent", "grid_size", "base_level")}
+    _write_neighbors(data_dir, manifest, neighbors)
+    _write_cluster_index(data_dir, manifest, cluster_index)
+    with open(os.path.join(data_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def _write_sidecar_chunk(chunk, columns, column_files, names_file, offsets_file, name_offset):
+    for column in columns:
+        _, typecode, missing = SIDECAR_COLUMNS[column]
+        values = [record.get(column) for record in chunk]
+        _write_little_endian(column_files[column], array(typecode, [missing if v is None else v for v in values]))
+
+    offsets = array(_UINT32)
+    for record in chunk:
+        encoded = record["song_name"].encode("utf-8")
+        names_file.write(encoded)
+        name_offset += len(encoded)
+        offsets.append(name_offset)
+    _write_little_endian(offsets_file, offsets)
+    return name_offset
+
+
+def layout_song_store(store, method="pca", n_components=2):
+    # Projects the store's raw embedding vectors and yields board records carrying x/y (and z for 3D layouts)
+    if store.vectors is None:
+        raise ValueError("The songs have no 'embedding' vectors to project.")
+    return store.board_records(project_embeddings(store.vectors, method, n_components))
+
+
+def layout_song_store_incremental(store, state_dir, method="pca", n_components=2):
+    # Like layout_song_store, but keeps the layout of unchanged songs from the previous run (see
+    # layout_state.update_layout). Returns the board records in slot order - removed songs stay behind as
+    # tombstones with NaN coordinates - and the changed slots, or None when everything was laid out again.
+    if store.vectors is None:
+        raise ValueError("The songs have no 'embedding' vectors to project.")
+    names = list(store.names)
+    update = update_layout(state_dir, names, store.vectors, method, n_components)
+    # Rows sharing a name fill that name's slots in order, as in update_layout
+    rows_of = {}
+    for row, name in enumerate(names):
+        rows_of.setdefault(name, deque()).append(row)
+    records = []
+    for name, point in zip(update.names, update.layout.tolist()):
+        record = {"song_name": name or ""}
+        record.update(zip("xyz", point))
+        if store.cluster is not None:
+            # Tombstones keep the column too, so that removing a song never drops the cluster ids of the board
+            rows = rows_of.get(name)
+            record["cluster"] = int(store.cluster[rows.popleft()]) if rows else UNASSIGNED_CLUSTER
+        records.append(record)
+    return records, None if update.full else update.changed
+
+
+def apply_song_clusters(records, clusters):
+    # Yields the board records with their ids from a {song name: cluster} map (see song_clusters.read_cluster_csv);
+    # songs the map does not list are unassigned
+    for record in records:
+        record["cluster"] = clusters.get(record["song_name"], UNASSIGNED_CLUSTER)
+        yield record
+
+
+def song_store_neighbors(store, k=SIMILAR_SONGS, backend="auto"):
+    # The k most similar songs of every board entry, from the raw embedding vectors. Incremental boards keep their
+    # table in the layout state instead (see layout_state.update_neighbors).
+    if store.vectors is None:
+        raise ValueError("The songs have no 'embedding' vectors to compare.")
+    return song_neighbors(store.vectors, k, backend)
+
+
+def patch_song_board_sidecar(data_dir, slots, records, slot_count, neighbors=None, clusters=None, neighbor_rows=None):
+    # Rewrites the given slots of an existing sidecar in place instead of writing it again. Slots past the current
+    # count are appended and must continue it without gaps; existing slots keep their name. The grid index is
+    # rebuilt from the patched x/y columns, which is linear in the catalogue but cheap next to a layout, and so are
+    # the names after the first removed song, which lose their name as in a full rewrite. A new song
+    # can be similar to any old one, so the neighbour table is replaced as a whole unless neighbor_rows lists the rows
+    # that changed (see layout_state.update_neighbors). Reclustering can move any song, so clusters, the cluster id of
+    # every slot, also replaces the whole cluster column.
+    with open(os.path.join(data_dir, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    count = manifest["count"]
+    order = sorted(range(len(slots)), key=lambda i: slots[i])
+    slots = [int(slots[i]) for i in order]
+    records = [records[i] for i in order]
+    appended = [record for slot, record in zip(slots, records) if slot >= count]
+    if appended and slots[-len(appended):] != list(range(count, count + len(appended))):
+        raise ValueError("Appended sidecar slots must directly follow the existing ones.")
+    if count + len(appended) != slot_count:
+        raise ValueError(f"The sidecar holds {count} songs, the layout {slot_count - len(appended)}.")
+    if ("cluster" in manifest["columns"]) != (clusters is not None):
+        raise ValueError("The songs gained or lost their cluster ids.")
+    _check_sidecar_names(data_dir, [(slot, record) for slot, record in zip(slots, records) if slot < count])
+    _blank_sidecar_names(data_dir, [slot for slot, record in zip(slots, records) if slot < count and not record["song_name"]])
+
+    for column in (c for c in SIDECAR_COLUMNS if c in manifest["columns"] and c != "cluster"):
+        file_name, typecode, missing = SIDECAR_COLUMNS[column]
+        with open(os.path.join(data_dir, file_name), "r+b") as f:
+            for slot, record in zip(slots, records):
+                value = record.get(column)
+                f.seek(slot * array(typecode).itemsize)
+                _write_little_endian(f, array(typecode, [missing if value is None else value]))
+
+    with open(os.path.join(data_dir, "names.utf8"), "ab") as names_file, \
+            open(os.path.join(data_dir, "name_offsets.u32"), "ab") as offsets_file:
+        name_offset = os.path.getsize(os.path.join(data_dir, "names.utf8"))
+        _write_sidecar_chunk(appended, [], {}, names_file, offsets_file, name_offset)
+
+    xs = np.fromfile(os.path.join(data_dir, SIDECAR_COLUMNS["x"][0]), dtype="<f4")
+    ys = np.fromfile(os.path.join(data_dir, SIDECAR_COLUMNS["y"][0]), dtype="<f4")
+    index = build_song_grid_index(xs, ys)
+    for key, file_name in GRID_INDEX_FILES.items():
+        index[key].tofile(os.path.join(data_dir, file_name))
+    cluster_index = None
+    if clusters is not None:
+        clusters = np.asarray(clusters, dtype="<u2")
+        clusters.tofile(os.path.join(data_dir, SIDECAR_COLUMNS["cluster"][0]))
+        cluster_index = build_cluster_index(clusters, xs, ys)
+    manifest["count"] = count + len(appended)
+    manifest["index"] = {key: index[key] for key in ("extent", "grid_size", "base_level")}
+    # The tile pyramid no longer matches the columns; tiled boards build it again afterwards
+    manifest.pop("tiles", None)
+    _write_neighbors(data_dir, manifest, neighbors, neighbor_rows)
+    _write_cluster_index(data_dir, manifest, cluster_index)
+    with open(os.path.join(data_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def _blank_sidecar_names(data_dir, slots):
+    # Empties the names of the given slots. Names are packed back to back, so the ones after the first of them move.
+    if not slots:
+        return
+    offsets_path = os.path.join(data_dir, "name_offsets.u32")
+    offsets = np.fromfile(offsets_path, dtype="<u4").astype(np.int64)
+    first = min(slots)
+    keep = np.ones(offsets[-1] - offsets[first], dtype=bool)
+    lengths = np.diff(offsets[first:])
+    for slot in slots:
+        keep[offsets[slot] - offsets[first]:offsets[slot + 1] - offsets[first]] = False
+        lengths[slot - first] = 0
+    with open(os.path.join(data_dir, "names.utf8"), "r+b") as f:
+        f.seek(int(offsets[first]))
+        tail = np.frombuffer(f.read(), dtype=np.uint8)
+        f.seek(int(offsets[first]))
+        f.write(tail[keep].tobytes())
+        f.truncate()
+    offsets[first + 1:] = offsets[first] + np.cumsum(lengths)
+    offsets.astype("<u4").tofile(offsets_path)
+
+
+def _check_sidecar_names(data_dir, slot_records):
+    # Guards against patching a sidecar that was written from a different slot order
+    offsets = np.fromfile(os.path.join(data_dir, "name_offsets.u32"), dtype="<u4")
+    with open(os.path.join(data_dir, "names.utf8"), "rb") as f:
+        for slot, record in slot_records:
+            if not record["song_name"]:
+                continue  # tombstone of a removed song
+            f.seek(int(offsets[slot]))
+            if f.read(int(offsets[slot + 1] - offsets[slot])).decode("utf-8") != record["song_name"]:
+                raise ValueError(f"Sidecar slot {slot} does not hold {record['song_name']!r}.")
+
+
+def song_file_paths(song_files):
+    # {song name: file} the way the page links songs: a name is either a path relative to the songs directory or,
+    # when only one file has it, a bare file name
+    paths = {song_file: song_file for song_file in song_files}
+    base_names = Counter(song_file.rsplit("/", 1)[-1] for song_file in song_files)
+    for song_file in song_files:
+        base_name = song_file.rsplit("/", 1)[-1]
+        if base_names[base_name] == 1:
+            paths.setdefault(base_name, song_file)
+    return paths
+
+
+def write_song_board_tiles(data_dir, manifest, song_files):
+    # Builds the tile pyramid (see song_tiles.py) from a sidecar's columns and adds it to the manifest, which is
+    # written again last
+    def column(name, dtype):
+        return np.fromfile(os.path.join(data_dir, manifest["columns"][name]), dtype=dtype)
+
+    clusters = column("cluster", "<u2") if "cluster" in manifest["columns"] else None
+    names = NameTable(column("names", np.uint8), column("name_offsets", "<u4"))
+    manifest["tiles"] = write_tile_pyramid(data_dir, manifest["index"]["extent"], column("x", "<f4"), column("y", "<f4"),
+                                           clusters, names, song_file_paths(song_files))
+    with open(os.path.join(data_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def board_output_bytes(output_html_path, data_format="inline"):
+    # Size of a generated board as a stand-in for what it costs the browser: everything written, and what the page
+    # loads before its first frame (all columns of a binary sidecar, but only the top tiles of a tiled one)
+    html_bytes = os.path.getsize(output_html_path)
+    sizes = {"html_bytes": html_bytes, "data_bytes": 0, "initial_bytes": html_bytes}
+    if data_format == "inline":
+        return sizes
+    data_dir = os.path.splitext(output_html_path)[0] + "_data"
+    sizes["data_bytes"] = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(data_dir) for f in files)
+    manifest_path = os.path.join(data_dir, "manifest.json")
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if "tiles" in manifest:
+        sizes["initial_bytes"] += os.path.getsize(manifest_path) + initial_tile_bytes(data_dir, manifest["tiles"])
+    else:
+        sizes["initial_bytes"] += sizes["data_bytes"]
+    return sizes
+
+
+# URL prefixes of the songs and preview clips on the serve command's server
+SERVE_SONGS_PREFIX = "/songs/"
+SERVE_PREVIEWS_PREFIX = "/previews/"
+# The page's boardConfig line is looked for within this many bytes of its start
+_BOARD_CONFIG_SEARCH_BYTES = 1 << 16
+
+
+class _PrefixedFile:
+    # A served page whose beginning was rewritten: head, then the rest of the open file
+    def __init__(self, head, rest):
+        self.head = head
+        self.rest = rest
+
+    def read(self, size=-1):
+        if self.head:
+            data, self.head = (self.head, b"") if size < 0 else (self.head[:size], self.head[size:])
+            return data
+        return self.rest.read(size)
+
+    def close(self):
+        self.rest.close()
+
+
+class SongBoardRequestHandler(SimpleHTTPRequestHandler):
+    # Serves one board and nothing else: the page and its "<name>_data" directory under "/", the songs directory
+    # under SERVE_SONGS_PREFIX and the previews directory under SERVE_PREVIEWS_PREFIX. Any other path, including the
+    # rest of the page's directory, is a 404, and directories are never listed. The page is sent with its song and
+    # preview URLs pointing at those prefixes, wherever the directories are on disk.
+    page_path = None
+    songs_dir = None
+    previews_dir = None
+
+    def _route(self):
+        # (directory, path below it) for the request, or None
+        url_path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        page_name = os.path.basename(self.page_path)
+        data_prefix = "/" + os.path.splitext(page_name)[0] + "_data/"
+        routes = [(data_prefix, os.path.splitext(self.page_path)[0] + "_data"), (SERVE_SONGS_PREFIX, self.songs_dir)]
+        if self.previews_dir:
+            routes.append((SERVE_PREVIEWS_PREFIX, self.previews_dir))
+        if url_path in ("/", "/" + page_name):
+            return os.path.dirname(self.page_path), "/" + page_name
+        for prefix, directory in routes:
+            if url_path.startswith(prefix):
+                return directory, "/" + url_path[len(prefix):]
+        return None
+
+    def send_head(self):
+        route = self._route()
+        if route is None:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+        self.directory, self.path = route[0], urllib.parse.quote(route[1])
+        path = self.translate_path(self.path)
+        if path == self.page_path:
+            return self._send_page()
+        if os.path.isdir(path):
+            return self.list_directory(path)
+        return super().send_head()
+
+    def _send_page(self):
+        f = open(self.page_path, "rb")
+        size = os.fstat(f.fileno()).st_size
+        head = f.read(_BOARD_CONFIG_SEARCH_BYTES)
+        marker = b"const boardConfig = "
+        start = head.find(marker)
+        end = head.find(b";\n", start)
+        if start >= 0 and end >= 0:
+            config = json.loads(head[start + len(marker):end])
+            config["songsUrl"] = SERVE_SONGS_PREFIX
+            config["previewsUrl"] = SERVE_PREVIEWS_PREFIX if self.previews_dir else None
+            literal = _js_literal(config).encode("utf-8")
+            size += len(literal) - (end - start - len(marker))
+            head = head[:start + len(marker)] + literal + head[end:]
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        return _PrefixedFile(head, f)
+
+    def list_directory(self, path):
+        self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+        return None
+
+
+def serve_song_board(output_html_path, songs_dir="songs", previews_dir=None, bind="127.0.0.1", port=8000):
+    # Small static file server standing in for real hosting: binary and tiled pages fetch their data, which browsers
+    # refuse for pages opened from disk. Only the board, its songs and its previews are reachable (see
+    # SongBoardRequestHandler).
+    handler = type("Handler", (SongBoardRequestHandler,), {
+        "page_path": os.path.abspath(output_html_path),
+        "songs_dir": os.path.abspath(songs_dir),
+        "previews_dir": os.path.abspath(previews_dir) if previews_dir and os.path.isdir(previews_dir) else None,
+    })
+    with ThreadingHTTPServer((bind, port), handler) as server:
+        page_url = urllib.parse.quote(os.path.basename(output_html_path))
+        print(f"Serving {output_html_path} at http://{bind}:{server.server_address[1]}/{page_url} (Ctrl+C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def write_song_board(output_html_path, song_embeddings, song_files, data_format="inline", chunk_size=SONG_RECORD_CHUNK,
+                     renderer="svg", changed_slots=None, songs_dir="songs", neighbors=None, previews_dir=None,
+                     has_clusters=None, neighbor_rows=None):
+    # Binary and tiled boards keep their records in a "<name>_data" directory next to the HTML file. With
+    # changed_slots set (from layout_song_store_incremental) an existing sidecar is patched in place at those slots
+    # only; the tile pyramid is always built again from the sidecar. Tiled pages carry neither the song file list
+    # nor the similar songs, since songs only reach the page with their tiles, which hold their file paths.
+    # Song and preview links are made relative to the HTML file, so the page works wherever both are served from.
+    # Previews are only linked when previews_dir exists. has_clusters says whether the records carry cluster ids
+    # (None: see whether the first one does). neighbor_rows, the rows of neighbors that changed, lets a patched
+    # sidecar rewrite only those.
+    if data_format not in DATA_FORMATS:
+        raise ValueError(f"Unknown data format: {data_format!r}")
+    data_url = None
+    if data_format != "inline":
+        stem = os.path.splitext(os.path.basename(output_html_path))[0]
+        data_url = stem + "_data"
+        data_dir = os.path.join(os.path.dirname(output_html_path), data_url)
+        patched = False
+        if changed_slots is not None and os.path.exists(os.path.join(data_dir, "manifest.json")):
+            song_embeddings = list(song_embeddings)
+            if has_clusters is None:
+                has_clusters = bool(song_embeddings) and "cluster" in song_embeddings[0]
+            clusters = None
+            if has_clusters:
+                clusters = [record.get("cluster", UNASSIGNED_CLUSTER) for record in song_embeddings]
+            try:
+                manifest = patch_song_board_sidecar(data_dir, changed_slots,
+                                                    [song_embeddings[slot] for slot in changed_slots],
+                                                    len(song_embeddings), neighbors, clusters, neighbor_rows)
+                patched = True
+            except ValueError as e:
+                print(f"Rewriting the whole sidecar: {e}")
+        if not patched:
+            manifest = write_song_board_sidecar(data_dir, song_embeddings, chunk_size, neighbors, has_clusters)
+        if data_format == "tiles":
+            write_song_board_tiles(data_dir, manifest, song_files)
+            song_files = ()
+            neighbors = None
+        song_embeddings = ()
+
+    page_dir = os.path.dirname(os.path.abspath(output_html_path))
+    songs_url = os.path.relpath(songs_dir, page_dir).replace(os.sep, "/") + "/"
+    previews_url = None
+    if previews_dir and os.path.isdir(previews_dir):
+        previews_url = os.path.relpath(previews_dir, page_dir).replace(os.sep, "/") + "/"
+    with open(output_html_path, "w", encoding="utf-8") as f:
+        write_interactive_song_board(f, song_embeddings, song_files, chunk_size, data_url, renderer, songs_url, neighbors,
+                                     previews_url)
+
 
 if __name__ == "__main__":
-    input_json_path = 'song_embeddings.json' # Make sure this file exists and is correct
+    # Options the cluster command reads as well; they are accepted before or after it
+    shared_options = [
+        ("--neighbors", dict(type=int, default=SIMILAR_SONGS, metavar="K",
+                             help="Store the K most similar songs (by embedding) of every song, highlighted on click; "
+                                  "0 disables.")),
+        ("--neighbor-index", dict(choices=NEIGHBOR_BACKENDS, default="auto",
+                                  help="How the similar songs are found: exhaustive search, numpy IVF, faiss or hnswlib.")),
+        ("--clusters", dict(default="df_clusters.csv",
+                            help="CSV of song_name and cluster the songs are coloured and filtered by, as written by the "
+                                 "notebook or the cluster command; ignored when missing ('' to disable).")),
+        ("--profile", dict(metavar="JSON",
+                           help="Write the wall time and peak RSS of every stage, and the output bytes per song, to this "
+                                "file (board generation and the cluster command).")),
+    ]
 
-    try:
-        with open(input_json_path, 'r') as f:
-            song_embeddings_data = json.load(f)
-        # Ensure song_embeddings_data is a list of objects as expected by D3
-        if not isinstance(song_embeddings_data, list):
-            print(f"Error: {input_json_path} should contain a JSON list of song objects.")
-            # Provide a default empty list or sample structure if needed for testing
-            song_embeddings_data = []
-            # Example: song_embeddings_data = [{"song_name": "example.mp3", "x": 0.5, "y": 0.5}]
-        print(f"Loaded embeddings from {input_json_path}")
-    except FileNotFoundError:
-        print(f"Error: Embeddings file '{input_json_path}' not found. Using empty data.")
-        song_embeddings_data = []
-    except json.JSONDecodeError:
-        print(f"Error: Could not decode JSON from '{input_json_path}'. Using empty data.")
-        song_embeddings_data = []
-    except Exception as e:
-        print(f"Failed to load embeddings: {e}. Using empty data.")
-        song_embeddings_data = []
+    parser = argparse.ArgumentParser(description="Generate the interactive song board.")
+    for flag, options in shared_options:
+        parser.add_argument(flag, **options)
+    parser.add_argument("--input", default="song_embeddings.json",
+                        help="Song embeddings JSON file, or an embedding store directory (see the convert command).")
+    parser.add_argument("--songs-dir", default="songs", help="Directory holding the audio files.")
+    parser.add_argument("--scan-index", default=".song_scan_index.json",
+                        help="File that caches the songs directory listing between runs ('' to disable).")
+    parser.add_argument("--scan-workers", type=int, default=SCAN_WORKERS, help="Threads listing directories in parallel.")
+    parser.add_argument("--previews-dir", default="previews",
+                        help="Preview clips played on hover (see the previews command); ignored when missing.")
+    parser.add_argument("--output", default="interactive_song_board.html", help="HTML file to write.")
+    parser.add_argument("--data-format", choices=DATA_FORMATS, default="inline",
+                        help="'inline' embeds the records in the page; 'binary' writes packed typed-array files next to it "
+                             "and 'tiles' adds a zoom-level tile pyramid the page fetches as it pans and zooms (both "
+                             "have to be served over HTTP, see the serve command).")
+    parser.add_argument("--renderer", choices=RENDERERS, default="svg",
+                        help="How the page draws songs; use canvas or webgl for boards past ~10k songs.")
+    parser.add_argument("--projection", choices=("auto",) + PROJECTION_METHODS, default="auto",
+                        help="Lay out raw 'embedding' vectors with this method. 'auto' keeps precomputed x/y and "
+                             "falls back to pca when the records only carry embeddings.")
+    parser.add_argument("--dims", type=int, choices=(2, 3), default=2, help="Number of layout dimensions to compute.")
+    parser.add_argument("--incremental", metavar="STATE_DIR",
+                        help="Keep the layout and embedding fingerprints in STATE_DIR and only place new or changed "
+                             "songs into it; with --data-format binary only their sidecar entries are rewritten. "
+                             "Needs a layout to compute: with precomputed x/y, also pass --projection.")
+
+    subparsers = parser.add_subparsers(dest="command")
+    convert_parser = subparsers.add_parser("convert", help="Convert song_embeddings.json into a memory-mapped embedding store.")
+    convert_parser.add_argument("source", help="Song embeddings JSON file.")
+    convert_parser.add_argument("store", help="Store directory to write.")
+    previews_parser = subparsers.add_parser("previews", help="Cut short low-bitrate preview clips of the songs in "
+                                                             "--songs-dir into --previews-dir with ffmpeg.")
+    previews_parser.add_argument("--seconds", type=int, default=PREVIEW_SECONDS, help="Length of each clip.")
+    previews_parser.add_argument("--bitrate", default=PREVIEW_BITRATE, help="MP3 bitrate of the clips.")
+    previews_parser.add_argument("--workers", type=int, default=PREVIEW_WORKERS, help="ffmpeg processes run in parallel.")
+    embed_parser = subparsers.add_parser("embed", help="Embed the songs in --songs-dir with the trained model into an "
+                                                       "embedding store (resumes an interrupted run).")
+    embed_parser.add_argument("--model", required=True, help="TorchScript file or pickled model from the notebook.")
+    embed_parser.add_argument("--store", default="song_embeddings.store", help="Embedding store directory to write.")
+    embed_parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SONGS,
+                              help="Songs per model call (each is 100 segments of 30,000 samples).")
+    embed_parser.add_argument("--workers", type=int, default=DECODE_WORKERS, help="Processes decoding audio in parallel.")
+    embed_parser.add_argument("--padded", action="store_true",
+                              help="Pad every song to 100 segments even when the model supports packed inference.")
+    embed_parser.add_argument("--segment-cache", default=".segment_cache",
+                              help="Directory caching the decoded 8 kHz segments by file hash ('' to disable).")
+    embed_parser.add_argument("--segment-cache-gb", type=float, default=SEGMENT_CACHE_BYTES / 2 ** 30,
+                              help="Size the segment cache is held to during a run, least recently used songs first.")
+    cluster_parser = subparsers.add_parser("cluster", help="Cluster the embeddings of a store with mini-batch k-means, "
+                                                           "store the ids in it and export them to --clusters.")
+    cluster_parser.add_argument("--store", default="song_embeddings.store", help="Embedding store directory to cluster.")
+    cluster_parser.add_argument("--count", type=int, default=CLUSTER_COUNT, help="Number of clusters.")
+    cluster_parser.add_argument("--method", choices=CLUSTER_METHODS, default="kmeans",
+                                help="'knn' smooths the k-means clusters over the --neighbors K nearest-neighbour graph "
+                                     "(found with --neighbor-index).")
+    cluster_parser.add_argument("--batch-rows", type=int, default=CLUSTER_BATCH_ROWS,
+                                help="Songs per mini-batch read from the store.")
+    cluster_parser.add_argument("--epochs", type=int, default=CLUSTER_EPOCHS, help="Passes of mini-batches over the store.")
+    cluster_parser.add_argument("--workers", type=int, default=CLUSTER_WORKERS,
+                                help="Threads assigning songs to clusters in parallel.")
+    for flag, options in shared_options:
+        # Without a default, so values given before the command are kept
+        cluster_parser.add_argument(flag, **{**options, "default": argparse.SUPPRESS})
+    serve_parser = subparsers.add_parser("serve", help="Serve the board in --output, its data and --songs-dir over HTTP.")
+    serve_parser.add_argument("--bind", default="127.0.0.1", help="Address to listen on.")
+    serve_parser.add_argument("--port", type=int, default=8000, help="Port to listen on (0 picks a free one).")
+    args = parser.parse_args()
+    profile = PipelineProfile(args.command or "board")
+
+    if args.command == "convert":
+        meta = convert_json_to_store(args.source, args.store)
+        print(f"Converted {meta['count']} songs from {args.source} into {args.store}")
+        sys.exit(0)
+
+    if args.command == "embed":
+        if not os.path.isdir(args.songs_dir):
+            print(f"Error: '{args.songs_dir}' directory not found.")
+            sys.exit(1)
+        try:
+            model = load_embedding_model(args.model)
+        except (ImportError, OSError) as e:
+            print(f"Error: could not load the model: {e}")
+            sys.exit(1)
+        segment_cache = None
+        if args.segment_cache:
+            segment_cache = SegmentCache(args.segment_cache, int(args.segment_cache_gb * 2 ** 30))
+        meta, failed, segments = embed_song_library(args.songs_dir, scan_song_library(args.songs_dir, args.scan_index),
+                                                    args.store, model, args.batch_size, args.workers, segment_cache,
+                                                    False if args.padded else None)
+        for song_file in failed:
+            print(f"Could not decode {song_file}")
+        print(f"Embedded {meta['count']} songs into {args.store} ({len(failed)} failed)")
+        if segments["padded_segments"]:
+            saved = 1 - segments["segments"] / segments["padded_segments"]
+            print(f"The CNN ran on {segments['segments']} segments instead of {segments['padded_segments']} padded ones "
+                  f"({saved:.0%} saved)")
+        if segment_cache is not None:
+            print(f"Segment cache: {segment_cache.hits} hits, {segment_cache.misses} misses")
+        sys.exit(0)
+
+    if args.command == "cluster":
+        if not is_embedding_store(args.store):
+            print(f"Error: '{args.store}' is not an embedding store (see the convert and embed commands).")
+            sys.exit(1)
+        with profile.stage("load"):
+            song_store = EmbeddingStore.open(args.store)
+        try:
+            with profile.stage("cluster"):
+                labels = cluster_song_store(song_store, args.count, args.method, args.neighbors, args.neighbor_index,
+                                            args.batch_rows, args.epochs, args.workers)
+        except (ImportError, ValueError) as e:
+            print(f"Error: could not cluster the embeddings: {e}")
+            sys.exit(1)
+        with profile.stage("emit"):
+            if args.clusters:
+                write_cluster_csv(args.clusters, song_store.names, labels)
+            write_store_cluster(args.store, labels)
+        print(f"Grouped {len(labels)} songs into {len(np.unique(labels))} clusters in {args.store}"
+              + (f" and {args.clusters}" if args.clusters else ""))
+        if args.profile:
+            profile.info.update(songs=len(labels), dim=song_store.vectors.shape[1], method=args.method)
+            profile.write(args.profile)
+            print(f"Wrote the profile to {args.profile}")
+        sys.exit(0)
+
+    if args.command == "serve":
+        if not os.path.isfile(args.output):
+            print(f"Error: '{args.output}' not found; generate the board first.")
+            sys.exit(1)
+        serve_song_board(args.output, args.songs_dir, args.previews_dir, args.bind, args.port)
+        sys.exit(0)
+
+    if args.command == "previews":
+        if not os.path.isdir(args.songs_dir):
+            print(f"Error: '{args.songs_dir}' directory not found.")
+            sys.exit(1)
+        try:
+            made, skipped, failures = generate_previews(args.songs_dir, scan_song_library(args.songs_dir, args.scan_index),
+                                                        args.previews_dir, args.seconds, args.bitrate, args.workers)
+        except RuntimeError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        for song_file, error in failures.items():
+            print(f"Could not cut a preview of {song_file}: {error}")
+        print(f"Cut {made} preview clips into {args.previews_dir} ({skipped} were up to date)")
+        sys.exit(1 if failures else 0)
+
+    input_path = args.input # Make sure this file or store exists and is correct
+
+    with profile.stage("load"):
+        try:
+            if is_embedding_store(input_path):
+                # Columns are memory-mapped, nothing is read until it is used
+                song_store = EmbeddingStore.open(input_path)
+            else:
+                with open(input_path, 'r') as f:
+                    song_embeddings_data = json.load(f)
+                # Ensure song_embeddings_data is a list of song objects
+                if not isinstance(song_embeddings_data, list):
+                    print(f"Error: {input_path} should contain a JSON list of song objects.")
+                    # Example: song_embeddings_data = [{"song_name": "example.mp3", "x": 0.5, "y": 0.5}]
+                    song_embeddings_data = []
+                song_store = EmbeddingStore.from_records(song_embeddings_data)
+                del song_embeddings_data
+            print(f"Loaded embeddings from {input_path}")
+        except FileNotFoundError:
+            print(f"Error: Embeddings file '{input_path}' not found. Using empty data.")
+            song_store = EmbeddingStore([])
+        except json.JSONDecodeError:
+            print(f"Error: Could not decode JSON from '{input_path}'. Using empty data.")
+            song_store = EmbeddingStore([])
+        except Exception as e:
+            print(f"Failed to load embeddings: {e}. Using empty data.")
+            song_store = EmbeddingStore([])
+
+
+    changed_slots = None
+    # Boards laid out in a state directory are in slot order and keep their similar songs table there too
+    layout_state_dir = None
+    song_embeddings_data = song_store.board_records()
+    needs_layout = len(song_store) > 0 and (args.projection != "auto" or song_store.layout is None)
+    if args.incremental and len(song_store) > 0 and not needs_layout:
+        print(f"Warning: the songs already carry x/y, so --incremental {args.incremental} is ignored "
+              f"(pass --projection to lay them out again).")
+    if needs_layout:
+        with profile.stage("layout"):
+            projection_method = "pca" if args.projection == "auto" else args.projection
+            try:
+                if args.incremental:
+                    song_embeddings_data, changed_slots = layout_song_store_incremental(
+                        song_store, args.incremental, projection_method, args.dims)
+                    layout_state_dir = args.incremental
+                    if changed_slots is not None:
+                        # Changed slots that lost their name are the songs removed since the last run
+                        removed = sum(1 for slot in changed_slots if not song_embeddings_data[slot]["song_name"])
+                        print(f"Placed {len(changed_slots) - removed} new or changed songs into the layout in "
+                              f"{args.incremental} and removed {removed}")
+                    else:
+                        print(f"Projected {len(song_store)} embeddings with {projection_method}")
+                else:
+                    song_embeddings_data = layout_song_store(song_store, projection_method, args.dims)
+                    print(f"Projected {len(song_store)} embeddings with {projection_method}")
+            except (ImportError, ValueError) as e:
+                print(f"Error: could not project embeddings: {e} Using empty data.")
+                song_embeddings_data = []
+                song_store = EmbeddingStore([])
+
+    # Whether the board has a cluster column comes from the store and the CSV, never from the first record
+    has_clusters = song_store.cluster is not None
+    if args.clusters and os.path.isfile(args.clusters):
+        try:
+            with profile.stage("clusters"):
+                song_embeddings_data = apply_song_clusters(song_embeddings_data, read_cluster_csv(args.clusters))
+            has_clusters = True
+            print(f"Loaded clusters from {args.clusters}")
+        except (OSError, ValueError) as e:
+            print(f"Error: could not read the clusters: {e} Keeping the stored ones.")
+
+    song_neighbor_table = None
+    neighbor_rows = None
+    if args.neighbors > 0 and song_store.vectors is not None and args.data_format != "tiles":
+        try:
+            with profile.stage("neighbors"):
+                if layout_state_dir:
+                    song_neighbor_table, neighbor_rows = update_neighbors(layout_state_dir, changed_slots, args.neighbors,
+                                                                          args.neighbor_index)
+                else:
+                    song_neighbor_table = song_store_neighbors(song_store, args.neighbors, args.neighbor_index)
+            if neighbor_rows is not None:
+                print(f"Updated the similar songs of {len(neighbor_rows)} songs")
+            else:
+                print(f"Found the {args.neighbors} most similar songs of each song")
+        except (ImportError, ValueError) as e:
+            print(f"Error: could not build the similar songs index: {e} Continuing without it.")
 
 
     song_files_list = []
-    songs_directory = "songs" # Make sure this directory exists
+    songs_directory = args.songs_dir # Make sure this directory exists
     if os.path.exists(songs_directory) and os.path.isdir(songs_directory):
-        for root, _, files in os.walk(songs_directory):
-            for file in files:
-                if file.endswith((".mp3", ".wav", ".ogg")):
-                    song_files_list.append(file)
+        # Paths relative to the songs directory; unchanged directories are served from the scan index
+        with profile.stage("scan"):
+            song_files_list = scan_song_library(songs_directory, args.scan_index, args.scan_workers)
         if not song_files_list:
             print(f"No audio files found in '{songs_directory}' directory.")
             # song_files_list.append("example.mp3") # For testing if dir is empty
@@ -391,13 +2128,27 @@ if __name__ == "__main__":
         #    song_files_list = [item['song_name'] for item in song_embeddings_data if 'song_name' in item]
 
 
-    # Generate HTML using the loaded (or default empty) data
-    html = generate_interactive_song_board(song_embeddings_data, song_files_list)
-
-    output_html_path = "interactive_song_board.html"
+    # Stream the HTML (and the binary sidecar, if requested) for the loaded (or default empty) data straight to disk
+    output_html_path = args.output
     try:
-        with open(output_html_path, "w", encoding="utf-8") as f:
-            f.write(html)
+        with profile.stage("emit"):
+            write_song_board(output_html_path, song_embeddings_data, song_files_list, args.data_format,
+                             renderer=args.renderer, changed_slots=changed_slots, songs_dir=songs_directory,
+                             neighbors=song_neighbor_table, previews_dir=args.previews_dir, has_clusters=has_clusters,
+                             neighbor_rows=neighbor_rows)
         print(f"Generated {output_html_path}")
     except Exception as e:
-        print(f"Error writing HTML file: {e}")
\ No newline at end of file
+        print(f"Error writing HTML file: {e}")
+        sys.exit(1)
+
+    if args.profile:
+        # Output bytes per song track the page's load and parse cost without running a browser
+        output_bytes = board_output_bytes(output_html_path, args.data_format)
+        songs_count = max(len(song_store), 1)
+        profile.info.update(songs=len(song_store), dim=song_store.vectors.shape[1] if song_store.vectors is not None else 0,
+                            song_files=len(song_files_list), data_format=args.data_format, renderer=args.renderer,
+                            output=dict(output_bytes,
+                                        bytes_per_song=(output_bytes["html_bytes"] + output_bytes["data_bytes"]) / songs_count,
+                                        initial_bytes_per_song=output_bytes["initial_bytes"] / songs_count))
+        profile.write(args.profile)
+        print(f"Wrote the profile to {args.profile}")
\ No newline at end of file
@@ -0,0 +1,158 @@
+import csv
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from neighbor_index import NEIGHBOR_BLOCK_ROWS, nearest_centroids, song_neighbors, unit_rows
+
+# "kmeans" assigns every song to its nearest mini-batch k-means centroid; "knn" then smooths those labels over the
+# songs' nearest-neighbour graph (see neighbor_index.py), so clusters follow the graph rather than straight centroid
+# boundaries
+CLUSTER_METHODS = ("kmeans", "knn")
+CLUSTER_COUNT = 20
+# Cluster ids are stored as uint16; this one marks songs without a cluster
+UNASSIGNED_CLUSTER = 0xFFFF
+
+# Mini-batch k-means reads the vectors in blocks of this many rows, CLUSTER_EPOCHS times over
+CLUSTER_BATCH_ROWS = 8192
+CLUSTER_EPOCHS = 3
+# The initial centroids are picked by k-means++ from a sample of this many songs
+CLUSTER_SEED_SAMPLE = 65536
+# Threads assigning songs to centroids; numpy releases the GIL inside the block products
+CLUSTER_WORKERS = os.cpu_count() or 4
+# Label propagation rounds of the "knn" method, and the vote table size (rows x clusters) counted at once
+KNN_ROUNDS = 5
+_VOTE_TABLE_CELLS = 1 << 22
+
+# df_clusters.csv columns; reading also accepts the other names below
+CLUSTER_CSV_COLUMNS = ("song_name", "cluster")
+_CSV_NAME_COLUMNS = ("song_name", "song", "file_name", "filename")
+_CSV_CLUSTER_COLUMNS = ("cluster", "cluster_id", "label")
+
+
+def _cluster_sums(block, assignment, n_clusters):
+    # Per-cluster sum and count of the block's rows
+    counts = np.bincount(assignment, minlength=n_clusters)
+    used = counts > 0
+    sums = np.zeros((n_clusters, block.shape[1]), dtype=np.float32)
+    order = np.argsort(assignment, kind="stable")
+    sums[used] = np.add.reduceat(block[order], np.concatenate([[0], np.cumsum(counts)[:-1]])[used], axis=0)
+    return sums, counts
+
+
+def _kmeans_plus_plus(sample, n_clusters, rng):
+    # k-means++ seeding over unit rows: each further centroid is drawn with probability proportional to its cosine
+    # distance from the nearest centroid so far (half the squared Euclidean distance between unit vectors)
+    chosen = [rng.integers(len(sample))]
+    distance = 1 - sample @ sample[chosen[0]]
+    for _ in range(1, n_clusters):
+        weights = np.maximum(distance, 0).astype(np.float64)
+        total = weights.sum()
+        chosen.append(rng.choice(len(sample), p=weights / total) if total > 0 else rng.integers(len(sample)))
+        distance = np.minimum(distance, 1 - sample @ sample[chosen[-1]])
+    return sample[chosen]
+
+
+def minibatch_kmeans(vectors, n_clusters=CLUSTER_COUNT, batch_rows=CLUSTER_BATCH_ROWS, epochs=CLUSTER_EPOCHS,
+                     random_state=0):
+    # Spherical mini-batch k-means over the unit-normalised rows, returning (n_clusters, dim) unit centroids. Blocks
+    # are contiguous, so memory-mapped vectors are read sequentially, and visited in a new random order every epoch.
+    # Each centroid moves towards the mean of its songs in a block by (songs in the block) / (songs so far), so it
+    # follows the running mean of everything assigned to it. Centroids that never win a song are reseeded.
+    if len(vectors) == 0:
+        raise ValueError("There are no embeddings to cluster.")
+    rng = np.random.default_rng(random_state)
+    n_clusters = min(n_clusters, len(vectors))
+    sample = np.sort(rng.choice(len(vectors), min(len(vectors), max(CLUSTER_SEED_SAMPLE, n_clusters)), replace=False))
+    centroids = _kmeans_plus_plus(unit_rows(vectors[sample]), n_clusters, rng)
+    counts = np.zeros(n_clusters, dtype=np.int64)
+    for _ in range(epochs):
+        for start in rng.permutation(np.arange(0, len(vectors), batch_rows)):
+            block = unit_rows(vectors[start:start + batch_rows])
+            sums, block_counts = _cluster_sums(block, np.argmax(block @ centroids.T, axis=1), n_clusters)
+            used = block_counts > 0
+            counts[used] += block_counts[used]
+            step = (block_counts[used] / counts[used])[:, None]
+            centroids[used] = unit_rows((1 - step) * centroids[used] + step * sums[used] / block_counts[used][:, None])
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = unit_rows(vectors[np.sort(rng.choice(len(vectors), len(empty), replace=False))])
+    return centroids
+
+
+def assign_clusters(vectors, centroids, workers=CLUSTER_WORKERS):
+    # Nearest centroid of every song, as uint16 cluster ids
+    def assign(start):
+        return nearest_centroids(vectors[start:start + NEIGHBOR_BLOCK_ROWS], centroids, 1)[:, 0]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        blocks = list(pool.map(assign, range(0, len(vectors), NEIGHBOR_BLOCK_ROWS)))
+    return np.concatenate(blocks).astype(np.uint16) if blocks else np.zeros(0, dtype=np.uint16)
+
+
+def propagate_labels(labels, neighbors, n_clusters, rounds=KNN_ROUNDS):
+    # Label propagation over a (songs, k) neighbour table padded with -1: every round each song takes the label most
+    # common among its neighbours, its own label counting one and a half so that ties keep it. Stops early once no
+    # label changes.
+    labels = labels.astype(np.int64)
+    block_rows = max(1, _VOTE_TABLE_CELLS // n_clusters)
+    for _ in range(rounds):
+        updated = np.empty_like(labels)
+        for start in range(0, len(labels), block_rows):
+            table = neighbors[start:start + block_rows]
+            rows = np.arange(len(table))
+            valid = table >= 0
+            votes = np.bincount((rows[:, None] * n_clusters + labels[np.where(valid, table, 0)])[valid],
+                                minlength=len(table) * n_clusters).reshape(len(table), n_clusters).astype(np.float32)
+            votes[rows, labels[start:start + len(table)]] += 1.5
+            updated[start:start + len(table)] = votes.argmax(axis=1)
+        changed = np.any(updated != labels)
+        labels = updated
+        if not changed:
+            break
+    return labels.astype(np.uint16)
+
+
+def cluster_song_store(store, n_clusters=CLUSTER_COUNT, method="kmeans", k=10, backend="auto",
+                       batch_rows=CLUSTER_BATCH_ROWS, epochs=CLUSTER_EPOCHS, workers=CLUSTER_WORKERS, random_state=0):
+    # Cluster id of every song in the store, from its raw embedding vectors. The "knn" method builds a k-nearest
+    # neighbour table with the given backend (see neighbor_index.song_neighbors) to propagate the labels over.
+    if store.vectors is None:
+        raise ValueError("The songs have no 'embedding' vectors to cluster.")
+    if method not in CLUSTER_METHODS:
+        raise ValueError(f"Unknown clustering method: {method!r}")
+    if not 1 <= n_clusters < UNASSIGNED_CLUSTER:
+        raise ValueError(f"The number of clusters must be between 1 and {UNASSIGNED_CLUSTER - 1}.")
+    centroids = minibatch_kmeans(store.vectors, n_clusters, batch_rows, epochs, random_state)
+    labels = assign_clusters(store.vectors, centroids, workers)
+    if method == "knn":
+        labels = propagate_labels(labels, song_neighbors(store.vectors, k, backend), len(centroids))
+    return labels
+
+
+def write_cluster_csv(path, names, labels):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(CLUSTER_CSV_COLUMNS)
+        writer.writerows(zip(names, labels.tolist()))
+
+
+def read_cluster_csv(path):
+    # {song name: cluster id} from df_clusters.csv, as written by the notebook or write_cluster_csv. Songs without
+    # a cluster, or with an id that does not fit the uint16 column (such as -1 for noise), are left out.
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        fields = reader.fieldnames or []
+        name_column = next((c for c in _CSV_NAME_COLUMNS if c in fields), None)
+        cluster_column = next((c for c in _CSV_CLUSTER_COLUMNS if c in fields), None)
+        if name_column is None or cluster_column is None:
+            raise ValueError(f"{path} needs a song_name and a cluster column.")
+        clusters = {}
+        for row in reader:
+            value = row[cluster_column]
+            if value:
+                cluster = int(float(value))
+                if 0 <= cluster < UNASSIGNED_CLUSTER:
+                    clusters[row[name_column]] = cluster
+        return clusters
@@ -0,0 +1,224 @@
+import functools
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from embedding_store import STORE_META, write_store_meta, write_store_names
+
+# Audio hierarchy the model was trained on (see the README): 8 kHz mono, 3.75 s segments of 30,000 samples and
+# 100 segments per song, cut or padded with silence
+SAMPLE_RATE = 8000
+SEGMENT_SAMPLES = 30000
+SEGMENTS_PER_SONG = 100
+# Songs per model call, i.e. EMBED_BATCH_SONGS * SEGMENTS_PER_SONG segments through the CNN at once. Packed batches
+# (see _embed_packed) hold as many songs as fit into the same number of real segments.
+EMBED_BATCH_SONGS = 4
+# Decoding runs in worker processes next to the model, which already spreads each batch over the cores
+DECODE_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+# Decoded songs waiting for the model, per worker; bounds memory when decoding outpaces inference (12 MB per song)
+DECODE_QUEUE_PER_WORKER = 2
+# Written next to the vectors while a store is being embedded, removed once it is complete
+EMBED_PROGRESS = "embed_progress.json"
+# Segment caches (see segment_cache.py) keep samples as int16 at this scale
+INT16_SCALE = 32767
+
+
+def decode_samples(path):
+    # Flat float32 samples at SAMPLE_RATE, or None when the file cannot be decoded. Decoding stops once the segments
+    # are full, so long songs cost no more than 6.25 minutes of audio.
+    import librosa
+    try:
+        samples, _ = librosa.load(path, sr=SAMPLE_RATE, mono=True,
+                                  duration=SEGMENTS_PER_SONG * SEGMENT_SAMPLES / SAMPLE_RATE)
+    except Exception:  # librosa passes on whatever its audio backend raises
+        return None
+    return samples[:SEGMENTS_PER_SONG * SEGMENT_SAMPLES]
+
+
+def song_segments(samples, scale=1.0):
+    # The real segments of one song: samples (flat, or rows of SEGMENT_SAMPLES) times scale as (segments, 1,
+    # SEGMENT_SAMPLES) float32, between 1 and SEGMENTS_PER_SONG segments with the last one padded with silence
+    flat = np.asarray(samples).reshape(-1)[:SEGMENTS_PER_SONG * SEGMENT_SAMPLES]
+    segments = np.zeros(max(1, -(-len(flat) // SEGMENT_SAMPLES)) * SEGMENT_SAMPLES, dtype=np.float32)
+    segments[:len(flat)] = flat
+    if scale != 1.0:
+        segments *= scale
+    return segments.reshape(-1, 1, SEGMENT_SAMPLES)
+
+
+def pad_segments(segments):
+    # Pads a song's segments with silent ones to the (SEGMENTS_PER_SONG, 1, SEGMENT_SAMPLES) input of a padded model
+    padded = np.zeros((SEGMENTS_PER_SONG, 1, SEGMENT_SAMPLES), dtype=np.float32)
+    padded[:len(segments)] = segments
+    return padded
+
+
+def decode_song(path):
+    samples = decode_samples(path)
+    return None if samples is None else song_segments(samples)
+
+
+def iter_decoded_songs(paths, workers=DECODE_WORKERS, cache=None):
+    # Yields the segments of every path in order (None for files that cannot be decoded), decoding ahead in a
+    # process pool. Workers are spawned rather than forked, since forking a process that already runs PyTorch's
+    # thread pools can deadlock. With a SegmentCache, workers only hash files that are already cached, store the
+    # ones they decode, and hand back cache keys instead of arrays; the segments are then copied out of the cache.
+    # The cache is held to its size cap as it fills, sparing every song used since the oldest queued song was
+    # submitted, since a worker may already have found or stored it.
+    paths = iter(paths)
+    task = decode_song if cache is None else functools.partial(cache.load_or_decode, decode=decode_samples)
+    context = multiprocessing.get_context("spawn")
+
+    def submit(pool, path):
+        return time.time(), pool.submit(task, path)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        pending = deque(submit(pool, path) for path in itertools.islice(paths, workers * DECODE_QUEUE_PER_WORKER))
+        while pending:
+            result = pending.popleft()[1].result()
+            pending.extend(submit(pool, path) for path in itertools.islice(paths, 1))
+            if cache is None:
+                yield result
+                continue
+            key, hit = result
+            segments = None if key is None else song_segments(cache.open(key), 1.0 / INT16_SCALE)
+            cache.record(hit, key, pending[0][0] if pending else None)
+            yield segments
+
+
+def is_packable(model):
+    # Models that expose their two stages can skip the silent padding segments:
+    #   embed_segments(segments)                  (n, 1, SEGMENT_SAMPLES) -> (n, features), the CNN
+    #   encode_sequence(features, padding_mask)   (songs, length, features) and a (songs, length) bool mask that is
+    #                                             True at padding positions -> (songs, dim), the transformer
+    return hasattr(model, "embed_segments") and hasattr(model, "encode_sequence")
+
+
+def load_embedding_model(path):
+    # A TorchScript file (torch.jit.save) or a whole pickled nn.Module (torch.save(model)), loaded onto the CPU. The
+    # model maps a (songs, SEGMENTS_PER_SONG, 1, SEGMENT_SAMPLES) batch to (songs, dim) song embeddings, and may
+    # expose its stages for packed inference (see is_packable). librosa is checked here too, since decoding only
+    # imports it in the worker processes, where a missing module would surface as a traceback per song.
+    try:
+        import librosa  # noqa: F401
+        import torch
+    except ImportError as e:
+        raise ImportError(f"Embedding songs needs PyTorch and librosa, {e.name} is missing "
+                          f"(pip install torch librosa).") from None
+    try:
+        model = torch.jit.load(path, map_location="cpu").eval()
+    except RuntimeError:
+        return torch.load(path, map_location="cpu", weights_only=False).eval()
+    # Freezing folds the weights into the graph and fuses conv/batch-norm pairs, which pays off on CPU
+    try:
+        return torch.jit.optimize_for_inference(model, ["embed_segments", "encode_sequence"] if is_packable(model) else None)
+    except RuntimeError:
+        return model
+
+
+def _embed_padded(model, batch):
+    import torch
+    with torch.inference_mode():
+        return model(torch.from_numpy(np.stack([pad_segments(segments) for segments in batch]))).float().numpy()
+
+
+def _embed_packed(model, batch):
+    # The CNN runs once over the real segments of every song in the batch, concatenated. The transformer gets them
+    # back as a (songs, longest, features) sequence zero-padded to the longest song, with a mask over the padding.
+    import torch
+    lengths = torch.tensor([len(segments) for segments in batch])
+    with torch.inference_mode():
+        features = model.embed_segments(torch.from_numpy(np.concatenate(batch)))
+        sequences = torch.nn.utils.rnn.pad_sequence(features.split(lengths.tolist()), batch_first=True)
+        padding_mask = torch.arange(sequences.shape[1])[None, :] >= lengths[:, None]
+        return model.encode_sequence(sequences, padding_mask).float().numpy()
+
+
+def _read_progress(progress_path, songs_hash):
+    if not os.path.exists(progress_path):
+        return None
+    with open(progress_path, encoding="utf-8") as f:
+        progress = json.load(f)
+    return progress if progress["songs"] == songs_hash else None
+
+
+def _write_progress(progress_path, progress):
+    temporary_path = progress_path + ".tmp"
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        json.dump(progress, f)
+    os.replace(temporary_path, progress_path)
+
+
+def _write_batch(vectors, segments, songs, vectors_file, progress):
+    vectors.astype("<f4").tofile(vectors_file)
+    vectors_file.flush()
+    progress["rows"] += len(vectors)
+    progress["dim"] = int(vectors.shape[1])
+    progress["segments"] += segments
+    progress["padded_segments"] += songs * SEGMENTS_PER_SONG
+
+
+def embed_song_library(songs_dir, song_files, store_path, model, batch_size=EMBED_BATCH_SONGS, workers=DECODE_WORKERS,
+                       cache=None, packed=None):
+    # Embeds the songs (relative paths, as returned by scan_song_library) into an embedding store named after those
+    # paths. Vectors are appended to vectors.f32 batch by batch and the progress file records how far the run got,
+    # so rerunning after a crash resumes at the last finished batch. meta.json is only written at the end. Songs
+    # that cannot be decoded are left out. With a SegmentCache, decoded songs are reused across runs and the cache is
+    # held to its size cap while the run fills it, then trimmed to it exactly at the end. Packed inference (default:
+    # whenever the model supports it) batches up to batch_size * SEGMENTS_PER_SONG real segments instead of
+    # batch_size padded songs.
+    # Returns the store meta, the list of failed songs and the segment counts of the run: "segments" that went
+    # through the CNN and "padded_segments" that a padded run would have needed.
+    os.makedirs(store_path, exist_ok=True)
+    progress_path = os.path.join(store_path, EMBED_PROGRESS)
+    songs_hash = hashlib.blake2b("\n".join(song_files).encode("utf-8"), digest_size=8).hexdigest()
+    progress = _read_progress(progress_path, songs_hash)
+    if progress is None:
+        progress = {"songs": songs_hash, "done": 0, "rows": 0, "dim": 0, "failed": [], "segments": 0, "padded_segments": 0}
+        # A finished store at this path is being replaced
+        if os.path.exists(os.path.join(store_path, STORE_META)):
+            os.remove(os.path.join(store_path, STORE_META))
+
+    packed = is_packable(model) if packed is None else packed
+    embed_batch = _embed_packed if packed else _embed_padded
+    paths = [os.path.join(songs_dir, *song_file.split("/")) for song_file in song_files[progress["done"]:]]
+    with open(os.path.join(store_path, "vectors.f32"), "r+b" if progress["rows"] else "wb") as vectors_file:
+        # Drops whatever a crashed run wrote after its last checkpoint
+        vectors_file.truncate(progress["rows"] * progress["dim"] * 4)
+        vectors_file.seek(0, os.SEEK_END)
+        batch = []
+        batch_segments = 0
+        for song_file, segments in zip(song_files[progress["done"]:], iter_decoded_songs(paths, workers, cache)):
+            # CNN passes this song costs: its real segments when packed, always SEGMENTS_PER_SONG when padded
+            cost = 0 if segments is None else len(segments) if packed else SEGMENTS_PER_SONG
+            if batch and batch_segments + cost > batch_size * SEGMENTS_PER_SONG:
+                _write_batch(embed_batch(model, batch), batch_segments, len(batch), vectors_file, progress)
+                _write_progress(progress_path, progress)
+                batch = []
+                batch_segments = 0
+            if segments is None:
+                progress["failed"].append(song_file)
+            else:
+                batch.append(segments)
+                batch_segments += cost
+            progress["done"] += 1
+        if batch:
+            _write_batch(embed_batch(model, batch), batch_segments, len(batch), vectors_file, progress)
+        _write_progress(progress_path, progress)
+
+    failed = set(progress["failed"])
+    write_store_names(store_path, (song_file for song_file in song_files if song_file not in failed))
+    meta = {"count": progress["rows"], "dim": progress["dim"], "layout_dims": 0, "cluster": False}
+    write_store_meta(store_path, meta)
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+    if cache is not None:
+        cache.evict()
+    return meta, progress["failed"], {key: progress[key] for key in ("segments", "padded_segments")}
@@ -0,0 +1,63 @@
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# Hover previews are short mono MP3 clips at a low bitrate, cut from the middle of a song, so they start playing
+# after a few kilobytes instead of a multi-MB full track
+PREVIEW_SECONDS = 20
+PREVIEW_START_SECONDS = 30
+PREVIEW_BITRATE = "48k"
+PREVIEW_SUFFIX = ".mp3"
+# ffmpeg runs in its own process, so one thread per core keeps every core busy
+PREVIEW_WORKERS = os.cpu_count() or 4
+
+
+def preview_path(previews_dir, song_file):
+    # "album/song.wav" -> previews_dir/album/song.wav.mp3, so songs that only differ in extension keep separate clips
+    return os.path.join(previews_dir, *song_file.split("/")) + PREVIEW_SUFFIX
+
+
+def _duration(path):
+    try:
+        result = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+                                capture_output=True, text=True)
+        return float(result.stdout.strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _cut_preview(source, target, seconds, bitrate):
+    # Returns None on success or ffmpeg's error message. Short songs are clipped from the start instead.
+    duration = _duration(source)
+    start = 0 if duration is None else min(PREVIEW_START_SECONDS, max(duration - seconds, 0))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temporary_path = target + ".tmp"
+    result = subprocess.run(["ffmpeg", "-nostdin", "-v", "error", "-y", "-ss", f"{start:.2f}", "-t", str(seconds),
+                             "-i", source, "-vn", "-ac", "1", "-b:a", bitrate, "-f", "mp3", temporary_path],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        return result.stderr.strip() or f"ffmpeg exited with status {result.returncode}"
+    os.replace(temporary_path, target)
+    return None
+
+
+def generate_previews(songs_dir, song_files, previews_dir, seconds=PREVIEW_SECONDS, bitrate=PREVIEW_BITRATE,
+                      workers=PREVIEW_WORKERS):
+    # Cuts a preview of every song (relative paths, as returned by scan_song_library) whose clip is missing or older
+    # than the song. Returns the number of clips made, the number that were up to date, and {song: error}.
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("Preview clips need ffmpeg on the PATH.")
+    pending = []
+    for song_file in song_files:
+        source = os.path.join(songs_dir, *song_file.split("/"))
+        target = preview_path(previews_dir, song_file)
+        if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source):
+            pending.append((song_file, source, target))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        errors = list(pool.map(lambda job: _cut_preview(job[1], job[2], seconds, bitrate), pending))
+    failures = {song_file: error for (song_file, _, _), error in zip(pending, errors) if error}
+    return len(pending) - len(failures), len(song_files) - len(pending), failures
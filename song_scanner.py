@@ -0,0 +1,76 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".ogg")
+
+# Directories are listed by a thread pool one tree level at a time; on network mounts the time goes into waiting
+# on the server, so more threads than cores pay off
+SCAN_WORKERS = 32
+
+
+def _load_scan_index(index_path, root):
+    if not index_path or not os.path.exists(index_path):
+        return {}
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return index["dirs"] if index.get("root") == os.path.abspath(root) else {}
+
+
+def _save_scan_index(index_path, root, dirs):
+    temporary_path = index_path + ".tmp"
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        json.dump({"root": os.path.abspath(root), "dirs": dirs}, f)
+    os.replace(temporary_path, index_path)
+
+
+def _scan_directory(root, relative_dir, cached):
+    # A directory whose mtime did not change has the same entries as last time, so only the directory itself is
+    # stat-ed and the cached listing is reused
+    path = os.path.join(root, relative_dir) if relative_dir else root
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        # Removed (or unreadable) since its parent was listed
+        return {"mtime_ns": None, "files": {}, "subdirs": []}, True
+    if cached is not None and cached["mtime_ns"] == mtime_ns:
+        return cached, False
+
+    files = {}
+    subdirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+            elif entry.name.lower().endswith(AUDIO_EXTENSIONS) and entry.is_file():
+                stat = entry.stat()
+                files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+    return {"mtime_ns": mtime_ns, "files": files, "subdirs": sorted(subdirs)}, True
+
+
+def scan_song_library(root, index_path=None, workers=SCAN_WORKERS):
+    # Returns the audio files under root as sorted, "/"-separated paths relative to root, so songs with the same
+    # file name in different folders stay apart. With index_path set, every directory's listing (file sizes and
+    # mtimes included) is kept there keyed by its relative path, and reruns only list directories whose mtime
+    # changed. Files rewritten in place do not change their directory's mtime, so their cached size/mtime can lag.
+    previous = _load_scan_index(index_path, root)
+    dirs = {}
+    changed = False
+    frontier = [""]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while frontier:
+            listings = pool.map(lambda d: _scan_directory(root, d, previous.get(d)), frontier)
+            next_frontier = []
+            for relative_dir, (listing, rescanned) in zip(frontier, listings):
+                dirs[relative_dir] = listing
+                changed = changed or rescanned
+                next_frontier.extend(f"{relative_dir}/{name}" if relative_dir else name for name in listing["subdirs"])
+            frontier = next_frontier
+
+    if index_path and (changed or dirs.keys() != previous.keys()):
+        _save_scan_index(index_path, root, dirs)
+    return sorted(f"{relative_dir}/{name}" if relative_dir else name
+                  for relative_dir, listing in dirs.items() for name in listing["files"])
@@ -0,0 +1,160 @@
+import os
+import shutil
+
+import numpy as np
+
+# Zoom-level tile pyramid over the projected layout, for boards too large to ship to the page at once. Level z splits
+# the layout extent into 2**z x 2**z tiles. Tiles of the levels below the point level aggregate their songs into a
+# TILE_BINS x TILE_BINS grid of song counts and the most common cluster per cell; tiles of the point level hold the
+# songs themselves, at most TILE_SONGS per tile where TILE_MAX_LEVEL allows. The page fetches the tiles of one level that intersect the
+# viewport, so what it loads follows the viewport rather than the catalogue.
+TILE_SONGS = 4096
+TILE_BINS = 32
+TILE_MAX_LEVEL = 8
+# The page shows level floor(log2(zoom)) + TILE_BASE_LEVEL, so two to four tiles span the board at any zoom
+TILE_BASE_LEVEL = 1
+TILES_DIR = "tiles"
+# One byte per tile of every level, level after level, 1 where the tile has songs; the page skips empty tiles
+TILE_OCCUPANCY_FILE = "occupancy.u8"
+
+_UNASSIGNED_CLUSTER = 0xFFFF
+
+
+def point_level(xs, ys, extent, tile_songs=TILE_SONGS):
+    # Shallowest level whose busiest tile holds at most tile_songs songs. Layouts are far denser in the middle than
+    # at the edges, so this goes deeper than the average tile size alone would.
+    level = 0
+    while level < TILE_MAX_LEVEL and len(xs) > tile_songs:
+        gx, gy = _grid_coordinates(xs, ys, extent, 1 << level)
+        if np.bincount(gy * (1 << level) + gx).max() <= tile_songs:
+            break
+        level += 1
+    return level
+
+
+def tile_path(tiles_dir, level, x, y):
+    return os.path.join(tiles_dir, str(level), f"{x}_{y}.bin")
+
+
+def _level_offset(level):
+    # Position of the level's first tile in the occupancy file
+    return (4 ** level - 1) // 3
+
+
+def _grid_coordinates(xs, ys, extent, size):
+    # Integer cell of every song on a size x size grid over the extent
+    x0, x1, y0, y1 = extent
+    gx = np.clip(((xs - x0) / max(x1 - x0, 1e-12) * size).astype(np.int64), 0, size - 1)
+    gy = np.clip(((ys - y0) / max(y1 - y0, 1e-12) * size).astype(np.int64), 0, size - 1)
+    return gx, gy
+
+
+def _write_aggregate_level(tiles_dir, level, gx, gy, clusters, occupancy, bins):
+    # Writes one aggregate level and returns its largest cell count. Cells are keyed tile by tile, so a single sort
+    # groups every tile's cells together, and only cells with songs are ever materialised.
+    cells_per_tile = bins * bins
+    tiles_across = 1 << level
+    tile = (gy // bins) * tiles_across + gx // bins
+    keys = tile * cells_per_tile + (gy % bins) * bins + gx % bins
+    pairs, pair_counts = np.unique(keys << 16 | clusters, return_counts=True)
+    pair_keys = pairs >> 16
+    # Per cell, the cluster with the most songs (ties go to the lower id) and the total count
+    order = np.lexsort((-pair_counts, pair_keys))
+    first = np.concatenate([[True], pair_keys[order][1:] != pair_keys[order][:-1]])
+    cell_keys = pair_keys[order][first]
+    dominant = (pairs & 0xFFFF)[order][first]
+    cell_counts = np.add.reduceat(pair_counts, np.flatnonzero(np.concatenate([[True], pair_keys[1:] != pair_keys[:-1]])))
+
+    os.makedirs(os.path.join(tiles_dir, str(level)), exist_ok=True)
+    cell_tiles = cell_keys // cells_per_tile
+    boundaries = np.flatnonzero(np.concatenate([[True], cell_tiles[1:] != cell_tiles[:-1], [True]]))
+    for start, stop in zip(boundaries[:-1], boundaries[1:]):
+        t = int(cell_tiles[start])
+        counts = np.zeros(cells_per_tile, dtype="<u4")
+        tile_clusters = np.full(cells_per_tile, _UNASSIGNED_CLUSTER, dtype="<u2")
+        counts[cell_keys[start:stop] % cells_per_tile] = cell_counts[start:stop]
+        tile_clusters[cell_keys[start:stop] % cells_per_tile] = dominant[start:stop]
+        with open(tile_path(tiles_dir, level, t % tiles_across, t // tiles_across), "wb") as f:
+            f.write(counts.tobytes())
+            f.write(tile_clusters.tobytes())
+        occupancy[_level_offset(level) + t] = 1
+    return int(cell_counts.max())
+
+
+def _aligned(data):
+    # Pads a section to a multiple of 4 bytes, so the page can view every section as a typed array in place
+    return data + b"\0" * (-len(data) % 4)
+
+
+def _write_point_level(tiles_dir, level, rows, gx, gy, xs, ys, clusters, names, song_paths, occupancy):
+    # Point tile layout, little-endian and 4-byte aligned: uint32 count, uint32 song ids, float32 x, float32 y,
+    # uint16 clusters, then uint32 offsets (2 * count + 1) into a UTF-8 string table holding the songs' names
+    # followed by their file paths ("" when the song has no file)
+    tiles_across = 1 << level
+    tile = gy * tiles_across + gx
+    order = np.argsort(tile, kind="stable")
+    boundaries = np.flatnonzero(np.concatenate([[True], tile[order][1:] != tile[order][:-1], [True]]))
+    os.makedirs(os.path.join(tiles_dir, str(level)), exist_ok=True)
+    for start, stop in zip(boundaries[:-1], boundaries[1:]):
+        members = order[start:stop]
+        t = int(tile[members[0]])
+        ids = rows[members]
+        tile_names = [names[i] for i in ids.tolist()]
+        strings = [name.encode("utf-8") for name in tile_names] + [song_paths.get(name, "").encode("utf-8")
+                                                                   for name in tile_names]
+        offsets = np.concatenate([[0], np.cumsum([len(s) for s in strings])])
+        with open(tile_path(tiles_dir, level, t % tiles_across, t // tiles_across), "wb") as f:
+            f.write(np.asarray([len(members)], dtype="<u4").tobytes())
+            f.write(ids.astype("<u4").tobytes())
+            f.write(xs[members].astype("<f4").tobytes())
+            f.write(ys[members].astype("<f4").tobytes())
+            f.write(_aligned(clusters[members].astype("<u2").tobytes()))
+            f.write(offsets.astype("<u4").tobytes())
+            f.write(b"".join(strings))
+        occupancy[_level_offset(level) + t] = 1
+
+
+def write_tile_pyramid(data_dir, extent, xs, ys, clusters, names, song_paths, tile_songs=TILE_SONGS, bins=TILE_BINS):
+    # Writes the pyramid into data_dir/TILES_DIR, replacing any previous one, and returns its manifest entry. xs, ys
+    # and clusters are per-song arrays (clusters may be None) and names a sequence indexed the same way; song_paths
+    # maps a name to its file relative to the songs directory. Songs with non-finite coordinates are left out.
+    tiles_dir = os.path.join(data_dir, TILES_DIR)
+    if os.path.isdir(tiles_dir):
+        shutil.rmtree(tiles_dir)
+    os.makedirs(tiles_dir)
+    xs = np.asarray(xs, dtype=np.float32)
+    ys = np.asarray(ys, dtype=np.float32)
+    rows = np.flatnonzero(np.isfinite(xs) & np.isfinite(ys))
+    xs, ys = xs[rows], ys[rows]
+    if clusters is None:
+        clusters = np.full(len(rows), _UNASSIGNED_CLUSTER, dtype=np.int64)
+    else:
+        clusters = np.asarray(clusters, dtype=np.int64)[rows]
+
+    levels = point_level(xs, ys, extent, tile_songs)
+    occupancy = np.zeros(_level_offset(levels + 1), dtype=np.uint8)
+    max_counts = []
+    if len(rows):
+        for level in range(levels):
+            gx, gy = _grid_coordinates(xs, ys, extent, (1 << level) * bins)
+            max_counts.append(_write_aggregate_level(tiles_dir, level, gx, gy, clusters, occupancy, bins))
+        gx, gy = _grid_coordinates(xs, ys, extent, 1 << levels)
+        _write_point_level(tiles_dir, levels, rows, gx, gy, xs, ys, clusters, names, song_paths, occupancy)
+    occupancy.tofile(os.path.join(tiles_dir, TILE_OCCUPANCY_FILE))
+    return {
+        "dir": TILES_DIR,
+        "occupancy": TILES_DIR + "/" + TILE_OCCUPANCY_FILE,
+        "extent": [float(v) for v in extent],
+        "point_level": levels,
+        "base_level": TILE_BASE_LEVEL,
+        "bins": bins,
+        "max_counts": max_counts,
+    }
+
+
+def initial_tile_bytes(data_dir, tiles):
+    # What a tiled page fetches before its first frame, given the pyramid's manifest entry: the occupancy bitmap and
+    # the tiles of the level shown unzoomed
+    level_dir = os.path.join(data_dir, tiles["dir"], str(min(tiles["base_level"], tiles["point_level"])))
+    level_bytes = sum(entry.stat().st_size for entry in os.scandir(level_dir)) if os.path.isdir(level_dir) else 0
+    return os.path.getsize(os.path.join(data_dir, tiles["occupancy"])) + level_bytes